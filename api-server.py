@@ -0,0 +1,24 @@
+#! /usr/bin/env python3
+
+import logging
+
+from ws.db.api_server import APIServer
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    import ws.config
+
+    argparser = ws.config.getArgParser(description="Serve a read-only MediaWiki API from the local SQL database")
+    APIServer.set_argparser(argparser)
+    args = ws.config.parse_args(argparser)
+
+    app = APIServer.from_argparser(args)
+    server = app.make_server(args.api_server_host, args.api_server_port)
+    logger.info("Serving the API at http://{}:{}/api.php".format(args.api_server_host, args.api_server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -693,8 +693,20 @@ if __name__ == "__main__":
             help="synchronize the SQL database with the remote wiki API (default: %(default)s)")
     argparser.add_argument("--no-sync", dest="sync", action="store_false",
             help="opposite of --sync")
+    argparser.add_argument("--sync-concurrency", type=int, default=4,
+            help="number of tables synchronized concurrently (default: %(default)s)")
+    argparser.add_argument("--import-concurrency", type=int, default=1,
+            help="number of parallel workers for the initial import of revisions and logs (default: %(default)s)")
+    argparser.add_argument("--sync-checkpoint-rows", metavar="N", type=int, default=100000,
+            help="commit the initial import of each table with a checkpoint after N entries (default: %(default)s)")
+    argparser.add_argument("--sync-checkpoint-interval", metavar="SECONDS", type=float, default=600,
+            help="commit the initial import of each table with a checkpoint after the given time (default: %(default)s)")
     argparser.add_argument("--content-sync-mode", choices=["latest", "all"], default="latest",
             help="mode of revisions content synchronization")
+    argparser.add_argument("--content-sync-concurrency", type=int, default=1,
+            help="number of concurrent API queries for revisions content synchronization (default: %(default)s)")
+    argparser.add_argument("--content-sync-priority-namespaces", metavar="NS", type=int, nargs="*", default=[],
+            help="numbers of namespaces whose content is synchronized first, e.g. 10 828 for templates and modules")
     argparser.add_argument("--parser-cache", dest="parser_cache", action="store_true", default=False,
             help="update parser cache (default: %(default)s)")
     argparser.add_argument("--no-parser-cache", dest="parser_cache", action="store_false",
@@ -708,8 +720,11 @@ if __name__ == "__main__":
     if args.sync:
         require_login(api)
 
-        db.sync_with_api(api)
-        db.sync_revisions_content(api, mode=args.content_sync_mode)
+        db.checkpoint_rows = args.sync_checkpoint_rows
+        db.checkpoint_interval = args.sync_checkpoint_interval
+        db.sync_with_api(api, concurrency=args.sync_concurrency, import_concurrency=args.import_concurrency)
+        db.sync_revisions_content(api, mode=args.content_sync_mode, concurrency=args.content_sync_concurrency,
+                                  priority_namespaces=args.content_sync_priority_namespaces)
 
         check_titles(api, db)
         check_specific_titles(api, db)
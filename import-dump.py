@@ -0,0 +1,21 @@
+#! /usr/bin/env python3
+
+import logging
+
+from ws.db.xmldump import XMLDumpImporter
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    import ws.config
+    from ws.interactive import require_login
+
+    argparser = ws.config.getArgParser(description="Import a MediaWiki XML dump into the local SQL database")
+    XMLDumpImporter.set_argparser(argparser)
+    args = ws.config.parse_args(argparser)
+
+    importer = XMLDumpImporter.from_argparser(args)
+    if importer.api is not None:
+        # alldeletedrevisions requires the deletedhistory right
+        require_login(importer.api)
+    importer.import_dump(args.dump_file, sync_timestamp=args.dump_sync_timestamp)
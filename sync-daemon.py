@@ -0,0 +1,18 @@
+#! /usr/bin/env python3
+
+from ws.db.sync_daemon import SyncDaemon
+
+if __name__ == "__main__":
+    import ws.config
+    from ws.interactive import require_login
+
+    argparser = ws.config.getArgParser(description="Keep the local SQL database synchronized with the wiki")
+    SyncDaemon.set_argparser(argparser)
+    args = ws.config.parse_args(argparser)
+
+    daemon = SyncDaemon.from_argparser(args)
+    require_login(daemon.api)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+
+import asyncio
+import datetime
+import json
+import urllib.parse
+
+import httpx
+import pytest
+
+from ws.client.async_api import AsyncAPI
+from ws.client.api import APIError
+
+API_URL = "https://wiki.example.org/api.php"
+INDEX_URL = "https://wiki.example.org/index.php"
+
+def make_api(handler, **kwargs):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), params={"format": "json"})
+    return AsyncAPI(API_URL, INDEX_URL, client, **kwargs)
+
+def get_params(request):
+    params = dict(request.url.params)
+    if request.method == "POST":
+        params.update(urllib.parse.parse_qsl(request.content.decode()))
+    return params
+
+def test_call_api():
+    def handler(request):
+        params = get_params(request)
+        assert params["format"] == "json"
+        assert params["action"] == "query"
+        return httpx.Response(200, json={"query": {"general": {"timestamp": "2014-08-25T14:26:59Z"}}})
+
+    async def main():
+        async with make_api(handler) as api:
+            return await api.call_api(action="query", meta="siteinfo")
+
+    result = asyncio.run(main())
+    assert result["general"]["timestamp"] == datetime.datetime(2014, 8, 25, 14, 26, 59)
+
+def test_call_api_error():
+    def handler(request):
+        return httpx.Response(200, json={"error": {"code": "badtoken", "info": "Invalid token"}})
+
+    async def main():
+        async with make_api(handler) as api:
+            await api.call_api(action="query", meta="siteinfo")
+
+    with pytest.raises(APIError):
+        asyncio.run(main())
+
+def test_list_continuation():
+    def handler(request):
+        params = get_params(request)
+        if "apcontinue" not in params:
+            return httpx.Response(200, json={
+                "continue": {"apcontinue": "B", "continue": "-||"},
+                "query": {"allpages": [{"title": "A"}]},
+            })
+        return httpx.Response(200, json={"query": {"allpages": [{"title": "B"}]}})
+
+    async def main():
+        async with make_api(handler) as api:
+            return [page["title"] async for page in api.list(list="allpages", aplimit="max")]
+
+    assert asyncio.run(main()) == ["A", "B"]
+
+def test_list_dummy():
+    async def main():
+        async with make_api(lambda request: None) as api:
+            async for _ in api.list():
+                pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+
+def test_max_concurrency():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, json={"query": {}})
+
+    async def main():
+        async with make_api(handler, max_concurrency=3) as api:
+            await asyncio.gather(*(api.call_api(action="query") for _ in range(10)))
+
+    asyncio.run(main())
+    assert max_in_flight == 3
+
+def test_call_api_autoiter_ids():
+    def handler(request):
+        params = get_params(request)
+        if params.get("meta") == "userinfo":
+            return httpx.Response(200, json={"query": {"userinfo": {"rights": []}}})
+        revids = params["revids"].split("|")
+        # simulate truncation for large chunks
+        if len(revids) > 20:
+            return httpx.Response(200, json={
+                "warnings": {"result": {"*": "This result was truncated because it would otherwise be larger than the limit of 8388608 bytes."}},
+                "query": {},
+            })
+        pages = {r: {"revid": int(r)} for r in revids}
+        return httpx.Response(200, json={"query": {"pages": pages}})
+
+    async def main():
+        async with make_api(handler) as api:
+            revids = []
+            async for chunk in api.call_api_autoiter_ids(action="query", revids=list(range(1, 101))):
+                revids.extend(page["revid"] for page in chunk["pages"].values())
+            return revids
+
+    assert asyncio.run(main()) == list(range(1, 101))
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+import json
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from ws.client.api import API
+
+from fixtures.fakes import FakeResponse, FakeSession
+
+TRUNCATED = {"result": {"*": "This result was truncated because it would otherwise be larger than the limit of 8388608 bytes."}}
+
+class RevisionsSession(FakeSession):
+    """
+    Simulates prop=revisions&revids=... queries, where each revision has
+    ``rev_size`` bytes and the result is truncated if the chunk exceeds
+    ``max_result_size``.
+    """
+    def __init__(self, rev_size=10, max_result_size=None, delay=0):
+        super().__init__()
+        self.rev_size = rev_size
+        self.max_result_size = max_result_size
+        self.delay = delay
+        self.chunks = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def respond(self, method, url, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        revids = [int(r) for r in kwargs["data"]["revids"].split("|")]
+        with self.lock:
+            self.chunks.append(revids)
+            self.in_flight -= 1
+        if self.max_result_size is not None and len(revids) * self.rev_size > self.max_result_size:
+            return FakeResponse({"warnings": TRUNCATED, "query": {}})
+        pages = dict((str(r), {"revid": r, "content": "x" * self.rev_size}) for r in revids)
+        return FakeResponse({"query": {"pages": pages}})
+
+def make_api(session):
+    api = API("https://wiki.example.org/api.php", "https://wiki.example.org/index.php", session)
+    api.max_ids_per_query = 50
+    return api
+
+def collect(results):
+    revids = []
+    for result in results:
+        revids.extend(page["revid"] for page in result["pages"].values())
+    return revids
+
+def test_sequential():
+    session = RevisionsSession()
+    api = make_api(session)
+    params = {"action": "query", "revids": list(range(1, 121))}
+    assert collect(api.call_api_autoiter_ids(params)) == list(range(1, 121))
+    assert [len(c) for c in session.chunks] == [50, 50, 20]
+    # the caller's params are not modified
+    assert params["revids"] == list(range(1, 121))
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_concurrent(ordered):
+    session = RevisionsSession(delay=0.01)
+    api = make_api(session)
+    results = api.call_api_autoiter_ids(action="query", revids=set(range(1, 501)), concurrency=4, ordered=ordered)
+    revids = collect(results)
+    if ordered:
+        assert revids == list(range(1, 501))
+    else:
+        assert sorted(revids) == list(range(1, 501))
+    assert session.max_in_flight == 4
+
+def test_truncation():
+    session = RevisionsSession(rev_size=1000, max_result_size=12000)
+    api = make_api(session)
+    api.max_result_size = 12000
+    results = api.call_api_autoiter_ids(action="query", revids=list(range(1, 101)))
+    assert collect(results) == list(range(1, 101))
+    # the first chunk is split in halves until it fits
+    assert [len(c) for c in session.chunks[:3]] == [50, 25, 12]
+    # the chunks are sized adaptively and no longer truncated
+    assert all(len(c) * 1000 <= 12000 for c in session.chunks[-5:])
+
+def test_expand_result_once():
+    session = RevisionsSession()
+    api = make_api(session)
+    results = list(api.call_api_autoiter_ids(action="query", revids=[1, 2, 3]))
+    assert len(results) == 1
+    assert "pages" in results[0]
+
+def test_lazy_iterable():
+    session = RevisionsSession()
+    api = make_api(session)
+    pulled = []
+    def gen_revids():
+        for revid in range(1, 1001):
+            pulled.append(revid)
+            yield revid
+    results = api.call_api_autoiter_ids(action="query", revids=gen_revids(), concurrency=2)
+    first = next(results)
+    assert len(first["pages"]) == 50
+    # only the submitted chunks are consumed from the generator
+    assert len(pulled) <= 3 * 50
+    assert collect([first] + list(results)) == list(range(1, 1001))
+
+def test_invalid_values():
+    api = make_api(RevisionsSession())
+    with pytest.raises(TypeError):
+        list(api.call_api_autoiter_ids(action="query", titles="Foo"))
+    with pytest.raises(TypeError):
+        list(api.call_api_autoiter_ids(action="query", revids=5))
+
+class ContinuingSession(RevisionsSession):
+    """
+    Simulates prop=deletedrevisions&revids=... queries, where each response
+    contains at most ``per_response`` revisions and the rest of the chunk is
+    fetched with the ``drvcontinue`` parameter.
+    """
+    def __init__(self, per_response, **kwargs):
+        super().__init__(**kwargs)
+        self.per_response = per_response
+
+    def respond(self, method, url, **kwargs):
+        data = kwargs["data"]
+        revids = [int(r) for r in data["revids"].split("|")]
+        if "drvcontinue" in data:
+            revids = [r for r in revids if r >= int(data["drvcontinue"])]
+        pages = dict((str(r), {"revid": r}) for r in revids[:self.per_response])
+        result = {"query": {"pages": pages}}
+        if len(revids) > self.per_response:
+            result["continue"] = {"drvcontinue": str(revids[self.per_response]), "continue": "||"}
+        return FakeResponse(result)
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_continuation(concurrency):
+    session = ContinuingSession(per_response=20)
+    api = make_api(session)
+    results = api.call_api_autoiter_ids(action="query", revids=list(range(1, 121)), concurrency=concurrency,
+                                        continuation=True)
+    assert collect(results) == list(range(1, 121))
+    assert any("drvcontinue" in request["data"] for request in session.requests)
+
+def test_continuation_disabled():
+    session = ContinuingSession(per_response=20)
+    api = make_api(session)
+    results = list(api.call_api_autoiter_ids(action="query", revids=list(range(1, 61))))
+    # only the first response of each chunk
+    assert collect(results) == list(range(1, 21)) + list(range(51, 61))
+    assert not any("drvcontinue" in request["data"] for request in session.requests)
+
+class TruncatingSession(ContinuingSession):
+    """
+    Like :py:class:`ContinuingSession`, but the first response of a chunk
+    is truncated if the chunk exceeds ``max_result_size``.
+    """
+    def respond(self, method, url, **kwargs):
+        response = super().respond(method, url, **kwargs)
+        data = kwargs["data"]
+        revids = data["revids"].split("|")
+        if "drvcontinue" not in data:
+            self.chunks.append(revids)
+            if len(revids) * self.rev_size > self.max_result_size:
+                result = json.loads(response.content)
+                result["warnings"] = TRUNCATED
+                response = FakeResponse(result)
+        return response
+
+def test_continuation_truncated():
+    session = TruncatingSession(per_response=20, rev_size=1000, max_result_size=30000)
+    api = make_api(session)
+    api.max_result_size = 30000
+    results = api.call_api_autoiter_ids(action="query", revids=list(range(1, 121)), continuation=True)
+    assert collect(results) == list(range(1, 121))
+    # the truncated chunk is continued and fetched exactly once
+    assert [len(c) for c in session.chunks[:1]] == [50]
+    assert sum("1" in chunk for chunk in session.chunks) == 1
+    # the next chunks are smaller
+    assert all(len(c) < 50 for c in session.chunks[1:])
+
+class PagesSession(RevisionsSession):
+    """
+    Simulates prop=deletedrevisions&drvlimit=...&pageids=... queries, where
+    each page has ``revisions_per_page`` revisions and each response contains
+    at most ``per_response`` revisions of all pages.
+    """
+    def __init__(self, revisions_per_page, per_response, **kwargs):
+        super().__init__(**kwargs)
+        self.revisions_per_page = revisions_per_page
+        self.per_response = per_response
+
+    def respond(self, method, url, **kwargs):
+        data = kwargs["data"]
+        revisions = [(pageid, 100 * pageid + i) for pageid in map(int, data["pageids"].split("|"))
+                                                for i in range(self.revisions_per_page)]
+        offset = int(data.get("drvcontinue", 0))
+        pages = {}
+        for pageid, revid in revisions[offset:offset + self.per_response]:
+            page = pages.setdefault(str(pageid), {"pageid": pageid, "title": "Page {}".format(pageid)})
+            page.setdefault("deletedrevisions", []).append({"revid": revid})
+        result = {"query": {"pages": pages}}
+        if offset + self.per_response < len(revisions):
+            result["continue"] = {"drvcontinue": str(offset + self.per_response), "continue": "||"}
+        return FakeResponse(result)
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_merge_continuation(concurrency):
+    session = PagesSession(revisions_per_page=3, per_response=4)
+    api = make_api(session)
+    api.max_ids_per_query = 5
+    results = list(api.call_api_autoiter_ids(action="query", pageids=list(range(1, 21)), concurrency=concurrency,
+                                             merge_continuation=True))
+    # one merged result per chunk
+    assert len(results) == 4
+    pages = {}
+    for result in results:
+        assert "continue" not in result
+        for pageid, page in result["pages"].items():
+            assert pageid not in pages
+            pages[pageid] = page
+    assert len(pages) == 20
+    for page in pages.values():
+        assert [rev["revid"] for rev in page["deletedrevisions"]] == [100 * page["pageid"] + i for i in range(3)]
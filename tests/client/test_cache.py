@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+
+import datetime
+
+import pytest
+
+import ws.client.cache
+from ws.client.cache import ResponseCache
+from ws.client.connection import Connection
+
+from fixtures.fakes import FakeResponse, FakeSession
+
+class FakeClock:
+    def __init__(self, now=1000000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ws.client.cache.time, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60, max_size=100)
+    yield cache
+    cache.close()
+
+def test_make_key():
+    k1 = ResponseCache.make_key("url", {"action": "query", "list": "allpages"})
+    k2 = ResponseCache.make_key("url", {"list": "allpages", "action": "query"})
+    k3 = ResponseCache.make_key("url", {"list": "allusers", "action": "query"})
+    assert k1 == k2
+    assert k1 != k3
+
+def test_get_set(cache):
+    assert cache.get("a") is None
+    cache.set("a", b"foo")
+    assert cache.get("a") == b"foo"
+    assert cache.stats == {"hits": 1, "misses": 1, "bytes_saved": 3, "entries": 1, "size": 3}
+
+def test_ttl(cache, clock):
+    cache.set("a", b"foo")
+    clock.now += 61
+    assert cache.get("a") is None
+    assert cache.stats["entries"] == 0
+
+def test_lru_eviction(cache, clock):
+    cache.set("a", b"x" * 40)
+    clock.now += 1
+    cache.set("b", b"x" * 40)
+    clock.now += 1
+    # touch the first entry
+    assert cache.get("a") is not None
+    clock.now += 1
+    cache.set("c", b"x" * 40)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_invalidate_older_than(cache, clock):
+    cache.set("a", b"foo")
+    clock.now += 10
+    cache.set("b", b"bar")
+    ts = datetime.datetime.fromtimestamp(clock.now - 5, tz=datetime.timezone.utc).replace(tzinfo=None)
+    cache.invalidate_older_than(ts)
+    assert cache.get("a") is None
+    assert cache.get("b") == b"bar"
+
+class CacheSession(FakeSession):
+    def respond(self, method, url, **kwargs):
+        return FakeResponse({"query": {"allpages": [{"title": "Foo"}]}})
+
+def test_connection_cache(cache):
+    session = CacheSession()
+    api = Connection("https://wiki.example.org/api.php", "https://wiki.example.org/index.php", session, cache=cache)
+    for _ in range(3):
+        assert api.call_api(action="query", list="allpages") == {"allpages": [{"title": "Foo"}]}
+    assert len(session.requests) == 1
+    assert cache.hits == 2
+
+    # tokens are never cached
+    api.call_api(action="query", meta="tokens")
+    api.call_api(action="query", meta="tokens")
+    assert len(session.requests) == 3
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+
+import gzip
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from ws.client.cassette import RecordingAdapter, ReplayAdapter, CassetteError
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    Adapter which answers each request with a JSON body containing the
+    request body and a counter.
+    """
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def send(self, request, **kwargs):
+        self.count += 1
+        response = requests.models.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json; charset=utf-8"
+        response.headers["X-Ignored"] = "foo"
+        body = request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body
+        response._content = json.dumps({"count": self.count, "body": body}).encode("utf-8")
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def make_session(adapter):
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    adapter = RecordingAdapter(path, FakeAdapter())
+    session = make_session(adapter)
+    session.get("https://example.org/api.php", params={"action": "query", "maxlag": 5})
+    session.get("https://example.org/api.php", params={"action": "query", "maxlag": 5})
+    session.post("https://example.org/api.php", data={"action": "edit", "token": "secret"})
+    session.close()
+    return path
+
+
+def test_record(cassette):
+    with gzip.open(cassette, "rt", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 3
+    assert entries[0]["headers"] == {"Content-Type": "application/json; charset=utf-8"}
+    assert ["token", "***"] in entries[2]["params"]
+    assert "secret" not in json.dumps(entries[2]["params"])
+
+def test_replay(cassette):
+    session = make_session(ReplayAdapter(cassette))
+    # maxlag is not part of the key
+    r1 = session.get("https://example.org/api.php", params={"action": "query"})
+    r2 = session.get("https://example.org/api.php", params={"action": "query", "maxlag": 10})
+    assert r1.json()["count"] == 1
+    assert r2.json()["count"] == 2
+    assert r1.headers["content-type"] == "application/json; charset=utf-8"
+    # the last response is repeated
+    r3 = session.get("https://example.org/api.php", params={"action": "query"})
+    assert r3.json()["count"] == 2
+
+def test_replay_ignores_token(cassette):
+    session = make_session(ReplayAdapter(cassette))
+    r = session.post("https://example.org/api.php", data={"action": "edit", "token": "other"})
+    assert r.json()["count"] == 3
+
+def test_replay_stream(cassette):
+    session = make_session(ReplayAdapter(cassette))
+    r = session.get("https://example.org/api.php", params={"action": "query"}, stream=True)
+    assert json.loads(r.raw.read())["count"] == 1
+
+def test_replay_miss(cassette):
+    session = make_session(ReplayAdapter(cassette))
+    with pytest.raises(CassetteError):
+        session.get("https://example.org/api.php", params={"action": "parse"})
+
+def test_replay_latency(cassette, monkeypatch):
+    delays = []
+    monkeypatch.setattr("ws.client.cassette.time.sleep", delays.append)
+    session = make_session(ReplayAdapter(cassette, latency=0.5, bandwidth=100))
+    r = session.get("https://example.org/api.php", params={"action": "query"})
+    assert delays == [pytest.approx(0.5 + len(r.content) / 100)]
@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+
+import json
+
+import pytest
+
+from ws.client.api import API
+from ws.client.connection import APIError
+from ws.client.metrics import SummarySink, JSONLinesSink
+
+from fixtures.fakes import FakeResponse, FakeSession
+
+def make_api(responses):
+    api = API("https://wiki.example.org/api.php", "https://wiki.example.org/index.php", FakeSession(responses))
+    events = []
+    api.add_hook(events.append)
+    return api, events
+
+def test_event():
+    api, events = make_api([FakeResponse({"query": {"general": {}}})])
+    api.call_api(action="query", meta="siteinfo")
+    assert len(events) == 1
+    event = events[0]
+    assert event["action"] == "query"
+    assert event["module"] == "meta=siteinfo"
+    assert event["bytes_in"] == len(b'{"query": {"general": {}}}')
+    assert event["bytes_out"] == len("https://wiki.example.org/api.php")
+    assert event["retries"] == 0
+    assert event["continuation_round"] is None
+    assert event["cached"] is False
+    assert event["error"] is None
+    assert event["time"] >= 0
+
+def test_retries_and_error():
+    api, events = make_api([
+        FakeResponse({}, status_code=429),
+        FakeResponse({"error": {"code": "badvalue", "info": "foo"}}),
+    ])
+    with pytest.raises(APIError):
+        api.call_api(action="query", list="foo")
+    assert events[0]["retries"] == 1
+    assert events[0]["error"] == "badvalue"
+    assert events[0]["module"] == "list=foo"
+
+def test_continuation_round():
+    api, events = make_api([
+        FakeResponse({"continue": {"apcontinue": "B", "continue": "-||"}, "query": {"allpages": [{"title": "A"}]}}),
+        FakeResponse({"query": {"allpages": [{"title": "B"}]}}),
+        FakeResponse({"query": {"general": {}}}),
+    ])
+    for page in api.list(list="allpages"):
+        pass
+    api.call_api(action="query", meta="siteinfo")
+    assert [e["continuation_round"] for e in events] == [0, 1, None]
+
+def test_stream():
+    pytest.importorskip("ijson")
+    content = {"query": {"allpages": [{"title": "A"}, {"title": "B"}]}}
+    api, events = make_api([FakeResponse(content)])
+    pages = api.list(list="allpages", stream=True)
+    assert next(pages) == {"title": "A"}
+    # the event is emitted when the response is consumed
+    assert events == []
+    assert list(pages) == [{"title": "B"}]
+    assert len(events) == 1
+    assert events[0]["bytes_in"] == len(json.dumps(content))
+    assert events[0]["continuation_round"] == 0
+
+def test_summary_sink():
+    sink = SummarySink()
+    base = {"action": "query", "module": "list=allpages", "time": 0.5, "bytes_out": 10, "bytes_in": 100,
+            "retries": 0, "sleep": 0.0, "cached": False, "error": None}
+    sink(base)
+    sink(dict(base, retries=2, cached=True))
+    sink(dict(base, action="edit", module="", time=2.0, error="badtoken"))
+    assert sink.rows[("query", "list=allpages")]["requests"] == 2
+    assert sink.rows[("query", "list=allpages")]["retries"] == 2
+    assert sink.rows[("query", "list=allpages")]["cached"] == 1
+    assert sink.rows[("edit", "")]["errors"] == 1
+    lines = sink.format_table().splitlines()
+    assert lines[0].split() == ["action", "module"] + SummarySink.columns
+    # sorted by time
+    assert lines[1].split()[:2] == ["edit", "-"]
+    assert lines[2].split() == ["query", "list=allpages", "2", "1", "0", "2", "1.000", "0.000", "20", "200"]
+
+def test_jsonlines_sink(tmp_path):
+    path = tmp_path / "events.jsonl"
+    sink = JSONLinesSink(str(path))
+    sink({"action": "query"})
+    sink({"action": "edit"})
+    sink.close()
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [{"action": "query"}, {"action": "edit"}]
@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+
+import datetime
+import types
+
+from ws.client.redirects import Redirects
+
+T0 = datetime.datetime(2020, 1, 1)
+T1 = datetime.datetime(2020, 1, 2)
+
+class FakeAPI:
+    api_url = "https://wiki.example.org/api.php"
+
+    def __init__(self):
+        self.site = types.SimpleNamespace(namespaces={0: {}, 1: {}})
+        self.now = T0
+        self.oldest_rc_timestamp = T0
+        # target title -> list of (source, fragment)
+        self.pages = {"Target": [("A", None), ("B", "Section")], "C": [("D", None)]}
+        self.recentchanges = []
+        self.logevents = {"move": [], "delete": []}
+        # title -> (target, fragment) returned by the query with redirects
+        self.redirect_targets = {}
+        self.generator_calls = 0
+        self.queried_titles = None
+
+    def call_api(self, params=None, **kwargs):
+        assert kwargs["curtimestamp"] == ""
+        return {"batchcomplete": "", "curtimestamp": self.now}
+
+    def generator(self, **params):
+        self.generator_calls += 1
+        if params["gapnamespace"] != 0:
+            return
+        for title, redirects in self.pages.items():
+            page = {"title": title}
+            if redirects:
+                page["redirects"] = [{"title": s, "fragment": f} if f else {"title": s} for s, f in redirects]
+            yield page
+
+    def list(self, **params):
+        if params["list"] == "recentchanges":
+            assert params["rcstart"] == T0
+            return iter(self.recentchanges)
+        assert params["lestart"] == T0
+        return iter(self.logevents[params["letype"]])
+
+    def call_api_autoiter_ids(self, **params):
+        self.queried_titles = set(params["titles"])
+        redirects = []
+        for title in params["titles"]:
+            if title in self.redirect_targets:
+                target, fragment = self.redirect_targets[title]
+                entry = {"from": title, "to": target}
+                if fragment:
+                    entry["tofragment"] = fragment
+                redirects.append(entry)
+        yield {"redirects": redirects}
+
+EXPECTED = {"A": "Target", "B": "Target#Section", "D": "C"}
+
+def test_map_without_cache():
+    api = FakeAPI()
+    assert Redirects(api).map == EXPECTED
+
+def test_resolve():
+    api = FakeAPI()
+    api.pages["E"] = [("F", "Frag")]
+    api.pages["F"] = [("G", None)]
+    api.pages["X"] = [("Y", None)]
+    api.pages["Y"] = [("X", None)]
+    redirects = Redirects(api)
+    assert redirects.resolve("G") == "E#Frag"
+    assert redirects.resolve("B") == "Target#Section"
+    assert redirects.resolve("Target") is None
+    assert redirects.resolve("X") is None
+    # memoized
+    assert redirects._resolved["G"] == "E#Frag"
+    del redirects.map
+    api.pages["E2"] = [("G", None)]
+    del api.pages["F"]
+    assert redirects.resolve("G") == "E2"
+
+def test_cache(tmp_path):
+    cache_file = str(tmp_path / "redirects.json.gz")
+    api = FakeAPI()
+    assert Redirects(api, cache_file=cache_file).map == EXPECTED
+    assert api.generator_calls == 2
+
+    # the second run updates the cached map from the changes
+    api.generator_calls = 0
+    api.now = T1
+    api.recentchanges = [{"title": "A"}, {"title": "New"}]
+    api.logevents["move"] = [{"title": "D", "params": {"target_title": "D2"}}]
+    api.logevents["delete"] = [{"title": "B"}]
+    api.redirect_targets = {"New": ("C", "x"), "D": ("D2", None), "D2": ("C", None)}
+    redirects = Redirects(api, cache_file=cache_file)
+    assert redirects.map == {"New": "C#x", "D": "D2", "D2": "C"}
+    assert api.generator_calls == 0
+    assert api.queried_titles == {"A", "New", "D", "D2", "B"}
+
+    # the update is saved with the new timestamp
+    assert Redirects(api, cache_file=cache_file)._load() == (redirects.map, T1)
+
+def test_cache_too_old(tmp_path):
+    cache_file = str(tmp_path / "redirects.json.gz")
+    api = FakeAPI()
+    Redirects(api, cache_file=cache_file).map
+    # recentchanges do not cover the period since the cache was saved
+    api.oldest_rc_timestamp = T1
+    api.pages["Target"] = []
+    assert Redirects(api, cache_file=cache_file).map == {"D": "C"}
+    assert api.generator_calls == 4
+
+def test_cache_other_wiki(tmp_path):
+    cache_file = str(tmp_path / "redirects.json.gz")
+    api = FakeAPI()
+    Redirects(api, cache_file=cache_file).map
+    api.api_url = "https://other.example.org/api.php"
+    api.pages = {}
+    assert Redirects(api, cache_file=cache_file).map == {}
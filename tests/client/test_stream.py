@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+
+import datetime
+
+import pytest
+
+from ws.client.api import API
+from ws.client.connection import APIError
+from ws.utils import LazyTimestampDict
+
+from fixtures.fakes import FakeResponse, FakeSession
+
+ijson = pytest.importorskip("ijson")
+
+def make_api(responses):
+    session = FakeSession(responses)
+    api = API("https://wiki.example.org/api.php", "https://wiki.example.org/index.php", session)
+    return api, session
+
+def test_list_stream():
+    api, session = make_api([
+        FakeResponse({"continue": {"arvcontinue": "2", "continue": "-||"},
+                      "query": {"allrevisions": [{"pageid": 1, "revisions": [{"revid": 1, "timestamp": "2014-08-25T14:26:59Z"}]}]}}),
+        FakeResponse({"batchcomplete": "",
+                      "query": {"allrevisions": [{"pageid": 2, "revisions": [{"revid": 2, "timestamp": "2014-08-26T14:26:59Z", "size": 1.5}]}]}}),
+    ])
+    pages = api.list(list="allrevisions", arvprop="ids|timestamp", stream=True)
+    assert next(pages) == {"pageid": 1, "revisions": [{"revid": 1, "timestamp": datetime.datetime(2014, 8, 25, 14, 26, 59)}]}
+    # the second response was not requested yet
+    assert len(session.requests) == 1
+    assert list(pages) == [{"pageid": 2, "revisions": [{"revid": 2, "timestamp": datetime.datetime(2014, 8, 26, 14, 26, 59), "size": 1.5}]}]
+    assert session.requests[0]["stream"] is True
+    assert session.requests[1]["params"]["arvcontinue"] == "2"
+
+def test_generator_stream():
+    api, session = make_api([
+        FakeResponse({"batchcomplete": "",
+                      "query": {"pages": {"2": {"pageid": 2, "title": "B"}, "1": {"pageid": 1, "title": "A"}}}}),
+    ])
+    pages = list(api.generator(generator="allpages", stream=True))
+    # streamed pages are yielded in the order of the response
+    assert [p["title"] for p in pages] == ["B", "A"]
+
+def test_list_querypage_stream():
+    api, session = make_api([
+        FakeResponse({"query": {"querypage": {"name": "Uncategorizedcategories", "results": [{"title": "A"}, {"title": "B"}]}}}),
+    ])
+    pages = list(api.list(list="querypage", qppage="Uncategorizedcategories", stream=True))
+    assert [p["title"] for p in pages] == ["A", "B"]
+
+def test_stream_error():
+    api, session = make_api([
+        FakeResponse({"error": {"code": "badvalue", "info": "Bad value"}}),
+    ])
+    with pytest.raises(APIError):
+        list(api.list(list="allrevisions", stream=True))
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_list_continuation(stream):
+    def responses():
+        return [
+            FakeResponse({"continue": {"lecontinue": "2", "continue": "-||"},
+                          "query": {"logevents": [{"logid": 1}]}}),
+            FakeResponse({"batchcomplete": "",
+                          "query": {"logevents": [{"logid": 2}, {"logid": 3}]}}),
+        ]
+    api, session = make_api(responses())
+    continuation = {}
+    seen = []
+    for event in api.list(list="logevents", stream=stream, continuation=continuation):
+        seen.append((event["logid"], continuation["continue"]))
+    assert seen == [
+        (1, {"continue": ""}),
+        (2, {"lecontinue": "2", "continue": "-||"}),
+        (3, {"lecontinue": "2", "continue": "-||"}),
+    ]
+
+    # resume from the second response
+    api, session = make_api(responses()[1:])
+    continuation = {"continue": {"lecontinue": "2", "continue": "-||"}}
+    events = list(api.list(list="logevents", stream=stream, continuation=continuation))
+    assert [e["logid"] for e in events] == [2, 3]
+    assert session.requests[0]["params"]["lecontinue"] == "2"
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_lazy_timestamps(stream):
+    api, session = make_api([
+        FakeResponse({"batchcomplete": "",
+                      "query": {"allrevisions": [{"pageid": 1, "revisions": [{"revid": 1, "timestamp": "2014-08-25T14:26:59Z"}]}]}}),
+    ])
+    api.lazy_timestamps = True
+    pages = list(api.list(list="allrevisions", arvprop="ids|timestamp", stream=stream))
+    rev = pages[0]["revisions"][0]
+    assert isinstance(rev, LazyTimestampDict)
+    assert dict.__getitem__(rev, "timestamp") == "2014-08-25T14:26:59Z"
+    assert rev["timestamp"] == datetime.datetime(2014, 8, 25, 14, 26, 59)
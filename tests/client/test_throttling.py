@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+
+import pytest
+
+from ws.client.connection import Connection, APIError, MAX_THROTTLE_RETRIES
+from ws.utils import RateLimiter
+
+from fixtures.fakes import FakeResponse, FakeSession
+
+class FakeLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.backoffs = []
+
+    def backoff(self, delay, rate_class=None):
+        self.backoffs.append(delay)
+
+OK = {"query": {"general": {}}}
+MAXLAG = {"error": {"code": "maxlag", "info": "Waiting for a database server: 7 seconds lagged.", "lag": 7}}
+
+def make_connection(responses, **kwargs):
+    session = FakeSession(responses)
+    limiter = FakeLimiter()
+    api = Connection("https://wiki.example.org/api.php", "https://wiki.example.org/index.php", session, limiter=limiter, **kwargs)
+    return api, session, limiter
+
+def test_rate_class():
+    assert Connection.get_rate_class("query") == "read"
+    assert Connection.get_rate_class("login") == "write"
+    assert Connection.get_rate_class("edit") == "edit"
+
+def test_retry_after_429():
+    api, session, limiter = make_connection([
+        FakeResponse({}, status_code=429, headers={"Retry-After": "3"}),
+        FakeResponse(OK),
+    ])
+    assert api.call_api(action="query", meta="siteinfo") == OK["query"]
+    assert len(session.requests) == 2
+    assert limiter.backoffs == [3]
+
+def test_retry_maxlag():
+    api, session, limiter = make_connection([
+        FakeResponse(MAXLAG, headers={"Retry-After": "7"}),
+        FakeResponse(OK),
+    ], maxlag=5)
+    assert api.call_api(action="query", meta="siteinfo") == OK["query"]
+    assert session.requests[0]["params"]["maxlag"] == 5
+    assert limiter.backoffs == [7]
+
+def test_maxlag_retries_exhausted():
+    api, session, limiter = make_connection([FakeResponse(MAXLAG)] * (MAX_THROTTLE_RETRIES + 1), maxlag=5)
+    with pytest.raises(APIError):
+        api.call_api(action="query", meta="siteinfo")
+    assert len(limiter.backoffs) == MAX_THROTTLE_RETRIES
+
+def test_maxlag_keeps_request_kwargs():
+    api, session, limiter = make_connection([FakeResponse(OK)], maxlag=5)
+    request_kwargs = {"params": {"action": "query", "meta": "siteinfo"}}
+    api._request_api("query", "GET", request_kwargs)
+    assert request_kwargs == {"params": {"action": "query", "meta": "siteinfo"}}
+    assert session.requests[0]["params"]["maxlag"] == 5
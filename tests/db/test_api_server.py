@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+
+import datetime
+import io
+import json
+import urllib.parse
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from ws.db import selects
+from ws.db.selects.lists.allpages import AllPages
+from ws.db.selects.lists.allrevisions import AllRevisions
+from ws.db.api_server import APIServer, _convert_value
+
+from fixtures.fakes import SchemaDatabase
+
+
+@pytest.fixture
+def server(monkeypatch):
+    calls = []
+
+    def paginate(keys, continuation, limit):
+        # keyset pagination like in ws.db.selects
+        if continuation.get("continue"):
+            keys = [k for k in keys if k > int(continuation["continue"])]
+        if len(keys) > limit:
+            keys = keys[:limit]
+            continuation["continue"] = str(keys[-1])
+        else:
+            continuation.pop("continue", None)
+        return keys
+
+    def fake_list(db, params, *, continuation=None, limit=None):
+        calls.append(("list", params, dict(continuation), limit))
+        for i in paginate(list(range(25)), continuation, limit):
+            yield {"pageid": i, "ns": 0, "title": "Page {}".format(i)}
+
+    def fake_generator_pageids(db, params, *, continuation=None, limit=None):
+        calls.append(("generator", params, dict(continuation), limit))
+        return paginate(list(range(1, 4)), continuation, limit)
+
+    def fake_query_pageset(db, params):
+        calls.append(("pageset", params))
+        for pageid in sorted(params.get("pageids", [])):
+            yield {"pageid": pageid, "ns": 0, "title": "Page {}".format(pageid),
+                   "touched": datetime.datetime(2020, 1, 2, 3, 4, 5)}
+        for title in sorted(params.get("titles", [])):
+            yield {"missing": "", "ns": 0, "title": title}
+
+    monkeypatch.setattr(selects, "list", fake_list)
+    monkeypatch.setattr(selects, "generator_pageids", fake_generator_pageids)
+    monkeypatch.setattr(selects, "query_pageset", fake_query_pageset)
+    server = APIServer(None, max_limit=20)
+    server.calls = calls
+    return server
+
+def call(server, params, method="GET"):
+    data = urllib.parse.urlencode(params).encode("utf-8")
+    environ = {"REQUEST_METHOD": method}
+    if method == "GET":
+        environ["QUERY_STRING"] = data.decode("ascii")
+    else:
+        environ["CONTENT_TYPE"] = "application/x-www-form-urlencoded"
+        environ["CONTENT_LENGTH"] = str(len(data))
+        environ["wsgi.input"] = io.BytesIO(data)
+    statuses = []
+    body = b"".join(server(environ, lambda status, headers: statuses.append((status, dict(headers)))))
+    status, headers = statuses[0]
+    assert status == "200 OK"
+    assert headers["Content-Type"] == "application/json; charset=utf-8"
+    assert int(headers["Content-Length"]) == len(body)
+    return json.loads(body)
+
+def test_convert_value():
+    assert _convert_value("prop", "ids") == {"ids"}
+    assert _convert_value("prop", "ids|user") == {"ids", "user"}
+    assert _convert_value("namespace", "4") == 4
+    assert _convert_value("namespace", "0|4") == {0, 4}
+    assert _convert_value("titles", "Foo") == "Foo"
+    assert _convert_value("start", "2020-01-02T03:04:05Z") == datetime.datetime(2020, 1, 2, 3, 4, 5)
+    assert _convert_value("toponly", "") is True
+    assert _convert_value("dir", "newer") == "newer"
+
+def test_list_continuation(server):
+    params = {"action": "query", "list": "allpages", "aplimit": "10", "apnamespace": "0", "continue": ""}
+    result = call(server, params)
+    assert [p["pageid"] for p in result["query"]["allpages"]] == list(range(10))
+    assert result["continue"] == {"apcontinue": "9", "continue": "-||"}
+    # the select receives typed parameters without limit and continue
+    assert server.calls[0] == ("list", {"list": "allpages", "apnamespace": 0}, {"continue": None}, 10)
+
+    pages = []
+    while True:
+        pages += result["query"]["allpages"]
+        if "continue" not in result:
+            break
+        result = call(server, dict(params, **result["continue"]))
+    assert [p["pageid"] for p in pages] == list(range(25))
+    assert "batchcomplete" in result
+
+def test_limit_max(server):
+    result = call(server, {"action": "query", "list": "allpages", "aplimit": "max"})
+    assert len(result["query"]["allpages"]) == 20
+
+def test_generator(server):
+    params = {"action": "query", "generator": "allpages", "gaplimit": "2", "prop": "info"}
+    result = call(server, params, method="POST")
+    assert set(result["query"]["pages"]) == {"1", "2"}
+    assert result["query"]["pages"]["1"]["touched"] == "2020-01-02T03:04:05Z"
+    assert result["continue"] == {"gapcontinue": "2", "continue": "-||"}
+    assert server.calls[-2] == ("generator", {"generator": "allpages"}, {"continue": None}, 2)
+    assert server.calls[-1] == ("pageset", {"prop": {"info"}, "pageids": {1, 2}})
+
+    result = call(server, dict(params, **result["continue"]), method="POST")
+    assert set(result["query"]["pages"]) == {"3"}
+    assert "continue" not in result
+
+def test_missing_titles(server):
+    result = call(server, {"action": "query", "titles": "Foo|Bar"}, method="POST")
+    assert result["query"]["pages"] == {
+        "-1": {"missing": "", "ns": 0, "title": "Bar"},
+        "-2": {"missing": "", "ns": 0, "title": "Foo"},
+    }
+
+def test_userinfo(server):
+    result = call(server, {"action": "query", "meta": "userinfo", "uiprop": "rights"})
+    assert "apihighlimits" in result["query"]["userinfo"]["rights"]
+
+@pytest.mark.parametrize("params, code", [
+    ({"action": "edit", "title": "Foo"}, "unknown_action"),
+    ({"action": "query", "list": "nonexisting"}, "badvalue"),
+    ({"action": "query", "meta": "tokens"}, "badvalue"),
+    ({"action": "query", "list": "allpages|recentchanges"}, "notimplemented"),
+    ({"action": "query", "list": "allpages", "aplimit": "foo"}, "badparams"),
+])
+def test_errors(server, params, code):
+    result = call(server, params)
+    assert result["error"]["code"] == code
+
+def test_keyset_select():
+    db = SchemaDatabase()
+    s = AllRevisions(db)
+    params = {"prop": {"ids", "timestamp"}, "dir": "older"}
+    s.set_defaults(params)
+    s.sanitize_params(params)
+    query, key_length = selects._keyset_select(s.get_select(params), {"continue": "2020-01-02T03:04:05Z|42"}, 10)
+    assert key_length == 2
+    compiled = query.compile(dialect=postgresql.dialect())
+    assert "(revision.rev_timestamp, revision.rev_id) < (" in str(compiled)
+    assert "OFFSET" not in str(compiled)
+    assert list(compiled.params.values()) == [datetime.datetime(2020, 1, 2, 3, 4, 5), 42, 11]
+
+    row, key = selects._split_keyset_row({"rev_id": 41, "_keyset_0": datetime.datetime(2020, 1, 1), "_keyset_1": 41}, key_length)
+    assert row == {"rev_id": 41}
+    assert selects._encode_continue(key) == "2020-01-01T00:00:00Z|41"
+
+def test_keyset_select_tie_breaker():
+    db = SchemaDatabase()
+    s = AllPages(db)
+    params = {"prtype": {"edit", "move"}}
+    s.set_defaults(params)
+    s.sanitize_params(params)
+    query, key_length = selects._keyset_select(s.get_select(params), {"continue": "Foo|3|"}, 10)
+    assert key_length == 3
+    compiled = str(query.compile(dialect=postgresql.dialect()))
+    assert "(page.page_title, page.page_id, page_restrictions.pr_id) > (" in compiled
+    assert "ORDER BY page.page_title ASC, page.page_id ASC, page_restrictions.pr_id ASC" in compiled
+
+    row, key = selects._split_keyset_row({"page_id": 3, "_keyset_0": "Foo", "_keyset_1": 3, "_keyset_2": None}, key_length)
+    assert selects._encode_continue(key) == "Foo|3|"
@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+
+import datetime
+import itertools
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+import ws.db.mw_constants as mwconst
+from ws.db.grabbers.revision import GrabberRevisions, _prefetch
+
+def test_order():
+    assert list(_prefetch(iter(range(100)), maxsize=3)) == list(range(100))
+
+def test_backpressure():
+    produced = []
+    event = threading.Event()
+
+    def producer():
+        for i in range(100):
+            produced.append(i)
+            if len(produced) == 4:
+                event.set()
+            yield i
+
+    items = _prefetch(producer(), maxsize=2)
+    assert next(items) == 0
+    event.wait(timeout=5)
+    # one item consumed, two in the queue and one waiting to be put
+    assert len(produced) <= 4
+    items.close()
+
+def test_exception():
+    def producer():
+        yield 1
+        raise ValueError("failed")
+
+    items = _prefetch(producer(), maxsize=2)
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+def test_close_stops_producer():
+    closed = threading.Event()
+
+    def producer():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    items = _prefetch(producer(), maxsize=2)
+    assert next(items) == 0
+    items.close()
+    assert closed.is_set()
+
+class FakeAPI:
+    """
+    Serves the content of the requested revisions in chunks of 10 revids.
+    The deleted revisions are served in two responses per chunk.
+    """
+    def __init__(self):
+        self.revids = []
+        self.deleted_revids = []
+
+    def call_api_autoiter_ids(self, params, *, expand_result=True, concurrency=1, continuation=False):
+        assert continuation is True
+        revids = iter(params["revids"])
+        while True:
+            chunk = list(itertools.islice(revids, 10))
+            if not chunk:
+                break
+            if params["prop"] == "deletedrevisions":
+                self.deleted_revids.extend(chunk)
+                for part in [chunk[:5], chunk[5:]]:
+                    revisions = [{"revid": revid, "slots": {"main": {"*": "deleted text {}".format(revid)}}}
+                                 for revid in part]
+                    yield {"query": {"pages": {"-1": {"ns": 0, "title": "Deleted", "missing": "",
+                                                      "deletedrevisions": revisions}}}}
+            else:
+                self.revids.extend(chunk)
+                revisions = [{"revid": revid, "slots": {"main": {"*": "text {}".format(revid)}}} for revid in chunk]
+                yield {"query": {"pages": {"1": {"pageid": 1, "title": "Page", "revisions": revisions}}}}
+
+def test_sync_revisions_content_streaming(db):
+    timestamp = datetime.datetime(2020, 1, 1)
+    with db.engine.begin() as conn:
+        # the referenced users do not have to exist
+        conn.execute(sa.text("SET LOCAL session_replication_role = replica"))
+        conn.execute(db.page.insert(), [{"page_id": ns + 1, "page_namespace": ns, "page_title": "Page",
+                                         "page_touched": timestamp, "page_latest": 0, "page_len": 0}
+                                        for ns in [0, 10]])
+        conn.execute(db.revision.insert(), [{"rev_id": i, "rev_page": 1 + 10 * (i % 2), "rev_comment": "", "rev_user": 1,
+                                             "rev_user_text": "User", "rev_timestamp": timestamp}
+                                            for i in range(1, 101)])
+        # the text of the last deleted revision is suppressed, the text of
+        # the previous one is only deleted and available to administrators
+        ar_deleted = {129: mwconst.DELETED_TEXT, 130: mwconst.DELETED_TEXT | mwconst.DELETED_RESTRICTED}
+        conn.execute(db.archive.insert(), [{"ar_rev_id": i, "ar_namespace": 0, "ar_title": "Deleted", "ar_comment": "",
+                                            "ar_user": 1, "ar_user_text": "User", "ar_timestamp": timestamp,
+                                            "ar_deleted": ar_deleted.get(i, 0)}
+                                           for i in range(101, 131)])
+    db.chunk_size = 7
+    api = FakeAPI()
+    GrabberRevisions(api, db).sync_revisions_content(mode="all", priority_namespaces=[10])
+
+    # the revisions from the priority namespace are fetched first, each group in order
+    assert api.revids == list(range(1, 101, 2)) + list(range(2, 101, 2))
+    assert api.deleted_revids == list(range(101, 130))
+    with db.engine.connect() as conn:
+        count = conn.execute(sa.select(sa.func.count()).select_from(db.revision)
+                               .where(db.revision.c.rev_text_id == None)).scalar()
+        assert count == 0
+        rows = conn.execute(sa.select(db.archive.c.ar_rev_id).where(db.archive.c.ar_text_id == None)).scalars().all()
+        assert rows == [130]
+
+class RevisionsAPI:
+    """
+    Serves ``allrevisions`` with the content in responses of one page with
+    ``per_page`` revisions. Every other revision reverts to the first text.
+    """
+    def __init__(self, pages, per_page):
+        self.pages = pages
+        self.per_page = per_page
+
+    def list(self, params, *, continuation=None, **kwargs):
+        if params["list"] != "allrevisions":
+            return
+        timestamp = datetime.datetime(2020, 1, 1)
+        for pageid in range(1, self.pages + 1):
+            continuation["continue"] = {"arvcontinue": str(pageid), "continue": "-||"}
+            revisions = []
+            for i in range(self.per_page):
+                revid = pageid * 100 + i
+                text = "first text" if i % 2 == 0 else "text {}".format(revid)
+                revisions.append({"revid": revid, "parentid": revid - 1 if i else 0, "user": "User", "userid": 1,
+                                  "timestamp": timestamp, "comment": "", "size": len(text), "sha1": None,
+                                  "slots": {"main": {"contentmodel": "wikitext", "*": text}}})
+            yield {"pageid": pageid, "ns": 0, "title": "Page {}".format(pageid), "revisions": revisions}
+
+def test_bulk_insert_with_content(db):
+    with db.engine.begin() as conn:
+        conn.execute(sa.text("SET LOCAL session_replication_role = replica"))
+        conn.execute(db.user.insert(), [{"user_id": 1, "user_name": "User"}])
+        conn.execute(db.page.insert(), [{"page_id": pageid, "page_namespace": 0, "page_title": "Page {}".format(pageid),
+                                         "page_touched": datetime.datetime(2020, 1, 1), "page_latest": 0, "page_len": 0}
+                                        for pageid in range(1, 5)])
+    # the queue is flushed in the middle of the import, while the texts of
+    # the next pages are looked up on another connection
+    db.bulk_load = True
+    db.chunk_size = 3
+    db.checkpoint_rows = None
+    db.checkpoint_interval = None
+    g = GrabberRevisions(RevisionsAPI(pages=4, per_page=6), db, with_content=True)
+    thread = threading.Thread(target=g.insert, daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive(), "the import is blocked"
+
+    with db.engine.connect() as conn:
+        rows = conn.execute(sa.select(db.revision.c.rev_id, db.revision.c.rev_text_id)).all()
+        assert len(rows) == 24
+        assert all(text_id is not None for revid, text_id in rows)
+        # the reverts within a transaction share the text
+        first = {text_id for revid, text_id in rows if revid % 2 == 0}
+        assert len(first) == 1
+        # the deferred indexes are created again
+        indexes = {index["name"] for index in sa.inspect(conn).get_indexes("revision")}
+        assert {index.name for index in db.revision.indexes} <= indexes
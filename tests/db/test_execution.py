@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+
+import contextlib
+import datetime
+import hashlib
+import types
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql.psycopg import dialect as psycopg_dialect
+
+from ws.db.execution import CopyExecutionQueue
+from ws.db.sql_types import MWTimestamp, SHA1
+
+metadata = sa.MetaData()
+foo = sa.Table("foo", metadata,
+    sa.Column("foo_id", sa.Integer, primary_key=True),
+    sa.Column("foo_name", sa.UnicodeText),
+    sa.Column("foo_timestamp", MWTimestamp),
+    sa.Column("foo_sha1", SHA1),
+    sa.Column("foo_flag", sa.Boolean),
+)
+sa.Index("foo_name", foo.c.foo_name, unique=True)
+sa.Index("foo_timestamp", foo.c.foo_timestamp)
+
+class FakeCopy:
+    def __init__(self, query, copies):
+        self.rows = []
+        copies.append((query, self.rows))
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @contextlib.contextmanager
+    def copy(self, query):
+        self.conn.executed.append((query, ()))
+        yield FakeCopy(query, self.conn.copies)
+
+class FakeConnection:
+    def __init__(self, empty=True):
+        self.dialect = psycopg_dialect()
+        self.empty = empty
+        self.executed = []
+        self.copies = []
+        driver_connection = types.SimpleNamespace(cursor=lambda: FakeCursor(self))
+        self.connection = types.SimpleNamespace(driver_connection=driver_connection)
+
+    def execute(self, statement, *args):
+        self.executed.append((str(statement), args))
+        if isinstance(statement, sa.sql.Select):
+            return types.SimpleNamespace(first=lambda: None if self.empty else (1,))
+
+ts = datetime.datetime(2020, 1, 2, 3, 4, 5)
+ins = insert(foo).on_conflict_do_nothing()
+
+def test_copy_into_empty_table():
+    conn = FakeConnection()
+    with CopyExecutionQueue(conn, 10, defer_indexes=["foo"]) as q:
+        q.execute(ins, {"foo_id": 1, "foo_name": "a", "foo_timestamp": ts})
+        q.execute(ins, {"foo_id": 2, "foo_name": "b", "foo_timestamp": datetime.datetime.max})
+
+    assert conn.copies == [
+        ("COPY foo (foo_id, foo_name, foo_timestamp) FROM STDIN",
+         [[1, "a", ts], [2, "b", "infinity"]]),
+    ]
+    executed = [query for query, args in conn.executed]
+    # the non-unique index is dropped and created again, the unique index is kept
+    assert "DROP INDEX IF EXISTS foo_timestamp" in executed
+    assert "DROP INDEX IF EXISTS foo_name" not in executed
+    assert "CREATE INDEX foo_timestamp ON foo (foo_timestamp)" in executed
+    assert executed[-1] == "ANALYZE foo"
+
+def test_indexes_kept_by_default():
+    conn = FakeConnection()
+    with CopyExecutionQueue(conn, 10) as q:
+        q.execute(ins, {"foo_id": 1, "foo_name": "a", "foo_timestamp": ts})
+    assert len(conn.copies) == 1
+    executed = [query.split()[0] for query, args in conn.executed]
+    assert executed == ["SELECT", "COPY", "ANALYZE"]
+
+def test_non_empty_table():
+    conn = FakeConnection(empty=False)
+    with CopyExecutionQueue(conn, 10) as q:
+        q.execute(ins, {"foo_id": 1, "foo_name": "a", "foo_timestamp": ts})
+    assert conn.copies == []
+    assert conn.executed[-1][0].startswith("INSERT INTO foo")
+
+def test_not_copyable():
+    conn = FakeConnection()
+    stmt = insert(foo).values(foo_id=sa.bindparam("b_id"))
+    with CopyExecutionQueue(conn, 10) as q:
+        q.execute(stmt, {"b_id": 1})
+        q.execute(foo.update(), {"foo_name": "a"})
+    assert conn.copies == []
+    executed = [query.split()[0] for query, args in conn.executed]
+    assert executed == ["INSERT", "UPDATE"]
+
+def test_order_is_preserved():
+    conn = FakeConnection()
+    with CopyExecutionQueue(conn, 2, defer_indexes=["foo"]) as q:
+        q.execute(ins, {"foo_id": 1, "foo_name": "a", "foo_timestamp": ts})
+        q.execute(foo.update(), {"foo_name": "b"})
+    executed = [query.split()[0] for query, args in conn.executed]
+    assert executed == ["SELECT", "DROP", "COPY", "UPDATE", "CREATE", "ANALYZE"]
+
+def test_copy_postgresql(db):
+    metadata.create_all(db.engine)
+    sha1 = hashlib.sha1(b"foo").hexdigest()
+    entries = [
+        {"foo_id": 1, "foo_name": "a", "foo_timestamp": ts, "foo_sha1": sha1, "foo_flag": True},
+        {"foo_id": 2, "foo_name": "b", "foo_timestamp": datetime.datetime.max, "foo_sha1": None, "foo_flag": False},
+        {"foo_id": 3, "foo_name": "c\td\ne", "foo_timestamp": None, "foo_sha1": sha1, "foo_flag": None},
+    ]
+    try:
+        with db.engine.begin() as conn:
+            with CopyExecutionQueue(conn, 10, defer_indexes=["foo"]) as q:
+                for entry in entries:
+                    q.execute(ins, entry)
+                q.execute_deferred()
+                assert q.copied_rows == {"foo": 3}
+                # the non-unique index is dropped while loading
+                assert {index["name"] for index in sa.inspect(conn).get_indexes("foo")} == {"foo_name"}
+
+        with db.engine.connect() as conn:
+            # the values are converted the same way as for INSERT
+            rows = conn.execute(foo.select().order_by(foo.c.foo_id)).mappings().all()
+            assert [dict(row) for row in rows] == entries
+            raw_sha1 = conn.execute(sa.text("SELECT foo_sha1 FROM foo WHERE foo_id = 1")).scalar()
+            assert bytes(raw_sha1) == SHA1().process_bind_param(sha1, conn.dialect)
+            # the dropped index is created again
+            assert {index["name"] for index in sa.inspect(conn).get_indexes("foo")} == {"foo_name", "foo_timestamp"}
+    finally:
+        metadata.drop_all(db.engine)
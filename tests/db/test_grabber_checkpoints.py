@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+import copy
+import datetime
+
+import pytest
+
+from ws.db.grabbers.GrabberBase import GrabberBase, Checkpoint
+
+from fixtures.fakes import FakeDatabase
+
+class FakeAPI:
+    """
+    Serves lists of integers in responses of ``page_size`` items, with the
+    continuation semantics of :py:meth:`ws.client.api.API.list`.
+    """
+    def __init__(self, lists, page_size=3):
+        self.lists = lists
+        self.page_size = page_size
+        self.requests = []
+
+    def list(self, params, *, continuation=None):
+        items = self.lists[params["list"]]
+        offset = 0
+        if continuation is not None and continuation.get("continue"):
+            offset = continuation["continue"]["offset"]
+        while True:
+            last_continue = {"offset": offset}
+            if continuation is not None:
+                continuation["continue"] = last_continue
+            self.requests.append((params["list"], offset))
+            yield from items[offset:offset + self.page_size]
+            offset += self.page_size
+            if offset >= len(items):
+                break
+
+def make_db():
+    return FakeDatabase(chunk_size=2, checkpoint_rows=1, checkpoint=None, sync_timestamp=None)
+
+class ResumableGrabber(GrabberBase):
+    def __init__(self, api, db, fail=None):
+        super().__init__(api, db)
+        self.fail = fail
+
+    def gen_entries(self, item):
+        if item == self.fail:
+            raise ConnectionError(item)
+        yield ("insert", item)
+
+    def gen_insert(self):
+        yield from self.gen_resumable_list("first", {"list": "first"}, self.gen_entries)
+        yield from self.gen_resumable_list("second", {"list": "second"}, self.gen_entries)
+
+    def _set_sync_timestamp(self, timestamp, conn=None):
+        conn.state["sync_timestamp"] = timestamp
+
+    def _set_checkpoint(self, timestamp, state, conn):
+        conn.state["checkpoint"] = (timestamp, copy.deepcopy(state))
+
+    def _get_checkpoint(self):
+        return copy.deepcopy(self.db.committed["checkpoint"])
+
+    def _clear_checkpoint(self, conn):
+        conn.state["checkpoint"] = None
+
+@pytest.fixture(autouse=True)
+def no_indexes(monkeypatch):
+    monkeypatch.setattr("ws.db.grabbers.GrabberBase.restore_indexes", lambda conn, tables: None)
+
+LISTS = {"first": list(range(0, 10)), "second": list(range(100, 107))}
+
+def test_gen_resumable_list():
+    g = ResumableGrabber(FakeAPI(LISTS), make_db())
+    items = list(g.gen_resumable_list("first", {"list": "first"}, g.gen_entries))
+    checkpoints = [item.state for item in items if isinstance(item, Checkpoint)]
+    assert checkpoints == [{"stage": "first", "continue": {"offset": i}} for i in [0, 3, 6, 9]]
+    assert [item[1] for item in items if not isinstance(item, Checkpoint)] == LISTS["first"]
+
+@pytest.mark.parametrize("fail", [4, 9, 104])
+def test_resume(fail):
+    db = make_db()
+    g = ResumableGrabber(FakeAPI(LISTS), db, fail=fail)
+    with pytest.raises(ConnectionError):
+        g.insert()
+    # the data before the last checkpoint is committed
+    timestamp, state = db.committed["checkpoint"]
+    assert db.committed["sync_timestamp"] is None
+    assert db.committed["rows"] and fail not in db.committed["rows"]
+
+    api = FakeAPI(LISTS)
+    g = ResumableGrabber(api, db)
+    g.insert()
+    # the responses before the checkpoint are not requested again
+    assert api.requests[0] == (state["stage"], state["continue"]["offset"])
+    assert db.committed["rows"] == LISTS["first"] + LISTS["second"]
+    assert db.committed["checkpoint"] is None
+    assert db.committed["sync_timestamp"] == timestamp
+
+def test_no_checkpoint_commits():
+    db = make_db()
+    db.checkpoint_rows = None
+    g = ResumableGrabber(FakeAPI(LISTS), db)
+    g.insert()
+    assert db.committed["rows"] == LISTS["first"] + LISTS["second"]
+    # predelete and the import
+    assert db.commits == 2
+
+def test_resume_unknown_stage():
+    db = make_db()
+    db.committed["checkpoint"] = (datetime.datetime(2020, 1, 1), {"stage": "removed", "continue": None})
+    g = ResumableGrabber(FakeAPI(LISTS), db)
+    with pytest.raises(RuntimeError):
+        g.insert()
+    assert db.committed["checkpoint"] is None
+    assert db.committed["sync_timestamp"] is None
@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+import datetime
+
+import pytest
+
+from ws.db.grabbers.GrabberBase import GrabberBase, ShardProgress, split_time_range
+from ws.db.grabbers.revision import GrabberRevisions
+
+from fixtures.fakes import FakeDatabase, SchemaDatabase
+
+def dt(*args):
+    return datetime.datetime(*args)
+
+def test_split_time_range():
+    shards = split_time_range(dt(2020, 1, 1), dt(2020, 1, 5), 4)
+    assert shards == [
+        (None, dt(2020, 1, 1, 23, 59, 59)),
+        (dt(2020, 1, 2), dt(2020, 1, 2, 23, 59, 59)),
+        (dt(2020, 1, 3), dt(2020, 1, 3, 23, 59, 59)),
+        (dt(2020, 1, 4), None),
+    ]
+
+def test_split_short_range():
+    # the boundaries are whole seconds, so there cannot be more shards than seconds
+    shards = split_time_range(dt(2020, 1, 1), dt(2020, 1, 1, 0, 0, 3), 8)
+    assert shards == [
+        (None, dt(2020, 1, 1, 0, 0, 0)),
+        (dt(2020, 1, 1, 0, 0, 1), dt(2020, 1, 1, 0, 0, 1)),
+        (dt(2020, 1, 1, 0, 0, 2), None),
+    ]
+
+def test_split_single_shard():
+    assert split_time_range(dt(2020, 1, 1), dt(2020, 1, 5), 1) == [(None, None)]
+
+def test_progress():
+    progress = ShardProgress("test", 1, 2, dt(2020, 1, 1), dt(2020, 1, 5), interval=3600)
+    assert progress.fraction() == 0
+    assert progress.eta() is None
+    progress.update(dt(2020, 1, 2))
+    progress.update(None, items=2)
+    assert progress.items == 3
+    assert progress.fraction() == 0.25
+    assert progress.eta() is not None
+
+class ShardedGrabber(GrabberBase):
+    # entries keyed by their timestamps
+    entries = [dt(2020, 1, d) for d in range(1, 11)]
+
+    def __init__(self, db, **kwargs):
+        super().__init__(None, db, **kwargs)
+        self.sync_timestamp = None
+
+    def get_oldest_timestamp(self):
+        return self.entries[0]
+
+    def gen_insert(self):
+        for entry in self.entries:
+            yield ("insert", entry)
+
+    def gen_insert_shard(self, start, end, progress):
+        for entry in self.entries:
+            if (start is None or entry >= start) and (end is None or entry <= end):
+                if entry == self.fail:
+                    raise RuntimeError(entry)
+                progress.update(entry)
+                yield ("insert", entry)
+
+    def gen_insert_unsharded(self):
+        for entry in self.unsharded:
+            yield ("insert", entry)
+
+    fail = None
+    unsharded = []
+
+    def _set_sync_timestamp(self, timestamp, conn=None):
+        self.sync_timestamp = timestamp
+
+    def _get_checkpoint(self):
+        return None
+
+    def _clear_checkpoint(self, conn):
+        pass
+
+@pytest.mark.parametrize("import_concurrency", [1, 3])
+def test_insert_sharded(import_concurrency):
+    db = FakeDatabase()
+    g = ShardedGrabber(db, import_concurrency=import_concurrency)
+    g.insert()
+    assert sorted(db.committed["rows"]) == g.entries
+    assert g.sync_timestamp is not None
+
+def test_insert_sharded_failure():
+    db = FakeDatabase()
+    g = ShardedGrabber(db, import_concurrency=3)
+    g.fail = dt(2020, 1, 5)
+    with pytest.raises(RuntimeError):
+        g.insert()
+    assert g.sync_timestamp is None
+
+def test_insert_unsharded():
+    db = FakeDatabase()
+    g = ShardedGrabber(db, import_concurrency=3)
+    g.unsharded = ["deleted 1", "deleted 2"]
+    g.insert()
+    rows = db.committed["rows"]
+    # the unsharded entries are imported exactly once
+    assert sorted(r for r in rows if isinstance(r, str)) == g.unsharded
+    assert sorted(r for r in rows if not isinstance(r, str)) == g.entries
+
+class StrictAPI:
+    """
+    Records the list queries and rejects the parameters which MediaWiki
+    rejects.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def list(self, params, **kwargs):
+        if ({"adrstart", "adrend"} & set(params)) and "adruser" not in params:
+            raise ValueError("adrstart and adrend can be used only along with adruser")
+        self.queries.append(params)
+        yield from ()
+
+def test_revisions_shards():
+    api = StrictAPI()
+    g = GrabberRevisions(api, SchemaDatabase(), import_concurrency=3)
+    progress = ShardProgress("test", 1, 2, dt(2020, 1, 1), dt(2020, 1, 5))
+    assert list(g.gen_insert_shard(dt(2020, 1, 2), dt(2020, 1, 3), progress)) == []
+    assert list(g.gen_insert_unsharded()) == []
+    assert [q["list"] for q in api.queries] == ["allrevisions", "alldeletedrevisions"]
+    assert api.queries[0]["arvstart"] == dt(2020, 1, 2)
+    assert api.queries[0]["arvend"] == dt(2020, 1, 3)
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+
+import threading
+import time
+
+import pytest
+
+from ws.db.grabbers import GRABBERS, check_dependencies, run_grabbers, get_critical_path
+
+def make_grabber(name, depends_on=()):
+    return type(name, (), {"DEPENDS_ON": list(depends_on)})
+
+A = make_grabber("A")
+B = make_grabber("B", ["A"])
+C = make_grabber("C", ["A"])
+D = make_grabber("D", ["B", "C"])
+GRAPH = [A, B, C, D]
+
+class Recorder:
+    def __init__(self, delays=None, fail=None):
+        self.delays = delays or {}
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, grabber):
+        name = grabber.__name__
+        with self.lock:
+            self.started.append(name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delays.get(name, 0))
+        with self.lock:
+            self.running -= 1
+            self.finished.append(name)
+        if name == self.fail:
+            raise RuntimeError(name)
+
+def test_repo_grabbers_are_ordered():
+    check_dependencies(GRABBERS)
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        check_dependencies([make_grabber("X", ["Y"])])
+
+def test_dependency_order():
+    with pytest.raises(ValueError):
+        check_dependencies([B, A])
+
+def test_sequential():
+    run = Recorder()
+    durations = run_grabbers(GRAPH, run, concurrency=1)
+    assert run.started == ["A", "B", "C", "D"]
+    assert run.max_running == 1
+    assert set(durations) == {"A", "B", "C", "D"}
+
+def test_concurrent():
+    run = Recorder(delays={"B": 0.2, "C": 0.2})
+    run_grabbers(GRAPH, run, concurrency=4)
+    assert run.max_running == 2
+    assert run.started[0] == "A"
+    assert run.finished[-1] == "D"
+
+def test_failure_stops_dependents():
+    run = Recorder(delays={"C": 0.2}, fail="B")
+    with pytest.raises(RuntimeError):
+        run_grabbers(GRAPH, run, concurrency=4)
+    # the running grabber is finished, but the dependent one is not started
+    assert "C" in run.finished
+    assert "D" not in run.started
+
+def test_critical_path():
+    durations = {"A": 1, "B": 5, "C": 2, "D": 1}
+    assert get_critical_path(GRAPH, durations) == (["A", "B", "D"], 7)
@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+
+import datetime
+
+import pytest
+
+from ws.db.grabbers import GRABBERS
+from ws.db.sync_daemon import SyncDaemon, get_affected_grabbers
+
+ALL = set(grabber.__name__ for grabber in GRABBERS)
+
+def make_change(rcid, type_="edit", logtype=None, minute=0):
+    change = {"rcid": rcid, "type": type_, "timestamp": datetime.datetime(2020, 1, 1, 0, minute)}
+    if logtype is not None:
+        change["logtype"] = logtype
+    return change
+
+class FakeAPI:
+    def __init__(self):
+        self.changes = []
+        self.requests = []
+
+    def list(self, params):
+        self.requests.append(dict(params))
+        start = params.get("rcstart")
+        for change in self.changes:
+            if start is None or change["timestamp"] >= start:
+                yield change
+
+class FakeDaemon(SyncDaemon):
+    def __init__(self, api, **kwargs):
+        super().__init__(api, None, **kwargs)
+        self.synchronized = []
+        self.notifications = []
+
+    def _synchronize(self, only=None):
+        self.synchronized.append(only)
+
+    def _load_last_change(self):
+        changes = self.api.changes
+        self.last_timestamp = max((change["timestamp"] for change in changes), default=None)
+        self.last_rcid = max((change["rcid"] for change in changes), default=None)
+
+    def notify(self, names):
+        self.notifications.append(sorted(names))
+
+@pytest.mark.parametrize("changes, expected", [
+    ([], set()),
+    ([make_change(1)], {"GrabberRecentChanges", "GrabberLogging", "GrabberPages", "GrabberRevisions"}),
+    ([make_change(1, "log", "block")], {"GrabberRecentChanges", "GrabberLogging", "GrabberIPBlocks"}),
+    ([make_change(1, "log", "newusers"), make_change(2, "log", "patrol")],
+        {"GrabberRecentChanges", "GrabberLogging", "GrabberUsers"}),
+    ([make_change(1, "log", "unknown")], ALL),
+    ([make_change(1, "unknown")], ALL),
+])
+def test_get_affected_grabbers(changes, expected):
+    assert get_affected_grabbers(changes) == expected
+
+def test_affected_grabbers_exist():
+    from ws.db import sync_daemon
+    names = set(sync_daemon.COMMON_GRABBERS)
+    for affected in list(sync_daemon.RC_TYPE_GRABBERS.values()) + list(sync_daemon.LOG_TYPE_GRABBERS.values()):
+        names |= affected
+    assert names <= ALL
+
+def test_next_interval():
+    daemon = FakeDaemon(FakeAPI(), min_interval=5, max_interval=60, backoff=2)
+    assert [daemon.next_interval(False) for i in range(5)] == [10, 20, 40, 60, 60]
+    assert daemon.next_interval(True) == 5
+    assert daemon.next_interval(False) == 10
+
+def test_invalid_intervals():
+    with pytest.raises(ValueError):
+        FakeDaemon(FakeAPI(), min_interval=10, max_interval=5)
+    with pytest.raises(ValueError):
+        FakeDaemon(FakeAPI(), backoff=0.5)
+
+def test_poll():
+    api = FakeAPI()
+    api.changes = [make_change(1), make_change(2, minute=1)]
+    daemon = FakeDaemon(api)
+    daemon.full_sync()
+    assert daemon.synchronized == [None]
+    assert daemon.notifications == [sorted(ALL)]
+
+    # no changes - the last change is skipped by its ID
+    assert daemon.poll() == set()
+    assert api.requests[-1]["rcstart"] == datetime.datetime(2020, 1, 1, 0, 1)
+    assert len(daemon.synchronized) == 1
+
+    api.changes.append(make_change(3, "log", "block", minute=1))
+    api.changes.append(make_change(4, "log", "rights", minute=2))
+    names = daemon.poll()
+    assert names == {"GrabberRecentChanges", "GrabberLogging", "GrabberIPBlocks", "GrabberUsers"}
+    assert daemon.synchronized[-1] == names
+    assert daemon.notifications[-1] == sorted(names)
+    assert daemon.last_rcid == 4
+    assert daemon.last_timestamp == datetime.datetime(2020, 1, 1, 0, 2)
+
+def test_run(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("time.sleep", sleeps.append)
+    api = FakeAPI()
+    daemon = FakeDaemon(api, min_interval=1, max_interval=8, full_sync_interval=None)
+
+    polls = iter([[], [], [make_change(1)], []])
+    def get_changes():
+        return next(polls)
+    daemon.get_changes = get_changes
+
+    daemon.run(iterations=5)
+    # full sync, two idle polls, a change and an idle poll
+    assert daemon.synchronized[0] is None
+    assert len(daemon.synchronized) == 2
+    assert sleeps == [1, 2, 4, 1]
+
+def test_run_survives_errors(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda interval: None)
+    daemon = FakeDaemon(FakeAPI(), full_sync_interval=None)
+    calls = []
+    def get_changes():
+        calls.append(1)
+        raise ConnectionError
+    daemon.get_changes = get_changes
+    daemon.run(iterations=3)
+    assert len(calls) == 2
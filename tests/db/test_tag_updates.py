@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+import datetime
+import time
+import types
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from ws.db.execution import DeferrableExecutionQueue
+from ws.db.grabbers.revision import GrabberRevisions
+
+from fixtures.fakes import SchemaDatabase
+
+TABLES = ["tagged_revision", "tagged_archived_revision", "tagged_recentchange"]
+
+def test_gen_tag_updates():
+    g = GrabberRevisions(types.SimpleNamespace(), SchemaDatabase())
+    added = {5: {"b", "a"}, 3: {"c"}}
+    removed = {7: {"a"}}
+    queries = list(g.gen_tag_updates(added, removed))
+    assert [q for q, e in queries] == [g.sql["insert-set", t] for t in TABLES] + [g.sql["delete-set", t] for t in TABLES]
+    assert queries[0][1] == {"b_rev_ids": [3, 5, 5], "b_tag_names": ["c", "a", "b"]}
+    assert queries[-1][1] == {"b_rev_ids": [7], "b_tag_names": ["a"]}
+
+@pytest.mark.parametrize("added, removed, actions", [
+    ({}, {}, []),
+    ({1: set()}, {}, []),
+    ({1: {"a"}}, {2: set()}, ["insert-set"]),
+    ({}, {2: {"a"}}, ["delete-set"]),
+])
+def test_gen_tag_updates_empty(added, removed, actions):
+    g = GrabberRevisions(types.SimpleNamespace(), SchemaDatabase())
+    queries = [q for q, e in g.gen_tag_updates(added, removed)]
+    assert queries == [g.sql[action, t] for action in actions for t in TABLES]
+
+@pytest.mark.parametrize("action", ["insert-set", "delete-set"])
+@pytest.mark.parametrize("table", TABLES)
+def test_tag_update_statements(action, table):
+    g = GrabberRevisions(types.SimpleNamespace(), SchemaDatabase())
+    sql = str(g.sql[action, table].compile(dialect=postgresql.dialect()))
+    assert "unnest(%(b_rev_ids)s::INTEGER[], %(b_tag_names)s::TEXT[])" in sql
+    if action == "insert-set":
+        assert "ON CONFLICT DO NOTHING" in sql
+
+def populate(db, count):
+    """
+    Creates ``count`` revisions with recent changes. The foreign key checks are disabled, so the referenced pages,
+    users and namespaces do not have to exist.
+    """
+    timestamp = datetime.datetime(2020, 1, 1)
+    with db.engine.begin() as conn:
+        conn.execute(sa.text("SET LOCAL session_replication_role = replica"))
+        conn.execute(db.tag.insert(), [{"tag_id": i, "tag_name": "tag{}".format(i), "tag_displayname": "Tag {}".format(i)}
+                                       for i in range(1, 6)])
+        conn.execute(db.revision.insert(), [{"rev_id": i, "rev_page": 1, "rev_comment": "", "rev_user": 1,
+                                             "rev_user_text": "User", "rev_timestamp": timestamp}
+                                            for i in range(1, count + 1)])
+        conn.execute(db.recentchanges.insert(), [{"rc_id": i, "rc_this_oldid": i, "rc_timestamp": timestamp,
+                                                  "rc_user_text": "User", "rc_namespace": 0, "rc_title": "Title",
+                                                  "rc_comment": "", "rc_type": "edit"}
+                                                 for i in range(1, count + 1)])
+
+def per_pair_tag_updates(g, added_tags):
+    """
+    Reference implementation probing the revision and recentchanges tables
+    for each (revid, tag) pair.
+    """
+    for revid, added in added_tags.items():
+        for tag in added:
+            db_entry = {"b_rev_id": revid, "b_tag_name": tag}
+            with g.db.engine.connect() as conn:
+                if conn.execute(sa.select(sa.exists().where(g.db.revision.c.rev_id == revid))).scalar():
+                    yield g.sql["insert", "tagged_revision"], db_entry
+                else:
+                    yield g.sql["insert", "tagged_archived_revision"], db_entry
+                if conn.execute(sa.select(sa.exists().where(g.db.recentchanges.c.rc_this_oldid == revid))).scalar():
+                    yield g.sql["insert", "tagged_recentchange"], db_entry
+
+def execute(db, gen):
+    with db.engine.begin() as conn:
+        queue = DeferrableExecutionQueue(conn, db.chunk_size)
+        for query, entry in gen:
+            queue.execute(query, entry)
+        queue.execute_deferred()
+
+def count_tags(db):
+    with db.engine.connect() as conn:
+        return tuple(conn.execute(sa.select(sa.func.count()).select_from(db.metadata.tables[t])).scalar()
+                     for t in TABLES)
+
+def test_benchmark_tag_updates(db, capsys):
+    """
+    Compares the time of the tag updates with the per-pair probes and with
+    the set-based statements depending on the number of changed revisions.
+    """
+    sizes = [100, 1000, 10000]
+    populate(db, max(sizes))
+    g = GrabberRevisions(types.SimpleNamespace(), db)
+
+    with capsys.disabled():
+        print("\ntag updates of changed revisions (2 tags per revision):")
+        for size in sizes:
+            added_tags = dict((revid, {"tag1", "tag2"}) for revid in range(1, size + 1))
+            timings = {}
+            for name, gen in [("per-pair", lambda: per_pair_tag_updates(g, added_tags)),
+                              ("set-based", lambda: g.gen_tag_updates(added_tags, {}))]:
+                start = time.perf_counter()
+                execute(db, gen())
+                timings[name] = time.perf_counter() - start
+                assert count_tags(db) == (2 * size, 0, 2 * size)
+
+                start = time.perf_counter()
+                execute(db, g.gen_tag_updates({}, added_tags))
+                timings["delete"] = time.perf_counter() - start
+                assert count_tags(db) == (0, 0, 0)
+            print("  {:6} revisions: per-pair {:7.3f} s, set-based {:7.3f} s (delete {:7.3f} s)"
+                  .format(size, timings["per-pair"], timings["set-based"], timings["delete"]))
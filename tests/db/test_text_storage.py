@@ -0,0 +1,356 @@
+#! /usr/bin/env python3
+
+import hashlib
+import itertools
+import random
+import threading
+import timeit
+import types
+
+import pytest
+import sqlalchemy as sa
+
+from ws.db import schema
+from ws.db.text_storage import TextStorage, TextDeduplicator, FLAG_ZSTD, FLAG_DELTA, make_delta, apply_delta
+from ws.db.grabbers.revision import GrabberRevisions
+
+zstandard = pytest.importorskip("zstandard")
+
+@pytest.fixture
+def db():
+    # the tables used by TextStorage work in SQLite too
+    metadata = sa.MetaData()
+    schema.create_tables(metadata)
+    tables = [metadata.tables["text"], metadata.tables["ws_text_dictionary"]]
+    engine = sa.create_engine("sqlite://")
+    metadata.create_all(engine, tables=tables)
+    return types.SimpleNamespace(engine=engine, text=tables[0], ws_text_dictionary=tables[1])
+
+WORDS = ("the of and to in is for on that with as by this page wiki arch linux package "
+         "install configuration file system service kernel boot user network").split()
+
+def make_history(count, seed=0):
+    """
+    Generates a synthetic history of wikitext revisions: groups of successive
+    edits of pages with sections, templates and links. Returns a list of
+    ``(revid, parentid, text)`` tuples.
+    """
+    rnd = random.Random(seed)
+    history = []
+    while len(history) < count:
+        lines = ["{{Lowercase title}}", "[[Category:Example]]"]
+        for section in range(rnd.randint(2, 6)):
+            lines.append("== {} ==".format(" ".join(rnd.choices(WORDS, k=3)).capitalize()))
+            for _ in range(rnd.randint(1, 4)):
+                words = rnd.choices(WORDS, k=rnd.randint(20, 60))
+                words[rnd.randrange(len(words))] = "[[{}]]".format(rnd.choice(WORDS))
+                lines.append(" ".join(words) + ".")
+            lines.append("{{{{ic|/etc/{}.conf}}}}".format(rnd.choice(WORDS)))
+        # successive revisions of the page
+        parentid = 0
+        for _ in range(rnd.randint(1, 10)):
+            i = rnd.randrange(len(lines))
+            lines.insert(i, " ".join(rnd.choices(WORDS, k=rnd.randint(5, 30))))
+            revid = len(history) + 1
+            history.append((revid, parentid, "\n".join(lines)))
+            parentid = revid
+    return history[:count]
+
+def make_corpus(count, seed=0):
+    """
+    Returns the texts of :py:func:`make_history`.
+    """
+    return [text for revid, parentid, text in make_history(count, seed)]
+
+def store_history(db, storage, history, **kwargs):
+    """
+    Encodes the history with a :py:class:`TextEncoder` and stores it in the
+    ``text`` table. The ``old_id`` of each text is equal to the revid.
+    """
+    encoder = storage.make_encoder(**kwargs)
+    entries = []
+    for revid, parentid, text in history:
+        entry = encoder.encode(text, text_id=revid, rev_id=revid, parent_id=parentid)
+        entry["old_id"] = revid
+        entries.append(entry)
+    with db.engine.begin() as conn:
+        conn.execute(db.text.insert(), entries)
+    return entries
+
+def test_plain(db):
+    storage = TextStorage(db)
+    entry = storage.encode("foo")
+    assert entry == {"old_text": "foo", "old_flags": "", "old_blob": None, "old_base_id": None}
+    assert storage.decode(entry["old_text"], entry["old_flags"], entry["old_blob"]) == "foo"
+
+def test_zstd(db):
+    storage = TextStorage(db, compression="zstd")
+    text = "foo bar " * 100
+    entry = storage.encode(text)
+    assert entry["old_text"] is None
+    assert entry["old_flags"] == FLAG_ZSTD
+    assert len(entry["old_blob"]) < len(text)
+    assert storage.decode(entry["old_text"], entry["old_flags"], entry["old_blob"]) == text
+
+def test_invalid_flags(db):
+    storage = TextStorage(db)
+    with pytest.raises(ValueError):
+        storage.decode(None, "gzip", b"")
+    with pytest.raises(ValueError):
+        TextStorage(db, compression="gzip")
+
+@pytest.mark.parametrize("base, text", [
+    ("", ""),
+    ("", "foo\nbar"),
+    ("foo\nbar", ""),
+    ("foo\nbar\nbaz", "foo\nbaz\n"),
+    ("foo\nbar\nbaz\n", "qux\nfoo\nbar\nquux\nbaz"),
+    ("a\r\nb\rc", "a\r\nx\rc"),
+])
+def test_delta(base, text):
+    assert apply_delta(base, make_delta(base, text)) == text
+
+@pytest.mark.parametrize("compression", [None, "zstd"])
+def test_keyframes(db, compression):
+    history = make_history(200)
+    writer = TextStorage(db, compression=compression, keyframe_interval=4)
+    entries = store_history(db, writer, history)
+
+    lengths = {}
+    for (revid, parentid, text), entry in zip(history, entries):
+        flags = entry["old_flags"].split(",")
+        if entry["old_base_id"] is None:
+            assert FLAG_DELTA not in flags
+            lengths[revid] = 1
+        else:
+            assert FLAG_DELTA in flags
+            assert entry["old_text"] is None
+            assert entry["old_base_id"] == parentid
+            lengths[revid] = lengths[parentid] + 1
+        assert (FLAG_ZSTD in flags) == (compression is not None)
+    # the chains are bounded by the interval and the deltas are actually used
+    assert max(lengths.values()) == 4
+    assert sum(entry["old_base_id"] is not None for entry in entries) > len(entries) / 2
+
+    # a fresh instance loads the bases from the database
+    reader = TextStorage(db, cache_size=8)
+    for (revid, parentid, text), entry in zip(reversed(history), reversed(entries)):
+        assert reader.decode(entry["old_text"], entry["old_flags"], entry["old_blob"], entry["old_base_id"]) == text
+    assert len(reader._texts) == 8
+
+def test_keyframes_unknown_parent(db):
+    storage = TextStorage(db, keyframe_interval=10)
+    encoder = storage.make_encoder(cache_size=2)
+    history = make_history(10)
+    entries = [encoder.encode(text, text_id=revid, rev_id=revid, parent_id=parentid)
+               for revid, parentid, text in history]
+    assert entries[0]["old_base_id"] is None
+    assert entries[1]["old_base_id"] == history[0][0]
+    # without rev_id, the encoder falls back to the plain encoding
+    assert encoder.encode("foo", text_id=100) == storage.encode("foo")
+    # the parent was forgotten
+    assert encoder.encode(history[1][2], text_id=101, rev_id=101, parent_id=history[0][0])["old_base_id"] is None
+
+def test_keyframes_per_thread(db):
+    storage = TextStorage(db, keyframe_interval=10)
+    encoder = storage.make_encoder(per_thread=True)
+    history = make_history(2)
+    assert history[1][1] == history[0][0]
+    encoder.encode(history[0][2], text_id=1, rev_id=history[0][0])
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        encoder.encode(history[1][2], text_id=2, rev_id=history[1][0], parent_id=history[1][1])))
+    thread.start()
+    thread.join()
+    assert result[0]["old_base_id"] is None
+    assert encoder.encode(history[1][2], text_id=2, rev_id=history[1][0], parent_id=history[1][1])["old_base_id"] == 1
+
+def test_deduplicator(db):
+    text = "žluťoučký kůň"
+    assert TextDeduplicator.get_key(text) == (hashlib.sha1(text.encode("utf-8")).hexdigest(), 19)
+    with db.engine.begin() as conn:
+        conn.execute(db.text.insert(), [{"old_id": 1, "old_text": "foo", "old_sha1": TextDeduplicator.get_key("foo")[0], "old_len": 3}])
+
+    dedup = TextDeduplicator(db)
+    dedup.prefetch([TextDeduplicator.get_key("foo"), TextDeduplicator.get_key("bar")])
+    assert dedup.get(TextDeduplicator.get_key("foo")) == 1
+    assert dedup.get(TextDeduplicator.get_key("bar")) is None
+    assert dedup.add(TextDeduplicator.get_key("bar"), 2) == {"old_sha1": TextDeduplicator.get_key("bar")[0], "old_len": 3}
+    assert dedup.get(TextDeduplicator.get_key("bar")) == 2
+
+def test_deduplicator_per_thread(db):
+    dedup = TextDeduplicator(db, per_thread=True)
+    key = TextDeduplicator.get_key("foo")
+    assert dedup.add(key, 1) == {"old_sha1": key[0], "old_len": 3}
+    assert dedup.get(key) == 1
+    result = []
+    def other():
+        # the text is not visible in other threads, they store their own copy
+        result.append(dedup.get(key))
+        result.append(dedup.add(key, 2))
+        result.append(dedup.get(key))
+    thread = threading.Thread(target=other)
+    thread.start()
+    thread.join()
+    assert result == [None, {"old_sha1": key[0], "old_len": 3}, 2]
+    assert dedup.get(key) == 1
+
+def test_deduplicator_concurrent_connections(tmp_path):
+    # two writers with their own connections store the same text before
+    # either of them commits
+    metadata = sa.MetaData()
+    schema.create_tables(metadata)
+    engine = sa.create_engine("sqlite:///{}".format(tmp_path / "text.db"))
+    metadata.create_all(engine, tables=[metadata.tables["text"]])
+    db = types.SimpleNamespace(engine=engine, text=metadata.tables["text"])
+
+    key = TextDeduplicator.get_key("foo")
+    writers = [TextDeduplicator(db), TextDeduplicator(db)]
+    entries = []
+    for text_id, dedup in enumerate(writers, start=1):
+        dedup.prefetch([key])
+        assert dedup.get(key) is None
+        entries.append({"old_id": text_id, "old_text": "foo", **dedup.add(key, text_id)})
+    for entry in entries:
+        with engine.begin() as conn:
+            conn.execute(db.text.insert(), [entry])
+
+    with engine.connect() as conn:
+        assert conn.execute(sa.select(sa.func.count()).select_from(db.text)).scalar() == 2
+    dedup = TextDeduplicator(db)
+    dedup.prefetch([key])
+    assert dedup.get(key) == 1
+
+def test_gen_text_deduplication(db):
+    grabber = types.SimpleNamespace(
+        text_id_gen=itertools.count(1),
+        text_encoder=TextStorage(db).make_encoder(),
+        text_dedup=TextDeduplicator(db),
+        sql={("insert", "text"): "insert text"},
+    )
+    def gen_text(revid, text):
+        rev = {"revid": revid, "parentid": revid - 1, "slots": {"main": {"*": text}}}
+        gen = GrabberRevisions.gen_text(grabber, rev)
+        queries = []
+        try:
+            while True:
+                queries.append(next(gen))
+        except StopIteration as e:
+            return e.value, queries
+
+    text_id, queries = gen_text(1, "foo")
+    assert text_id == 1
+    assert [q for q, entry in queries] == ["insert text"]
+    assert queries[0][1]["old_sha1"] == hashlib.sha1(b"foo").hexdigest()
+    assert gen_text(2, "bar")[0] == 2
+    # revert
+    assert gen_text(3, "foo") == (1, [])
+
+def test_text_id_gen():
+    sequence = itertools.count(1)
+    batches = []
+
+    class Connection:
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            pass
+        def execute(self, query):
+            compiled = query.compile(dialect=sa.dialects.postgresql.dialect())
+            assert "nextval" in str(compiled) and "generate_series" in str(compiled)
+            batch = compiled.params["generate_series_2"]
+            batches.append(batch)
+            # concurrent writers get interleaved values from the sequence
+            values = [next(sequence) for _ in range(2 * batch)][::2]
+            return types.SimpleNamespace(scalars=lambda: types.SimpleNamespace(all=lambda: values[::-1]))
+
+    grabber = types.SimpleNamespace(db=types.SimpleNamespace(
+        chunk_size=100, engine=types.SimpleNamespace(connect=Connection)))
+    gen = GrabberRevisions._get_text_id_gen(grabber)
+    values = list(itertools.islice(gen, 500))
+    assert values == sorted(set(values))
+    assert batches == [16, 32, 64, 100, 100, 100, 100]
+
+def test_dictionary(db):
+    corpus = make_corpus(500)
+    storage = TextStorage(db)
+    dictionary_id = storage.train_dictionary(corpus, size=16384)
+
+    writer = TextStorage(db, compression="zstd", dictionary_id=dictionary_id)
+    entries = [writer.encode(text) for text in corpus[:10]]
+    # a fresh instance loads the dictionary from the database
+    reader = TextStorage(db)
+    for text, entry in zip(corpus, entries):
+        assert zstandard.get_frame_parameters(entry["old_blob"]).dict_id == dictionary_id
+        assert reader.decode(entry["old_text"], entry["old_flags"], entry["old_blob"]) == text
+
+def test_dictionary_from_table(db):
+    corpus = make_corpus(200)
+    with db.engine.begin() as conn:
+        conn.execute(db.text.insert(), [{"old_id": i, "old_text": text} for i, text in enumerate(corpus)])
+    storage = TextStorage(db)
+    dictionary_id = storage.train_dictionary(sample_count=200, size=8192)
+    assert storage._get_dictionary(dictionary_id).dict_id() == dictionary_id
+
+def test_benchmark(db, capsys):
+    """
+    Compares the storage size and the read latency of the plain, zstd and
+    zstd+dictionary storage on a synthetic corpus.
+    """
+    corpus = make_corpus(2000)
+    train, test = corpus[:1000], corpus[1000:]
+    dictionary_id = TextStorage(db).train_dictionary(train)
+
+    storages = {
+        "plain": TextStorage(db),
+        "zstd": TextStorage(db, compression="zstd"),
+        "zstd+dictionary": TextStorage(db, compression="zstd", dictionary_id=dictionary_id),
+    }
+    raw_size = sum(len(text.encode("utf-8")) for text in test)
+
+    with capsys.disabled():
+        print("\ntext storage on a synthetic corpus of {} revisions ({} KiB):".format(len(test), raw_size // 1024))
+        sizes = {}
+        for name, storage in storages.items():
+            entries = [storage.encode(text) for text in test]
+            sizes[name] = sum(len(e["old_blob"]) if e["old_blob"] is not None else len(e["old_text"].encode("utf-8"))
+                              for e in entries)
+            rows = [(e["old_text"], e["old_flags"], e["old_blob"]) for e in entries]
+            timer = timeit.Timer(lambda: [storage.decode(*row) for row in rows])
+            latency = min(timer.repeat(repeat=3, number=1)) / len(rows)
+            print("  {:16} {:8} KiB ({:5.1f}%), read latency {:7.2f} us/revision"
+                  .format(name, sizes[name] // 1024, 100 * sizes[name] / raw_size, latency * 1e6))
+
+    assert sizes["zstd"] < sizes["plain"]
+    assert sizes["zstd+dictionary"] < sizes["zstd"]
+
+def test_benchmark_keyframes(db, capsys):
+    """
+    Compares the storage size and the cold read latency of the delta storage
+    with different keyframe intervals.
+    """
+    history = make_history(1000)
+    raw_size = sum(len(text.encode("utf-8")) for revid, parentid, text in history)
+
+    with capsys.disabled():
+        print("\ndelta storage on a synthetic history of {} revisions ({} KiB):".format(len(history), raw_size // 1024))
+        sizes = {}
+        for compression in [None, "zstd"]:
+            for interval in [1, 4, 16]:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text.delete())
+                writer = TextStorage(db, compression=compression, keyframe_interval=interval)
+                entries = store_history(db, writer, history)
+                name = "{}, interval {}".format(compression or "plain", interval)
+                sizes[name] = sum(len(e["old_blob"]) if e["old_blob"] is not None else len(e["old_text"].encode("utf-8"))
+                                  for e in entries)
+                rows = [(e["old_text"], e["old_flags"], e["old_blob"], e["old_base_id"]) for e in entries]
+                def read():
+                    reader = TextStorage(db)
+                    return [reader.decode(*row) for row in rows]
+                latency = min(timeit.Timer(read).repeat(repeat=3, number=1)) / len(rows)
+                print("  {:20} {:8} KiB ({:5.1f}%), read latency {:7.2f} us/revision"
+                      .format(name, sizes[name] // 1024, 100 * sizes[name] / raw_size, latency * 1e6))
+
+    assert sizes["plain, interval 4"] < sizes["plain, interval 1"]
+    assert sizes["zstd, interval 16"] < sizes["zstd, interval 1"]
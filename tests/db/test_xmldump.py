@@ -0,0 +1,275 @@
+#! /usr/bin/env python3
+
+import bz2
+import datetime
+import gzip
+import hashlib
+import io
+import types
+
+import pytest
+import sqlalchemy as sa
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ws.db.xmldump import open_dump, parse_dump, XMLDumpImporter, _sha1_base36_to_hex
+
+from fixtures.fakes import SchemaDatabase
+
+DUMP = """\
+<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.11/" version="0.11" xml:lang="en">
+  <siteinfo>
+    <sitename>ArchWiki</sitename>
+    <dbname>archwiki</dbname>
+    <case>first-letter</case>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+      <namespace key="2" case="first-letter">User</namespace>
+    </namespaces>
+  </siteinfo>
+  <page>
+    <title>Main page</title>
+    <ns>0</ns>
+    <id>1</id>
+    <revision>
+      <id>10</id>
+      <timestamp>2010-01-01T00:00:00Z</timestamp>
+      <contributor>
+        <username>Alice</username>
+        <id>5</id>
+      </contributor>
+      <comment>first</comment>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text bytes="5" xml:space="preserve">Hello</text>
+      <sha1>{sha1_hello}</sha1>
+    </revision>
+    <revision>
+      <id>12</id>
+      <parentid>10</parentid>
+      <timestamp>2010-01-02T00:00:00Z</timestamp>
+      <contributor>
+        <ip>10.0.0.1</ip>
+      </contributor>
+      <minor />
+      <comment deleted="deleted" />
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text bytes="12" xml:space="preserve">Hello world!</text>
+      <sha1 />
+    </revision>
+  </page>
+  <page>
+    <title>Talk:Main page</title>
+    <ns>1</ns>
+    <id>2</id>
+    <redirect title="Main page" />
+    <revision>
+      <id>11</id>
+      <timestamp>2010-01-01T12:00:00Z</timestamp>
+      <contributor deleted="deleted" />
+      <comment>redirect</comment>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text deleted="deleted" />
+      <sha1 />
+    </revision>
+  </page>
+</mediawiki>
+"""
+
+def sha1_base36(text):
+    n = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while n:
+        n, r = divmod(n, 36)
+        result = digits[r] + result
+    return result.zfill(31)
+
+def make_dump():
+    return DUMP.format(sha1_hello=sha1_base36("Hello")).encode("utf-8")
+
+def test_sha1_base36_to_hex():
+    assert _sha1_base36_to_hex(sha1_base36("Hello")) == hashlib.sha1(b"Hello").hexdigest()
+    assert _sha1_base36_to_hex(None) is None
+    assert _sha1_base36_to_hex("") is None
+
+@pytest.mark.parametrize("suffix, compress", [
+    ("", lambda data: data),
+    (".gz", gzip.compress),
+    (".bz2", bz2.compress),
+    pytest.param(".zst", lambda data: zstandard.ZstdCompressor().compress(data),
+                 marks=pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")),
+])
+def test_open_dump(tmp_path, suffix, compress):
+    path = tmp_path / ("dump.xml" + suffix)
+    path.write_bytes(compress(make_dump()))
+    with open_dump(str(path)) as f:
+        assert f.read() == make_dump()
+
+def test_parse_dump():
+    events = list(parse_dump(io.BytesIO(make_dump())))
+    assert [event[0] for event in events] == ["siteinfo", "revision", "revision", "page", "revision", "page"]
+
+    siteinfo = events[0][1]
+    assert siteinfo["sitename"] == "ArchWiki"
+    assert siteinfo["namespaces"] == {
+        0: {"id": 0, "case": "first-letter", "*": ""},
+        1: {"id": 1, "case": "first-letter", "*": "Talk"},
+        2: {"id": 2, "case": "first-letter", "*": "User"},
+    }
+
+    page = events[3][1]
+    assert page == {"title": "Main page", "ns": 0, "pageid": 1}
+    assert events[1][1] is page
+
+    rev = events[1][2]
+    assert rev == {
+        "revid": 10,
+        "timestamp": datetime.datetime(2010, 1, 1),
+        "user": "Alice",
+        "userid": 5,
+        "comment": "first",
+        "size": 5,
+        "sha1": hashlib.sha1(b"Hello").hexdigest(),
+        "slots": {"main": {"contentmodel": "wikitext", "contentformat": "text/x-wiki", "*": "Hello"}},
+    }
+
+    rev = events[2][2]
+    assert rev["parentid"] == 10
+    assert rev["user"] == "10.0.0.1"
+    assert rev["userid"] == 0
+    assert "minor" in rev
+    assert "commenthidden" in rev
+    assert rev["sha1"] is None
+
+    page = events[5][1]
+    assert page == {"title": "Talk:Main page", "ns": 1, "pageid": 2, "redirect": ""}
+    rev = events[4][2]
+    assert "userhidden" in rev
+    assert "texthidden" in rev
+    assert "*" not in rev["slots"]["main"]
+    assert rev["size"] is None
+
+def test_parse_stub_dump():
+    dump = make_dump().replace(b'<text bytes="5" xml:space="preserve">Hello</text>',
+                               b'<text bytes="5" id="100" />')
+    events = list(parse_dump(io.BytesIO(dump)))
+    rev = events[1][2]
+    assert rev["size"] == 5
+    assert "*" not in rev["slots"]["main"]
+
+def test_gen_insert():
+    db = SchemaDatabase()
+    importer = XMLDumpImporter(db, with_content=False)
+    entries = {}
+    for statement, entry in importer.gen_insert(parse_dump(io.BytesIO(make_dump()))):
+        entries.setdefault(statement.table.name, []).append(entry)
+
+    assert [entry["ns_id"] for entry in entries["namespace"]] == [0, 1, 2]
+    assert [(entry["user_id"], entry["user_name"]) for entry in entries["user"]] == [(0, "Anonymous"), (5, "Alice")]
+
+    revisions = dict((entry["rev_id"], entry) for entry in entries["revision"])
+    assert revisions.keys() == {10, 11, 12}
+    assert revisions[12]["rev_user"] == 0
+    assert revisions[12]["rev_user_text"] == "10.0.0.1"
+    assert revisions[12]["rev_deleted"] == 2
+    assert revisions[12]["rev_minor_edit"] is True
+    assert revisions[11]["rev_deleted"] == 1 | 4
+    assert revisions[11]["rev_page"] == 2
+    assert all(entry["rev_text_id"] is None for entry in revisions.values())
+
+    pages = dict((entry["page_id"], entry) for entry in entries["page"])
+    assert pages[1]["page_title"] == "Main page"
+    assert pages[1]["page_latest"] == 12
+    assert pages[1]["page_len"] == 12
+    assert pages[1]["page_is_new"] is False
+    assert pages[1]["page_is_redirect"] is False
+    assert pages[2]["page_title"] == "Main page"
+    assert pages[2]["page_namespace"] == 1
+    assert pages[2]["page_is_new"] is True
+    assert pages[2]["page_is_redirect"] is True
+
+    assert "text" not in entries
+    assert importer.newest_timestamp == datetime.datetime(2010, 1, 2)
+
+class FollowUpAPI:
+    """
+    Answers the queries of the follow-up pass after importing the dump.
+    """
+    site = types.SimpleNamespace(
+        tags=[{"name": "mw-undo", "displayname": "Undo", "description": "", "defined": "", "source": ["core"]}],
+        namespaces={-1: "Special", 0: "", 1: "Talk"},
+    )
+
+    def __init__(self):
+        self.queries = []
+
+    def generator(self, params):
+        self.queries.append(dict(params))
+        if params["gapnamespace"] == 0:
+            yield {"pageid": 1, "ns": 0, "title": "Main page", "touched": datetime.datetime(2010, 1, 2),
+                   "lastrevid": 12, "length": 12, "contentmodel": "wikitext", "pagelanguage": "cs",
+                   "pageprops": {"noindex": ""}, "protection": [{"type": "edit", "level": "sysop", "expiry": "infinity"}]}
+
+    def list(self, params, **kwargs):
+        self.queries.append(dict(params))
+        if params["list"] == "alldeletedrevisions":
+            yield {"pageid": 0, "ns": 0, "title": "Spam", "revisions": [
+                {"revid": 13, "parentid": 0, "user": "Spammer", "userid": 7, "timestamp": datetime.datetime(2010, 1, 2),
+                 "comment": "spam", "size": 4, "sha1": None, "tags": ["mw-undo"],
+                 "slots": {"main": {"contentmodel": "wikitext"}}},
+            ]}
+        elif params["list"] == "allrevisions":
+            yield {"pageid": 1, "ns": 0, "title": "Main page", "revisions": [
+                {"revid": 10, "tags": []},
+                {"revid": 12, "tags": ["mw-undo"]},
+            ]}
+
+def test_gen_insert_from_api():
+    db = SchemaDatabase()
+    db.Title = lambda title: types.SimpleNamespace(dbtitle=lambda ns: title)
+    api = FollowUpAPI()
+    importer = XMLDumpImporter(db, api, with_content=False)
+    list(importer.gen_insert(parse_dump(io.BytesIO(make_dump()))))
+    entries = {}
+    for statement, entry in importer.gen_insert_from_api(importer.newest_timestamp):
+        entries.setdefault(statement.table.name, []).append(entry)
+
+    assert [entry["tag_name"] for entry in entries["tag"]] == ["mw-undo"]
+    assert entries["page"][0]["page_lang"] == "cs"
+    assert entries["page_props"] == [{"pp_page": 1, "pp_propname": "noindex", "pp_value": ""}]
+    assert [entry["pr_type"] for entry in entries["page_restrictions"]] == ["edit"]
+    # only the contributors missing in the dump are added
+    assert [entry["user_id"] for entry in entries["user"]] == [7]
+    assert [entry["ar_rev_id"] for entry in entries["archive"]] == [13]
+    assert entries["tagged_archived_revision"] == [{"b_rev_id": 13, "b_tag_name": "mw-undo"}]
+    assert entries["tagged_revision"] == [{"b_rev_id": 12, "b_tag_name": "mw-undo"}]
+    # the revisions newer than the dump are left for the next synchronization
+    assert api.queries[-1]["arvend"] == datetime.datetime(2010, 1, 2)
+
+def test_import_dump(db, tmp_path):
+    path = tmp_path / "dump.xml.gz"
+    path.write_bytes(gzip.compress(make_dump()))
+    # the queue is flushed in the middle of the import, while the texts of
+    # the next pages are looked up on another connection
+    db.bulk_load = True
+    db.chunk_size = 2
+    importer = XMLDumpImporter(db)
+    importer.import_dump(str(path))
+
+    with db.engine.connect() as conn:
+        rows = conn.execute(sa.select(db.revision.c.rev_id, db.text.c.old_text)
+                              .select_from(db.revision.outerjoin(db.text, db.revision.c.rev_text_id == db.text.c.old_id))
+                              .order_by(db.revision.c.rev_id)).all()
+        assert [tuple(row) for row in rows] == [(10, "Hello"), (11, None), (12, "Hello world!")]
+        timestamps = dict(conn.execute(sa.select(db.ws_sync.c.wss_key, db.ws_sync.c.wss_timestamp)).all())
+    assert timestamps == {
+        "GrabberPages": datetime.datetime(2010, 1, 2),
+        "GrabberRevisions": datetime.datetime(2010, 1, 2),
+    }
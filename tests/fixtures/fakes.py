@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+
+"""
+Fake objects shared by the tests which do not need a real server or database.
+"""
+
+import contextlib
+import copy
+import io
+import json
+import threading
+import types
+
+import sqlalchemy as sa
+
+from ws.db import schema
+
+class FakeResponse:
+    """
+    Imitates :py:class:`requests.Response`. The ``content`` is serialized to
+    JSON unless it is given as :py:class:`bytes`.
+    """
+    def __init__(self, content, status_code=200, headers=None):
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode()
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.raw = io.BytesIO(content)
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception("HTTP error {}".format(self.status_code))
+
+    def close(self):
+        self.closed = True
+
+class FakeSession:
+    """
+    Imitates :py:class:`requests.Session`. The responses are taken from the
+    ``responses`` list in order, or produced by the :py:meth:`respond` method
+    which can be overridden in subclasses. The keyword arguments of all
+    requests are recorded in the ``requests`` list.
+    """
+    cookies = None
+
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.requests = []
+
+    def respond(self, method, url, **kwargs):
+        return self.responses.pop(0)
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(kwargs)
+        response = self.respond(method, url, **kwargs)
+        response.request = types.SimpleNamespace(url=url, body=None)
+        return response
+
+class FakeConnection:
+    """
+    Imitates a transaction of :py:class:`sqlalchemy.engine.Connection`. The
+    executed entries are appended to ``rows`` and the other keys of the
+    database state can be modified in ``state``. Both are published to the
+    database on commit.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.rollback()
+
+    def execute(self, statement, entries):
+        self.rows.extend(entries)
+
+    def commit(self):
+        with self.db.lock:
+            self.db.committed["rows"].extend(self.rows)
+            self.db.committed.update(copy.deepcopy(self.state))
+            self.db.commits += 1
+        self.rows = []
+
+    def rollback(self):
+        self.rows = []
+        with self.db.lock:
+            self.state = dict((key, copy.deepcopy(value)) for key, value in self.db.committed.items() if key != "rows")
+
+class FakeDatabase:
+    """
+    Imitates :py:class:`ws.db.database.Database` for the grabbers. The
+    committed state is in the ``committed`` dictionary, the ``rows`` key
+    holds all committed entries and the other keys are initialized from
+    ``state``.
+    """
+    bulk_load = False
+    checkpoint_interval = None
+
+    def __init__(self, chunk_size=100, checkpoint_rows=None, **state):
+        self.chunk_size = chunk_size
+        self.checkpoint_rows = checkpoint_rows
+        self.committed = {"rows": []}
+        self.committed.update(state)
+        self.commits = 0
+        self.lock = threading.Lock()
+        self.metadata = types.SimpleNamespace(sorted_tables=[], tables={})
+        self.engine = types.SimpleNamespace(begin=self.begin, connect=self.connect)
+
+    @contextlib.contextmanager
+    def connect(self):
+        yield FakeConnection(self)
+
+    @contextlib.contextmanager
+    def begin(self):
+        conn = FakeConnection(self)
+        yield conn
+        conn.commit()
+
+class SchemaDatabase:
+    """
+    Imitates :py:class:`ws.db.database.Database` with the tables of the schema,
+    but without any engine. Useful for compiling the statements of grabbers.
+    """
+    chunk_size = 5000
+
+    def __init__(self):
+        self.metadata = sa.MetaData()
+        schema.create_tables(self.metadata)
+
+    def __getattr__(self, table_name):
+        return self.metadata.tables[table_name]
@@ -35,3 +35,94 @@
 #    def test_4(self):
 #        for i in range(round(self.rate * 2.5)):
 #            self.func()
+
+import asyncio
+
+import pytest
+
+from ws.utils import TokenBucket, RateLimiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(10, 2)
+    for i in range(10):
+        assert bucket.reserve(0) == 0
+    # the next token is available after 0.2 seconds
+    assert bucket.reserve(0) == pytest.approx(0.2)
+    # the following caller has to wait in turn
+    assert bucket.reserve(0) == pytest.approx(0.4)
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(10, 2)
+    for i in range(10):
+        bucket.reserve(0)
+    for i in range(5):
+        assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) > 0
+
+def test_token_bucket_aimd():
+    bucket = TokenBucket(10, 1)
+    bucket.decrease()
+    assert bucket.rate == 5
+    for i in range(100):
+        bucket.decrease()
+    assert bucket.rate == pytest.approx(10 * TokenBucket.MIN_RATE_FRACTION)
+    for i in range(100):
+        bucket.increase()
+    assert bucket.rate == 10
+
+def test_rate_limiter_acquire(clock):
+    limiter = RateLimiter({"read": (2, 1)}, clock=clock, sleep=clock.sleep)
+    for i in range(6):
+        limiter.acquire("read")
+    assert sum(clock.slept) == pytest.approx(2)
+
+def test_rate_limiter_classes(clock):
+    limiter = RateLimiter({"read": (2, 1), "edit": (1, 3)}, clock=clock, sleep=clock.sleep)
+    limiter.acquire("edit")
+    limiter.acquire("read")
+    limiter.acquire("read")
+    assert clock.slept == []
+    limiter.acquire("edit")
+    assert clock.slept == [pytest.approx(3)]
+
+def test_rate_limiter_backoff(clock):
+    limiter = RateLimiter({"read": (10, 1)}, clock=clock, sleep=clock.sleep)
+    limiter.backoff(5)
+    assert limiter.acquire("read") == pytest.approx(5)
+    assert limiter.buckets["read"].rate == 5
+    limiter.success("read")
+    assert limiter.buckets["read"].rate == pytest.approx(5.5)
+
+def test_rate_limiter_acquire_async(clock):
+    limiter = RateLimiter({"read": (1, 0.01)}, clock=clock)
+    async def main():
+        return [await limiter.acquire_async("read") for i in range(2)]
+    delays = asyncio.run(main())
+    assert delays == [0, pytest.approx(0.01)]
+
+def test_rate_limiter_lock_file(tmp_path, clock):
+    lock_file = str(tmp_path / "rate.lock")
+    limiter1 = RateLimiter({"read": (2, 1)}, lock_file=lock_file, clock=clock)
+    limiter2 = RateLimiter({"read": (2, 1)}, lock_file=lock_file, clock=clock)
+    assert limiter1.reserve("read") == 0
+    assert limiter2.reserve("read") == 0
+    # the tokens are shared through the file
+    assert limiter1.reserve("read") == pytest.approx(0.5)
+    limiter2.backoff(10)
+    assert limiter1.reserve("read") == pytest.approx(10)
@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+import copy
+import datetime
+import json
+import random
+import timeit
+
+from ws.utils import gen_nested_values, parse_date
+from ws.utils.timestamps import *
+
+def _reference_parse_timestamps_in_struct(struct):
+    """
+    The previous implementation which walks all values in the structure.
+    """
+    def set_ts(struct, keys, value):
+        for k in keys[:-1]:
+            struct = struct[k]
+        struct[keys[-1]] = value
+
+    for keys, value in gen_nested_values(struct):
+        if isinstance(value, str):
+            _strkeys = "".join(str(k) for k in keys)
+            if "timestamp" not in _strkeys and "registration" not in _strkeys and "expiry" not in _strkeys and "touched" not in _strkeys:
+                continue
+            if value.lower() == "infinity" or value.lower() == "infinite":
+                set_ts(struct, keys, datetime.datetime.max)
+            elif value.lower() == "-infinity":
+                set_ts(struct, keys, datetime.datetime.min)
+            elif value.lower() == "indefinite":
+                set_ts(struct, keys, None)
+            elif (len(value) == 20 and value[4] == "-" and value[7] == "-" and
+                    value[10] == "T" and value[13] == ":" and value[16] == ":"
+                    and value[19] == "Z"):
+                try:
+                    ts = parse_date(value)
+                except ValueError:
+                    continue
+                set_ts(struct, keys, ts)
+
+def make_allrevisions_payload(pages=50, revisions=10, text_size=2000):
+    """
+    Creates a response to an ``list=allrevisions`` query with
+    ``arvprop=ids|timestamp|flags|user|userid|comment|size|sha1|contentmodel|tags|content``.
+    """
+    rnd = random.Random(0)
+    revid = 0
+    allrevisions = []
+    for pageid in range(1, pages + 1):
+        revs = []
+        for i in range(revisions):
+            revid += 1
+            revs.append({
+                "revid": revid,
+                "parentid": revid - 1,
+                "minor": "",
+                "user": "User {}".format(rnd.randrange(100)),
+                "userid": rnd.randrange(100),
+                "timestamp": "2017-{:02d}-{:02d}T12:34:56Z".format(rnd.randrange(1, 13), rnd.randrange(1, 29)),
+                "size": text_size,
+                "sha1": "%040x" % rnd.getrandbits(160),
+                "comment": "edit summary with timestamp 2017-01-01T00:00:00Z",
+                "tags": ["wiki-scripts"],
+                "slots": {
+                    "main": {
+                        "contentmodel": "wikitext",
+                        "contentformat": "text/x-wiki",
+                        "*": "".join(rnd.choice("abcdefghij \n") for _ in range(text_size)),
+                    },
+                },
+            })
+        allrevisions.append({"pageid": pageid, "ns": 0, "title": "Page {}".format(pageid), "revisions": revs})
+    return {
+        "batchcomplete": "",
+        "continue": {"arvcontinue": "20170101123456|500", "continue": "-||"},
+        "query": {"allrevisions": allrevisions},
+    }
+
+PARAMS = {"action": "query", "list": "allrevisions", "arvprop": "ids|timestamp|flags|user|userid|comment|size|sha1|contentmodel|tags|content"}
+
+def test_get_timestamp_keys():
+    assert get_timestamp_keys(PARAMS) == {"timestamp", "curtimestamp"}
+    assert get_timestamp_keys({"action": "query", "prop": {"revisions", "langlinks"}}) == {"timestamp", "curtimestamp"}
+    # unknown modules and actions
+    assert get_timestamp_keys({"action": "query", "list": "logevents"}) is None
+    assert get_timestamp_keys({"action": "parse"}) is None
+
+def test_parse_timestamp():
+    assert parse_timestamp("2014-08-25T14:26:59Z") == datetime.datetime(2014, 8, 25, 14, 26, 59)
+    assert parse_timestamp("infinity") == datetime.datetime.max
+    assert parse_timestamp("-infinity") == datetime.datetime.min
+    assert parse_timestamp("indefinite") is None
+    assert parse_timestamp("foo") == "foo"
+
+def test_parse_timestamps_in_struct():
+    struct = {
+        "timestamp": "2014-08-25T14:26:59Z",
+        "comment": "2014-08-25T14:26:59Z",
+        "protection": [{"type": "edit", "expiry": "infinity"}],
+        "blockexpiry": "2014-08-25T14:26:59Z",
+        "timestamps": ["2014-08-25T14:26:59Z", "foo"],
+    }
+    expected = {
+        "timestamp": datetime.datetime(2014, 8, 25, 14, 26, 59),
+        "comment": "2014-08-25T14:26:59Z",
+        "protection": [{"type": "edit", "expiry": datetime.datetime.max}],
+        "blockexpiry": datetime.datetime(2014, 8, 25, 14, 26, 59),
+        "timestamps": [datetime.datetime(2014, 8, 25, 14, 26, 59), "foo"],
+    }
+    reference = copy.deepcopy(struct)
+    _reference_parse_timestamps_in_struct(reference)
+    parse_timestamps_in_struct(struct)
+    assert struct == expected
+    assert reference == expected
+
+def test_parse_timestamps_in_struct_keys():
+    struct = {"timestamp": "2014-08-25T14:26:59Z", "blockexpiry": "2014-08-25T14:26:59Z"}
+    parse_timestamps_in_struct(struct, {"timestamp"})
+    assert struct == {"timestamp": datetime.datetime(2014, 8, 25, 14, 26, 59), "blockexpiry": "2014-08-25T14:26:59Z"}
+
+def test_same_result_as_reference():
+    payload = make_allrevisions_payload(pages=5)
+    reference = copy.deepcopy(payload)
+    _reference_parse_timestamps_in_struct(reference)
+    generic = copy.deepcopy(payload)
+    parse_timestamps_in_struct(generic)
+    keyed = copy.deepcopy(payload)
+    parse_timestamps_in_struct(keyed, get_timestamp_keys(PARAMS))
+    assert generic == reference
+    assert keyed == reference
+
+def test_wrap_timestamps():
+    struct = {"query": {"allrevisions": [{"revisions": [{"timestamp": "2014-08-25T14:26:59Z", "comment": "2014-08-25T14:26:59Z"}]}]}}
+    wrapped = wrap_timestamps(struct)
+    rev = wrapped["query"]["allrevisions"][0]["revisions"][0]
+    assert isinstance(rev, LazyTimestampDict)
+    assert dict.__getitem__(rev, "timestamp") == "2014-08-25T14:26:59Z"
+    assert rev["timestamp"] == datetime.datetime(2014, 8, 25, 14, 26, 59)
+    assert rev.get("timestamp") == datetime.datetime(2014, 8, 25, 14, 26, 59)
+    assert rev["comment"] == "2014-08-25T14:26:59Z"
+    # the original structure is not modified
+    assert struct["query"]["allrevisions"][0]["revisions"][0]["timestamp"] == "2014-08-25T14:26:59Z"
+
+def test_benchmark(capsys):
+    """
+    Compares the per-response CPU cost of the timestamp parsing on an
+    ``allrevisions`` response with content.
+    """
+    raw = json.dumps(make_allrevisions_payload())
+    keys = get_timestamp_keys(PARAMS)
+
+    def bench(func):
+        payloads = [json.loads(raw) for _ in range(5)]
+        timer = timeit.Timer(lambda: func(payloads.pop()))
+        return min(timer.repeat(repeat=5, number=1))
+
+    t_reference = bench(_reference_parse_timestamps_in_struct)
+    t_generic = bench(parse_timestamps_in_struct)
+    t_keyed = bench(lambda p: parse_timestamps_in_struct(p, keys))
+    t_lazy = bench(lambda p: wrap_timestamps(p, keys))
+
+    with capsys.disabled():
+        print("\nparse_timestamps_in_struct on an allrevisions response ({} KiB):".format(len(raw) // 1024))
+        print("  reference (path walk): {:8.3f} ms".format(t_reference * 1000))
+        print("  generic keys:          {:8.3f} ms".format(t_generic * 1000))
+        print("  module keys:           {:8.3f} ms".format(t_keyed * 1000))
+        print("  lazy wrappers:         {:8.3f} ms".format(t_lazy * 1000))
@@ -1,9 +1,18 @@
 #! /usr/bin/env python3
 
+import collections
+import collections.abc
+import concurrent.futures
 import hashlib
+import itertools
 import logging
 
-from ..utils import RateLimited, LazyProperty
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from ..utils import LazyProperty, dmerge
 
 from .connection import Connection, APIError
 from .site import Site
@@ -19,11 +28,45 @@ class API(Connection):
     """
     Simple interface to MediaWiki's API.
 
+    :param str redirects_cache:
+        path to a file for persisting the redirects map, see
+        :py:class:`ws.client.redirects.Redirects`
     :param kwargs: any keyword arguments of the Connection object
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, redirects_cache=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.redirects_cache = redirects_cache
+
+    @staticmethod
+    def set_argparser(argparser):
+        """
+        Add arguments for constructing a :py:class:`API` object to an instance
+        of :py:class:`argparse.ArgumentParser`.
+
+        The arguments of :py:meth:`ws.client.connection.Connection.set_argparser`
+        are added as well.
+
+        :param argparser: an instance of :py:class:`argparse.ArgumentParser`
+        """
+        import ws.config
+        Connection.set_argparser(argparser)
+        group = argparser.add_argument_group(title="API parameters")
+        group.add_argument("--redirects-cache", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
+                help="path to a file for persisting the map of redirects between runs (default: %(default)s)")
+
+    @classmethod
+    def from_argparser(klass, args):
+        """
+        Construct a :py:class:`API` object from arguments parsed by
+        :py:class:`argparse.ArgumentParser`.
+
+        :param args: an instance of :py:class:`argparse.Namespace`.
+        :returns: an instance of :py:class:`API`
+        """
+        api = super().from_argparser(args)
+        api.redirects_cache = args.redirects_cache
+        return api
 
     def login(self, username, password):
         """
@@ -89,7 +132,7 @@ class API(Connection):
         """
         A :py:class:`ws.client.redirects.Redirects` instance for the current wiki.
         """
-        return Redirects(self)
+        return Redirects(self, cache_file=self.redirects_cache)
 
     @LazyProperty
     def max_ids_per_query(self):
@@ -103,6 +146,14 @@ class API(Connection):
         """
         return 500 if "apihighlimits" in self.user.rights else 50
 
+    #: The maximum size of the API result in bytes, as configured by the
+    #: `$wgAPIMaxResultSize`_ setting on the wiki. It is not exposed by the API,
+    #: so it has to be set manually if it differs from the MediaWiki default.
+    #: It is used for adaptive chunk sizing in :py:meth:`call_api_autoiter_ids`.
+    #:
+    #: .. _`$wgAPIMaxResultSize`: https://www.mediawiki.org/wiki/Manual:$wgAPIMaxResultSize
+    max_result_size = 8 * 1024 * 1024
+
     @property
     def last_revision_id(self):
         """
@@ -170,6 +221,15 @@ class API(Connection):
             return None
         return recentchanges[0]["timestamp"]
 
+    def _validate_cache(self):
+        """
+        Drops the cached responses which were fetched before the newest change
+        on the wiki. See :py:meth:`ws.client.cache.ResponseCache.invalidate_older_than`.
+        """
+        timestamp = self.newest_rc_timestamp
+        if timestamp is not None:
+            self.cache.invalidate_older_than(timestamp)
+
     def Title(self, title):
         """
         Parse a MediaWiki title.
@@ -183,7 +243,8 @@ class API(Connection):
         return Title(Context.from_api(self), title)
 
 
-    def call_api_autoiter_ids(self, params=None, *, expand_result=True, **kwargs):
+    def call_api_autoiter_ids(self, params=None, *, expand_result=True, concurrency=1, ordered=True,
+                              continuation=False, merge_continuation=False, **kwargs):
         """
         A wrapper method around :py:meth:`Connection.call_api` which
         automatically splits the call into multiple queries due to
@@ -192,14 +253,43 @@ class API(Connection):
         Note that this is applicable only to the ``titles``, ``pageids`` and
         ``revids`` API parameters which have to be supplied as :py:class:`!list`
         or :py:class:`set` to this method. Exactly one of these parameters has
-        to be supplied.
+        to be supplied. The values of a list or set are sorted, other iterables
+        (e.g. generators) are consumed lazily in their own order as the chunks
+        are submitted, so the values do not have to be held in memory.
 
         The parameters have the same meaning as those in the
         :py:meth:`Connection.call_api` method.
 
         This method is a generator which yields the results of the call to the
         :py:meth:`Connection.call_api` method for each chunk.
-        """
+
+        The size of the chunks is adapted to the observed size of the responses
+        so that the results fit into :py:attr:`API.max_result_size`. When the
+        API truncates the result of a chunk anyway, the following chunks are
+        made smaller. Without ``continuation``, the truncated chunk is also
+        split in halves which are fetched again. With ``continuation``, the
+        rest of its result is fetched by the continued queries, so the chunk
+        is accepted as it is.
+
+        :param int concurrency: number of chunks fetched at the same time
+        :param bool ordered:
+            if ``True``, the results are yielded in the order of the sorted
+            values, otherwise in the order in which they were fetched
+        :param bool continuation:
+            if ``True``, the continuation parameters returned for a chunk (e.g.
+            ``drvcontinue`` when the content of the revisions does not fit into
+            one response) are followed by the same worker and the partial
+            results of the chunk are yielded one after another. Otherwise only
+            the first response of each chunk is yielded.
+        :param bool merge_continuation:
+            if ``True``, the continuation is followed (as with
+            ``continuation=True``) and the partial results of each chunk are
+            merged into one result, so that the lists of the page properties
+            (e.g. ``revisions`` or ``deletedrevisions`` with ``rvlimit`` or
+            ``drvlimit``) are complete for each page
+        """
+        if merge_continuation is True:
+            continuation = True
         if params is None:
             params = kwargs
         elif not isinstance(params, dict):
@@ -209,6 +299,8 @@ class API(Connection):
             # of params to avoid modifying the caller's data and then call
             # utils.dmerge. Too complicated, not supported.
             raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
 
         if "titles" in params:
             iter_key = "titles"
@@ -220,54 +312,135 @@ class API(Connection):
             raise ValueError("neither of the parameters titles, pageids or revids is present")
 
         iter_values = params[iter_key]
-        if not isinstance(iter_values, list) and not isinstance(iter_values, set):
-            raise TypeError("the value of the parameter '{}' must be either a list or a set".format(iter_key))
-        # code below expects a list
-        iter_values = sorted(iter_values)
-
-        chunk_size = self.max_ids_per_query
-        while iter_values:
-            logger.debug("call_api_autoiter_ids: current chunk size is {}".format(chunk_size))
-            # take the next chunk
-            chunk = iter_values[:chunk_size]
-            # update params
-            params[iter_key] = "|".join(str(v) for v in chunk)
-            # call
-            chunk_result = self.call_api(params, expand_result=False, check_warnings=False)
-            # check for truncation warning
-            if "warnings" in chunk_result:
-                msg = "API warning(s) for query {}:".format(params)
-                truncated = False
-                for warning in chunk_result["warnings"].values():
-                    if "This result was truncated" in warning["*"] and chunk_size > 1:
-                        truncated = True
-                    msg += "\n* {}".format(warning["*"])
-                if truncated is True:
-                    # truncated result - decrease chunk size and try again
-                    chunk_size //= 2
-                    continue
-                logger.warning(msg)
-            elif chunk_size < self.max_ids_per_query // 10:
-                # try to grow the chunk size if it dropped too much
-                chunk_size *= 4
-            # yield the chunk result
+        if isinstance(iter_values, (list, set)):
+            iter_values = iter(sorted(iter_values))
+        elif isinstance(iter_values, (str, bytes)) or not isinstance(iter_values, collections.abc.Iterable):
+            raise TypeError("the value of the parameter '{}' must be a list, a set or an iterable".format(iter_key))
+        else:
+            iter_values = iter(iter_values)
+
+        def fetch(chunk):
+            chunk_params = params.copy()
+            chunk_params[iter_key] = "|".join(str(v) for v in chunk)
+            results = []
+            total_size = 0
+            query_params = chunk_params
+            while True:
+                result, size = self._call_api(query_params, expand_result=False, check_warnings=False)
+                results.append(result)
+                total_size += size
+                if continuation is False or "continue" not in result:
+                    break
+                query_params = chunk_params.copy()
+                query_params.update(result["continue"])
+            return chunk_params, results, total_size
+
+        def expand(chunk_params, chunk_result):
             if expand_result is True:
-                action = params.get("action")
+                action = chunk_params.get("action")
                 if action in chunk_result:
-                    yield chunk_result[action]
+                    return chunk_result[action]
                 else:
-                    raise APIExpandResultFailed
-            yield chunk_result
-            # remove the processed values
-            iter_values = iter_values[chunk_size:]
+                    raise APIExpandResultFailed(chunk_params, chunk_result)
+            return chunk_result
+
+        sizer = _ChunkSizer(self.max_ids_per_query, self.max_result_size)
+        # offset of the next value which was not submitted yet
+        position = 0
+        # whether all values were submitted
+        exhausted = False
+        # truncated chunks which have to be fetched again, as (offset, chunk) tuples
+        resubmit = collections.deque()
+        # futures of the chunks being fetched, mapped to (offset, chunk) tuples
+        pending = {}
+        # fetched chunks waiting for ordered yielding, indexed by offset
+        completed = {}
+        # offset of the next chunk to be yielded in the ordered mode
+        next_offset = 0
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            while pending or resubmit or not exhausted:
+                # fill the pipeline
+                while len(pending) < concurrency and (resubmit or not exhausted):
+                    if resubmit:
+                        offset, chunk = resubmit.popleft()
+                    else:
+                        chunk_size = sizer.get_size()
+                        logger.debug("call_api_autoiter_ids: current chunk size is {}".format(chunk_size))
+                        offset = position
+                        chunk = list(itertools.islice(iter_values, chunk_size))
+                        if not chunk:
+                            exhausted = True
+                            break
+                        position += len(chunk)
+                    pending[executor.submit(fetch, chunk)] = (offset, chunk)
+                if not pending:
+                    continue
 
-    def query_continue(self, params=None, **kwargs):
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: pending[f][0]):
+                    offset, chunk = pending.pop(future)
+                    chunk_params, chunk_results, size = future.result()
+
+                    # check for truncation warning
+                    warnings = [warning for chunk_result in chunk_results
+                                        for warning in chunk_result.get("warnings", {}).values()]
+                    truncated = False
+                    if warnings:
+                        msg = "API warning(s) for query {}:".format(chunk_params)
+                        for warning in warnings:
+                            if "This result was truncated" in warning["*"] and len(chunk) > 1:
+                                truncated = True
+                            msg += "\n* {}".format(warning["*"])
+                        if truncated is True and continuation is False:
+                            # truncated result - split the chunk and try again
+                            sizer.truncated(len(chunk))
+                            half = len(chunk) // 2
+                            resubmit.appendleft((offset + half, chunk[half:]))
+                            resubmit.appendleft((offset, chunk[:half]))
+                            continue
+                        if truncated is False:
+                            logger.warning(msg)
+                    if truncated is True:
+                        # the rest of the result was fetched by the continued
+                        # queries, only the next chunks are made smaller
+                        sizer.truncated(len(chunk))
+                    else:
+                        sizer.observe(len(chunk), size)
+
+                    if merge_continuation is True:
+                        chunk_results = [_merge_continued_results(chunk_results)]
+
+                    if ordered is False:
+                        for chunk_result in chunk_results:
+                            yield expand(chunk_params, chunk_result)
+                    else:
+                        completed[offset] = (len(chunk), chunk_params, chunk_results)
+
+                # yield the fetched chunks in order
+                while next_offset in completed:
+                    length, chunk_params, chunk_results = completed.pop(next_offset)
+                    next_offset += length
+                    for chunk_result in chunk_results:
+                        yield expand(chunk_params, chunk_result)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def query_continue(self, params=None, *, continuation=None, **kwargs):
         """
         Generator for MediaWiki's `query-continue feature`_.
 
         :param params:
             same as :py:meth:`ws.client.connection.Connection.call_api`, but
             ``action`` is always set to ``"query"`` and ``"continue"`` to ``""``
+        :param dict continuation:
+            if given, the query starts from the continuation parameters stored
+            under the ``"continue"`` key (if any) and the key is set to the
+            continuation parameters of each request before it is made. Hence
+            when the caller gets the first result of a new response, all
+            results of the previous responses have been yielded and the query
+            can be resumed later from the stored parameters.
         :param kwargs:
             same as :py:meth:`ws.client.connection.Connection.call_api`
         :yields: from ``"query"`` part of the API response
@@ -286,6 +459,9 @@ class API(Connection):
         params["action"] = "query"
 
         last_continue = {"continue": ""}
+        if continuation is not None and continuation.get("continue"):
+            last_continue = continuation["continue"]
+        continuation_round = 0
 
         while True:
             # clone the original params to clean up old continue params
@@ -293,7 +469,11 @@ class API(Connection):
             # and update with the last continue -- it may involve multiple params,
             # hence the clean up with params.copy()
             params_copy.update(last_continue)
+            if continuation is not None:
+                continuation["continue"] = last_continue
             # call the API and handle the result
+            self._trace.continuation_round = continuation_round
+            continuation_round += 1
             result = self.call_api(params_copy, expand_result=False)
             if "query" in result:
                 yield result["query"]
@@ -301,7 +481,43 @@ class API(Connection):
                 break
             last_continue = result["continue"]
 
-    def generator(self, params=None, **kwargs):
+    def _query_continue_stream(self, container, params=None, *, continuation=None, **kwargs):
+        """
+        Streaming variant of :py:meth:`query_continue`, which yields the items
+        of the collection at the ``container`` path instead of the ``"query"``
+        part of the responses. See :py:meth:`Connection._call_api_stream
+        <ws.client.connection.Connection._call_api_stream>`.
+        """
+        if params is None:
+            params = kwargs
+        elif not isinstance(params, dict):
+            raise ValueError("params must be dict or None")
+        elif kwargs and params:
+            raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+        else:
+            # create copy before adding action=query
+            params = params.copy()
+        params["action"] = "query"
+
+        last_continue = {"continue": ""}
+        if continuation is not None and continuation.get("continue"):
+            last_continue = continuation["continue"]
+        continuation_round = 0
+
+        while True:
+            # clone the original params to clean up old continue params
+            params_copy = params.copy()
+            params_copy.update(last_continue)
+            if continuation is not None:
+                continuation["continue"] = last_continue
+            self._trace.continuation_round = continuation_round
+            continuation_round += 1
+            result = yield from self._call_api_stream(params_copy, container)
+            if "continue" not in result:
+                break
+            last_continue = result["continue"]
+
+    def generator(self, params=None, *, stream=False, **kwargs):
         """
         Interface to API:Generators, conveniently implemented as Python
         generator.
@@ -309,6 +525,11 @@ class API(Connection):
         Parameter ``generator`` must be supplied.
 
         :param params: same as :py:meth:`API.query_continue`
+        :param bool stream:
+            if ``True`` and the :py:mod:`ijson` module is available, the
+            responses are decoded incrementally and the pages are yielded as
+            soon as they are decoded (in the order of the response rather than
+            sorted by title), which bounds the memory usage to one page
         :param kwargs: same as :py:meth:`API.query_continue`
         :yields: from ``"pages"`` part of the API response
 
@@ -330,6 +551,10 @@ class API(Connection):
         if generator_ is None:
             raise ValueError("param 'generator' must be supplied")
 
+        if stream is True and ijson is not None:
+            yield from self._query_continue_stream("query.pages", params, **kwargs)
+            return
+
         for snippet in self.query_continue(params, **kwargs):
             # API generator returns dict !!!
             # for example:  snippet === {"pages":
@@ -338,13 +563,18 @@ class API(Connection):
             snippet = sorted(snippet["pages"].values(), key=lambda d: d["title"])
             yield from snippet
 
-    def list(self, params=None, **kwargs):
+    def list(self, params=None, *, stream=False, continuation=None, **kwargs):
         """
         Interface to API:Lists, implemented as Python generator.
 
         Parameter ``list`` must be supplied.
 
         :param params: same as :py:meth:`API.query_continue`
+        :param bool stream:
+            if ``True`` and the :py:mod:`ijson` module is available, the
+            responses are decoded incrementally and the items are yielded as
+            soon as they are decoded, which bounds the memory usage to one item
+        :param dict continuation: same as :py:meth:`API.query_continue`
         :param kwargs: same as :py:meth:`API.query_continue`
         :yields: from ``"list"`` part of the API response
         """
@@ -352,7 +582,15 @@ class API(Connection):
         if list_ is None:
             raise ValueError("param 'list' must be supplied")
 
-        for snippet in self.query_continue(params, **kwargs):
+        if stream is True and ijson is not None:
+            if list_ == "querypage":
+                container = "query.querypage.results"
+            else:
+                container = "query." + list_
+            yield from self._query_continue_stream(container, params, continuation=continuation, **kwargs)
+            return
+
+        for snippet in self.query_continue(params, continuation=continuation, **kwargs):
             if list_ == "querypage":
                 # list=querypage needs special treatment, the structure is:
                 #     snippet === {"querypage": {
@@ -418,13 +656,11 @@ class API(Connection):
         # don't catch the exception for the last try
         return self.call_api(params)
 
-    @RateLimited(1, 3)
     def edit(self, title, pageid, text, basetimestamp, summary, **kwargs):
         """
         Interface to `API:Edit`_. MD5 hash of the new text is computed
-        automatically and added to the query. This method is rate-limited with
-        the :py:class:`@RateLimited <ws.utils.rate.RateLimited>` decorator to
-        allow 1 call per 3 seconds.
+        automatically and added to the query. The call is rate-limited by the
+        ``edit`` class of the :py:attr:`limiter <ws.client.connection.Connection.limiter>`.
 
         :param str title: the title of the page (used only for logging)
         :param pageid: page ID of the page to be edited
@@ -473,13 +709,11 @@ class API(Connection):
             logger.error(f"Failed to edit page [[{title}]] due to APIError (code '{ecode}': {einfo})")
             raise
 
-    @RateLimited(1, 3)
     def create(self, title, text, summary, **kwargs):
         """
         Specialization of :py:meth:`edit` for creating pages. The ``createonly``
-        parameter is always added to the query. This method is rate-limited with
-        the :py:class:`@RateLimited <ws.utils.rate.RateLimited>` decorator to
-        allow 1 call per 3 seconds.
+        parameter is always added to the query. The call is rate-limited by the
+        ``edit`` class of the :py:attr:`limiter <ws.client.connection.Connection.limiter>`.
 
         :param str title: the title of the page to be created
         :param str text: new page content
@@ -527,12 +761,10 @@ class API(Connection):
             logger.error(f"Failed to create page [[{title}]] due to APIError (code '{ecode}': {einfo})")
             raise
 
-    @RateLimited(1, 3)
     def move(self, from_title, to_title, reason, *, movetalk=True, movesubpages=True, noredirect=False, **kwargs):
         """
-        Interface to `API:Move`_. This method is rate-limited with the
-        :py:class:`@RateLimited <ws.utils.rate.RateLimited>` decorator to allow
-        1 call per 3 seconds.
+        Interface to `API:Move`_. The call is rate-limited by the ``edit``
+        class of the :py:attr:`limiter <ws.client.connection.Connection.limiter>`.
 
         :param str from_title: the original title of the page to be renamed
         :param str to_title: the new title of the page to be renamed
@@ -573,12 +805,10 @@ class API(Connection):
             logger.error(f"Failed to move page [[{from_title}]] to [[{to_title}]] due to APIError (code '{ecode}': {einfo})")
             raise
 
-    @RateLimited(1, 3)
     def set_page_language(self, title, lang, reason, **kwargs):
         """
-        Interface to `API:SetPageLanguage`_. This method is rate-limited with the
-        :py:class:`@RateLimited <ws.utils.rate.RateLimited>` decorator to allow
-        1 call per 3 seconds.
+        Interface to `API:SetPageLanguage`_. The call is rate-limited by the
+        ``edit`` class of the :py:attr:`limiter <ws.client.connection.Connection.limiter>`.
 
         :param str title: title of the page whose language should be changed
         :param str lang: language code of the language to be set for the page
@@ -610,6 +840,54 @@ class API(Connection):
             logger.error(f"Failed to set page language of [[{title}]] to {lang} due to APIError (code '{ecode}': {einfo})")
             raise
 
+def _merge_continued_results(results):
+    """
+    Merges the partial results of a continued query into one result. The pages
+    are matched by their keys in ``query.pages`` and their lists (e.g.
+    ``revisions``) are concatenated in the order of the responses.
+    """
+    if len(results) == 1:
+        return results[0]
+    merged = {}
+    for result in results:
+        dmerge(result, merged)
+    merged.pop("continue", None)
+    return merged
+
+class _ChunkSizer:
+    """
+    Helper for the adaptive chunk sizing in :py:meth:`API.call_api_autoiter_ids`.
+
+    The number of bytes per ID is estimated from the sizes of the previous
+    responses and the chunk size is chosen to fill half of the maximum result
+    size, which leaves enough space for the variance between the chunks.
+    """
+    # weight of the new observation in the exponential moving average
+    ALPHA = 0.3
+
+    def __init__(self, max_chunk_size, max_result_size):
+        self.max_chunk_size = max_chunk_size
+        self.target_size = max_result_size / 2
+        self.bytes_per_id = None
+
+    def get_size(self):
+        if self.bytes_per_id is None:
+            return self.max_chunk_size
+        size = int(self.target_size / self.bytes_per_id)
+        return max(1, min(self.max_chunk_size, size))
+
+    def observe(self, ids, size):
+        bytes_per_id = size / ids
+        if self.bytes_per_id is None:
+            self.bytes_per_id = bytes_per_id
+        else:
+            self.bytes_per_id = self.ALPHA * bytes_per_id + (1 - self.ALPHA) * self.bytes_per_id
+
+    def truncated(self, ids):
+        # the full result would exceed the maximum result size (twice the target)
+        bytes_per_id = 2 * self.target_size / ids
+        self.bytes_per_id = max(self.bytes_per_id or 0, bytes_per_id)
+
 class LoginFailed(Exception):
     """
     Raised when the :py:meth:`API.login` call failed.
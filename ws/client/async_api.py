@@ -0,0 +1,448 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.client.async_api` module provides an :py:mod:`asyncio`
+counterpart of the :py:class:`ws.client.api.API` class. The
+:py:class:`httpx.AsyncClient` class from the :py:mod:`httpx` library is used
+to manage the cookies, authentication and making requests.
+
+The main benefit over the synchronous interface is that independent queries
+can be in flight at the same time. For example, all pages on the wiki can be
+listed with one ``list=allpages`` walk per namespace:
+
+.. code-block:: python
+
+    async def allpages(api, ns):
+        return [page async for page in api.list(list="allpages", apnamespace=ns, aplimit="max")]
+
+    async def main(api):
+        async with api:
+            namespaces = [0, 4, 10, 12, 14]
+            results = await asyncio.gather(*(allpages(api, ns) for ns in namespaces))
+
+The number of concurrent requests is limited by the ``max_concurrency``
+parameter of :py:class:`AsyncAPI`.
+"""
+
+import asyncio
+import http.cookiejar as cookielib
+import logging
+
+import httpx
+
+import ws
+from .connection import DEFAULT_UA, Connection, APIJsonError, APIError, MAX_THROTTLE_RETRIES, get_retry_after
+from .api import APIExpandResultFailed, LoginFailed
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["AsyncAPI"]
+
+class AsyncAPI:
+    """
+    Asynchronous interface to MediaWiki's API.
+
+    The methods mirror the synchronous :py:class:`ws.client.api.API` class:
+    :py:meth:`call_api` and :py:meth:`call_with_csrftoken` are coroutines,
+    :py:meth:`query_continue`, :py:meth:`generator`, :py:meth:`list` and
+    :py:meth:`call_api_autoiter_ids` are asynchronous generators. The same
+    exception classes are raised and the timestamps in the responses are
+    parsed the same way.
+
+    :param str api_url: URL path to the wiki's ``api.php`` entry point
+    :param str index_url: URL path to the wiki's ``index.php`` entry point
+    :param httpx.AsyncClient client: client created by :py:meth:`make_client`
+    :param int timeout: connection timeout in seconds
+    :param int max_concurrency: maximum number of requests in flight
+    :param limiter:
+        an instance of :py:class:`ws.utils.rate.RateLimiter`, which may be
+        shared with synchronous connections, or ``None`` to disable rate
+        limiting
+    """
+
+    def __init__(self, api_url, index_url, client, *, timeout=60, max_concurrency=10, limiter=None):
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be positive")
+
+        self.api_url = api_url
+        self.index_url = index_url
+        self.client = client
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+
+        # created lazily inside the running event loop
+        self._semaphore = None
+        self._max_ids_per_query = None
+        self._csrftoken = None
+
+    @staticmethod
+    def make_client(user_agent=DEFAULT_UA, max_retries=0, max_connections=10,
+                    cookie_file=None, cookiejar=None,
+                    http_user=None, http_password=None):
+        """
+        Creates a :py:class:`httpx.AsyncClient` object for the connection.
+
+        The parameters have the same meaning as in
+        :py:meth:`ws.client.connection.Connection.make_session`.
+
+        :param int max_connections:
+            maximum number of connections in the connection pool
+        :returns: :py:class:`httpx.AsyncClient` object
+        """
+        if cookiejar is None and cookie_file is not None:
+            cookiejar = cookielib.LWPCookieJar(cookie_file)
+            try:
+                cookiejar.load()
+            except (cookielib.LoadError, FileNotFoundError):
+                cookiejar.save()
+                cookiejar.load()
+
+        auth = None
+        if http_user is not None and http_password is not None:
+            auth = (http_user, http_password)
+
+        # retries apply only to failed connections, same as in Connection.make_session
+        transport = httpx.AsyncHTTPTransport(retries=max_retries)
+        limits = httpx.Limits(max_connections=max_connections)
+        return httpx.AsyncClient(transport=transport,
+                                 limits=limits,
+                                 cookies=cookiejar,
+                                 auth=auth,
+                                 headers={"user-agent": user_agent},
+                                 params={"format": "json"})
+
+    @staticmethod
+    def set_argparser(argparser):
+        """
+        Add arguments for constructing a :py:class:`AsyncAPI` object to an
+        instance of :py:class:`argparse.ArgumentParser`.
+
+        The arguments of :py:meth:`ws.client.connection.Connection.set_argparser`
+        are added as well.
+
+        :param argparser: an instance of :py:class:`argparse.ArgumentParser`
+        """
+        Connection.set_argparser(argparser)
+        group = argparser.add_argument_group(title="Asynchronous connection parameters")
+        group.add_argument("--connection-max-concurrency", default=10, type=int,
+                help="maximum number of concurrent requests (default: %(default)s)")
+
+    @classmethod
+    def from_argparser(klass, args):
+        """
+        Construct a :py:class:`AsyncAPI` object from arguments parsed by
+        :py:class:`argparse.ArgumentParser`.
+
+        :param args: an instance of :py:class:`argparse.Namespace`.
+        :returns: an instance of :py:class:`AsyncAPI`
+        """
+        client = klass.make_client(max_retries=args.connection_max_retries,
+                                   max_connections=args.connection_max_concurrency,
+                                   cookie_file=args.cookie_file)
+        return klass(args.api_url, args.index_url, client,
+                     timeout=args.connection_timeout,
+                     max_concurrency=args.connection_max_concurrency,
+                     limiter=Connection.make_limiter(args))
+
+    async def aclose(self):
+        """
+        Close the underlying :py:class:`httpx.AsyncClient`.
+        """
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def request(self, method, url, *, rate_class="read", **kwargs):
+        """
+        Simple HTTP request handler, the asynchronous counterpart of
+        :py:meth:`ws.client.connection.Connection.request`.
+
+        The parameters are the same as for :py:meth:`httpx.AsyncClient.request`.
+        At most ``max_concurrency`` requests are in flight at the same time and
+        the requests are rate-limited by the :py:attr:`limiter` according to
+        ``rate_class``. Responses with the HTTP status 429 (Too Many Requests)
+        are retried after the delay given by the ``Retry-After`` header.
+
+        There is no translation of exceptions, the :py:mod:`httpx` exceptions
+        (notably :py:exc:`httpx.TransportError` and
+        :py:exc:`httpx.HTTPStatusError`) should be catched by the caller.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        retries = 0
+        while True:
+            # no rate-limiting inside tests
+            if self.limiter is not None and not hasattr(ws, "_tests_are_running"):
+                await self.limiter.acquire_async(rate_class)
+            async with self._semaphore:
+                response = await self.client.request(method, url, timeout=self.timeout, **kwargs)
+            if response.status_code != 429 or retries >= MAX_THROTTLE_RETRIES:
+                break
+            retries += 1
+            delay = get_retry_after(response, default=2 ** retries)
+            logger.warning("Server responded with 429 Too Many Requests, retrying in {} seconds [{}/{}]"
+                           .format(delay, retries, MAX_THROTTLE_RETRIES))
+            if self.limiter is not None:
+                self.limiter.backoff(delay, rate_class)
+            else:
+                await asyncio.sleep(delay)
+
+        # raise HTTPStatusError for bad requests (4XX client errors and 5XX server errors)
+        response.raise_for_status()
+        if self.limiter is not None:
+            self.limiter.success(rate_class)
+
+        if isinstance(self.client.cookies.jar, cookielib.FileCookieJar):
+            self.client.cookies.jar.save()
+
+        return response
+
+    async def call_api(self, params=None, *, expand_result=True, check_warnings=True, **kwargs):
+        """
+        Convenient method to call the ``api.php`` entry point.
+
+        The parameters and the return value are the same as for
+        :py:meth:`ws.client.connection.Connection.call_api`.
+        """
+        if params is None:
+            params = kwargs
+        elif not isinstance(params, dict):
+            raise ValueError("params must be dict or None")
+        elif kwargs and params:
+            raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+
+        action, method, request_kwargs = Connection._prepare_api_request(params)
+        result = await self.request(method, self.api_url, rate_class=Connection.get_rate_class(action), **request_kwargs)
+
+        try:
+            result = result.json()
+        except ValueError:
+            raise APIJsonError("Failed to decode server response. Please make "
+                               "sure that the API is enabled on the wiki and "
+                               "that the API URL is correct.")
+
+        return Connection._process_api_response(params, action, result,
+                                                expand_result=expand_result, check_warnings=check_warnings)
+
+    async def login(self, username, password):
+        """
+        Logs into the wiki with username and password, see
+        :py:meth:`ws.client.api.API.login`.
+
+        :returns: ``True`` on successful login, otherwise raises :py:class:`ws.client.api.LoginFailed`
+        """
+
+        # reset the cached values related to login
+        self._max_ids_per_query = None
+        self._csrftoken = None
+
+        result = await self.call_api(action="query", meta="tokens", type="login")
+        token = result["tokens"]["logintoken"]
+        result = await self.call_api(action="login", lgname=username, lgpassword=password, lgtoken=token)
+        if result["result"] == "Success":
+            return True
+        logger.warning("Failed login attempt for user '{}'".format(username))
+        raise LoginFailed
+
+    async def logout(self):
+        """
+        Logs out of the wiki.
+
+        :returns: ``True``
+        """
+        await self.call_api(action="logout")
+        return True
+
+    async def get_max_ids_per_query(self):
+        """
+        Returns the maximum number of values that can be passed to the
+        ``titles``, ``pageids`` and ``revids`` parameters of the API. See
+        :py:attr:`ws.client.api.API.max_ids_per_query`.
+
+        The value is cached until the next :py:meth:`login`.
+        """
+        if self._max_ids_per_query is None:
+            result = await self.call_api(action="query", meta="userinfo", uiprop="rights")
+            rights = result["userinfo"].get("rights", [])
+            self._max_ids_per_query = 500 if "apihighlimits" in rights else 50
+        return self._max_ids_per_query
+
+    async def call_api_autoiter_ids(self, params=None, *, expand_result=True, **kwargs):
+        """
+        Asynchronous generator counterpart of
+        :py:meth:`ws.client.api.API.call_api_autoiter_ids`.
+
+        The chunks are fetched one after another, concurrency is achieved by
+        running multiple independent calls at the same time.
+        """
+        if params is None:
+            params = kwargs
+        elif not isinstance(params, dict):
+            raise ValueError("params must be dict or None")
+        elif kwargs and params:
+            raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+        else:
+            # create copy before replacing the list of IDs with chunks
+            params = params.copy()
+
+        if "titles" in params:
+            iter_key = "titles"
+        elif "pageids" in params:
+            iter_key = "pageids"
+        elif "revids" in params:
+            iter_key = "revids"
+        else:
+            raise ValueError("neither of the parameters titles, pageids or revids is present")
+
+        iter_values = params[iter_key]
+        if not isinstance(iter_values, list) and not isinstance(iter_values, set):
+            raise TypeError("the value of the parameter '{}' must be either a list or a set".format(iter_key))
+        # code below expects a list
+        iter_values = sorted(iter_values)
+
+        max_ids_per_query = await self.get_max_ids_per_query()
+        chunk_size = max_ids_per_query
+        while iter_values:
+            logger.debug("call_api_autoiter_ids: current chunk size is {}".format(chunk_size))
+            chunk = iter_values[:chunk_size]
+            params[iter_key] = "|".join(str(v) for v in chunk)
+            chunk_result = await self.call_api(params, expand_result=False, check_warnings=False)
+            # check for truncation warning
+            if "warnings" in chunk_result:
+                msg = "API warning(s) for query {}:".format(params)
+                truncated = False
+                for warning in chunk_result["warnings"].values():
+                    if "This result was truncated" in warning["*"] and chunk_size > 1:
+                        truncated = True
+                    msg += "\n* {}".format(warning["*"])
+                if truncated is True:
+                    # truncated result - decrease chunk size and try again
+                    chunk_size //= 2
+                    continue
+                logger.warning(msg)
+            # remove the processed values
+            iter_values = iter_values[len(chunk):]
+            if chunk_size < max_ids_per_query // 10:
+                # try to grow the chunk size if it dropped too much
+                chunk_size *= 4
+            # yield the chunk result
+            if expand_result is True:
+                action = params.get("action")
+                if action in chunk_result:
+                    yield chunk_result[action]
+                else:
+                    raise APIExpandResultFailed(params, chunk_result)
+            else:
+                yield chunk_result
+
+    async def query_continue(self, params=None, **kwargs):
+        """
+        Asynchronous generator counterpart of
+        :py:meth:`ws.client.api.API.query_continue`.
+        """
+        if params is None:
+            params = kwargs
+        elif not isinstance(params, dict):
+            raise ValueError("params must be dict or None")
+        elif kwargs and params:
+            raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+        else:
+            # create copy before adding action=query
+            params = params.copy()
+        params["action"] = "query"
+
+        last_continue = {"continue": ""}
+
+        while True:
+            # clone the original params to clean up old continue params
+            params_copy = params.copy()
+            params_copy.update(last_continue)
+            result = await self.call_api(params_copy, expand_result=False)
+            if "query" in result:
+                yield result["query"]
+            if "continue" not in result:
+                break
+            last_continue = result["continue"]
+
+    async def generator(self, params=None, **kwargs):
+        """
+        Asynchronous generator counterpart of
+        :py:meth:`ws.client.api.API.generator`.
+        """
+        generator_ = kwargs.get("generator") if params is None else params.get("generator")
+        if generator_ is None:
+            raise ValueError("param 'generator' must be supplied")
+
+        async for snippet in self.query_continue(params, **kwargs):
+            snippet = sorted(snippet["pages"].values(), key=lambda d: d["title"])
+            for page in snippet:
+                yield page
+
+    async def list(self, params=None, **kwargs):
+        """
+        Asynchronous generator counterpart of
+        :py:meth:`ws.client.api.API.list`.
+        """
+        list_ = kwargs.get("list") if params is None else params.get("list")
+        if list_ is None:
+            raise ValueError("param 'list' must be supplied")
+
+        async for snippet in self.query_continue(params, **kwargs):
+            if list_ == "querypage":
+                items = snippet[list_]["results"]
+            else:
+                items = snippet[list_]
+            for item in items:
+                yield item
+
+    async def _get_csrftoken(self):
+        if self._csrftoken is None:
+            logger.debug("Requesting new csrftoken...")
+            result = await self.call_api(action="query", meta="tokens")
+            self._csrftoken = result["tokens"]["csrftoken"]
+        return self._csrftoken
+
+    async def call_with_csrftoken(self, params=None, **kwargs):
+        """
+        Asynchronous counterpart of
+        :py:meth:`ws.client.api.API.call_with_csrftoken`.
+        """
+        if params is None:
+            params = kwargs
+        elif not isinstance(params, dict):
+            raise ValueError("params must be dict or None")
+        elif kwargs and params:
+            raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
+        else:
+            # create copy before adding token
+            params = params.copy()
+
+        # max tries
+        max_retries = 2
+
+        retries = max_retries
+        while retries > 0:
+            try:
+                # ensure that the new token is passed when renewed
+                params["token"] = await self._get_csrftoken()
+                return await self.call_api(params)
+            except APIError as e:
+                retries -= 1
+                # csrftoken can be used multiple times, but expires after some time,
+                # so try to get a new one *once*
+                if e.server_response["code"] == "badtoken":
+                    logger.debug("Got 'badtoken' error, trying to reset csrftoken [{}/{}]"
+                            .format(max_retries - retries, max_retries))
+                    # reset the cached csrftoken and try again
+                    self._csrftoken = None
+                else:
+                    raise
+
+        # don't catch the exception for the last try
+        return await self.call_api(params)
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.client.cache` module provides a persistent on-disk cache for
+responses of read-only API queries. The cache is stored in an SQLite database
+and it is used by :py:meth:`ws.client.connection.Connection.call_api` when
+the connection is created with the ``cache`` parameter.
+
+Entries are keyed by the normalized set of API parameters and they are
+dropped when they are older than the configured TTL, when the total size of
+the cache exceeds the configured limit (least recently used entries are
+evicted first), or when they were stored before the newest change on the
+wiki (see :py:meth:`ResponseCache.invalidate_older_than`).
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ResponseCache"]
+
+class ResponseCache:
+    """
+    Persistent cache of raw API responses.
+
+    :param str path: path to the SQLite database file
+    :param ttl: maximum age of the cached entries in seconds (``None`` means
+        no limit)
+    :param max_size: maximum total size of the cached responses in bytes
+        (``None`` means no limit)
+    """
+
+    def __init__(self, path, *, ttl=None, max_size=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        # the connection may be shared by multiple threads, the lock serializes the access
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS response_accessed ON response (accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS response_created ON response (created)")
+
+    @staticmethod
+    def make_key(url, params):
+        """
+        Returns the cache key for a query.
+
+        :param str url: the API URL
+        :param dict params: the API parameters (after serialization of timestamps)
+        :returns: a string suitable as a cache key
+        """
+        # sort the parameters and normalize the values to strings
+        normalized = sorted((str(k), str(v)) for k, v in params.items())
+        data = json.dumps([url, normalized], ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached response body for the given key, or ``None`` if
+        there is no valid entry.
+
+        :param str key: the cache key, see :py:meth:`make_key`
+        :returns: :py:class:`bytes` or ``None``
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, created FROM response WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self._db.execute("DELETE FROM response WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE response SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.bytes_saved += len(row[0])
+            return row[0]
+
+    def set(self, key, body):
+        """
+        Stores a response body in the cache. Least recently used entries are
+        evicted if the size limit is exceeded.
+
+        :param str key: the cache key, see :py:meth:`make_key`
+        :param bytes body: the raw response body
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO response (key, body, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                             (key, body, len(body), now, now))
+            if self.max_size is not None:
+                self._evict(self.max_size)
+
+    def _evict(self, max_size):
+        total = self._db.execute("SELECT coalesce(sum(size), 0) FROM response").fetchone()[0]
+        if total <= max_size:
+            return
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM response ORDER BY accessed ASC").fetchall():
+            if total <= max_size:
+                break
+            self._db.execute("DELETE FROM response WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.debug("Evicted {} entries from the API response cache".format(evicted))
+
+    def invalidate_older_than(self, timestamp):
+        """
+        Drops all entries which were stored before the given time.
+
+        This is used with the timestamp of the newest entry in the wiki's
+        ``recentchanges`` table: responses fetched before the last change might
+        be stale, whereas responses fetched afterwards are still valid.
+
+        :param datetime.datetime timestamp: the (UTC) cut-off time
+        """
+        # naive timestamps returned by the API are in UTC
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        cutoff = timestamp.timestamp()
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM response WHERE created < ?", (cutoff,))
+        if cursor.rowcount > 0:
+            logger.info("Dropped {} stale entries from the API response cache".format(cursor.rowcount))
+
+    def clear(self):
+        """
+        Drops all entries from the cache.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM response")
+
+    @property
+    def stats(self):
+        """
+        A dictionary with the ``hits``, ``misses`` and ``bytes_saved`` counters,
+        the number of ``entries`` and their total ``size`` in bytes.
+        """
+        with self._lock:
+            entries, size = self._db.execute("SELECT count(*), coalesce(sum(size), 0) FROM response").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "entries": entries,
+            "size": size,
+        }
+
+    def close(self):
+        """
+        Closes the underlying database connection.
+        """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.client.cassette` module provides transport adapters for
+:py:class:`requests.Session` which record HTTP request/response pairs into a
+cassette file and replay them later without network access. This allows to
+run repeatable benchmarks and profiling of the code using the API, e.g.
+:py:func:`ws.db.grabbers.synchronize`.
+
+The cassette is a gzip-compressed file with one JSON object per line. The
+requests are identified by the method, URL and the normalized set of query
+and form parameters. Identical requests are replayed in the recorded order
+and the last recorded response is repeated when the recorded ones are
+exhausted.
+
+Usage:
+
+.. code-block:: python
+
+    # record
+    session = Connection.make_session(cassette_file="sync.jsonl.gz", cassette_mode="record")
+    ...
+    session.close()
+
+    # replay with 50 ms latency and 10 MB/s bandwidth
+    session = Connection.make_session(cassette_file="sync.jsonl.gz", cassette_mode="replay",
+                                      replay_latency=0.05, replay_bandwidth=10e6)
+
+See also the ``--cassette`` and ``--cassette-mode`` options of
+:py:meth:`ws.client.connection.Connection.set_argparser`.
+"""
+
+import base64
+import collections
+import gzip
+import io
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["RecordingAdapter", "ReplayAdapter", "CassetteError"]
+
+# parameters which are not part of the request key
+IGNORED_PARAMS = {"maxlag", "token", "lgtoken", "lgpassword"}
+# parameters whose values are not written into the cassette
+REDACTED_PARAMS = {"token", "lgtoken", "lgpassword"}
+# response headers which are stored in the cassette
+STORED_HEADERS = {"content-type", "retry-after"}
+
+class CassetteError(requests.exceptions.RequestException):
+    """
+    Raised when a request cannot be replayed from the cassette.
+    """
+    pass
+
+def _get_params(request):
+    """
+    Returns the list of query and form parameters of a prepared request.
+    """
+    url = urllib.parse.urlsplit(request.url)
+    params = urllib.parse.parse_qsl(url.query, keep_blank_values=True)
+    content_type = request.headers.get("Content-Type", "")
+    if request.body and content_type.startswith("application/x-www-form-urlencoded"):
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        params += urllib.parse.parse_qsl(body, keep_blank_values=True)
+    elif request.body:
+        # e.g. multipart/form-data, use the raw body
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        params.append(("<body>", base64.b64encode(body).decode("ascii")))
+    return params
+
+def _get_key(method, url, params):
+    base_url = urllib.parse.urlunsplit(urllib.parse.urlsplit(url)._replace(query="", fragment=""))
+    params = sorted((k, v) for k, v in params if k not in IGNORED_PARAMS)
+    return json.dumps([method, base_url, params], ensure_ascii=False)
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Transport adapter which passes the requests to an inner adapter and
+    appends the request/response pairs to a cassette file.
+
+    :param str path: path to the cassette file (it is overwritten)
+    :param requests.adapters.BaseAdapter adapter: the inner adapter
+    """
+    def __init__(self, path, adapter):
+        super().__init__()
+        self.path = path
+        self.adapter = adapter
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        # read the content (even for streamed responses) and make it
+        # available to the caller again
+        content = response.content
+        if kwargs.get("stream"):
+            response.raw = io.BytesIO(content)
+
+        params = [(k, "***" if k in REDACTED_PARAMS else v) for k, v in _get_params(request)]
+        entry = {
+            "method": request.method,
+            "url": request.url.split("?", 1)[0],
+            "params": params,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict((k, v) for k, v in response.headers.items() if k.lower() in STORED_HEADERS),
+        }
+        try:
+            entry["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(content).decode("ascii")
+
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False))
+            self._file.write("\n")
+            self.count += 1
+        return response
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                logger.info("Recorded {} requests into the cassette {}".format(self.count, self.path))
+        self.adapter.close()
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter which serves the responses recorded by
+    :py:class:`RecordingAdapter`.
+
+    :param str path: path to the cassette file
+    :param float latency: simulated latency of each request in seconds
+    :param float bandwidth:
+        simulated bandwidth in bytes per second (``None`` means unlimited)
+    """
+    def __init__(self, path, *, latency=0, bandwidth=None):
+        super().__init__()
+        self.path = path
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(collections.deque)
+
+        count = 0
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                key = _get_key(entry["method"], entry["url"], [tuple(p) for p in entry["params"]])
+                self._responses[key].append(entry)
+                count += 1
+        logger.info("Loaded {} requests from the cassette {}".format(count, path))
+
+    def send(self, request, **kwargs):
+        key = _get_key(request.method, request.url, _get_params(request))
+        with self._lock:
+            queue = self._responses.get(key)
+            if not queue:
+                raise CassetteError("Request not found in the cassette {}: {} {}".format(self.path, request.method, key), request=request)
+            # repeat the last response when the recorded ones are exhausted
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+
+        if "body" in entry:
+            content = entry["body"].encode("utf-8")
+        else:
+            content = base64.b64decode(entry["body_b64"])
+
+        delay = self.latency
+        if self.bandwidth:
+            delay += len(content) / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.models.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response._content = content
+        response.raw = io.BytesIO(content)
+        return response
+
+    def close(self):
+        pass
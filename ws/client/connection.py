@@ -12,12 +12,21 @@ and making requests.
 
 import requests
 from requests.packages.urllib3.util.retry import Retry
+try:
+    import ijson
+except ImportError:
+    ijson = None
 import http.cookiejar as cookielib
 import logging
 import copy
+import email.utils
+import json
+import threading
+import time
 
+import ws
 from ws import __version__, __url__
-from ws.utils import TLSAdapter, RateLimited, parse_timestamps_in_struct, serialize_timestamps_in_struct
+from ws.utils import TLSAdapter, RateLimiter, get_timestamp_keys, parse_timestamps_in_struct, wrap_timestamps, serialize_timestamps_in_struct
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +92,32 @@ MULTIPART_FORM_DATA = {
     'upload': {'file', 'chunk'},
 }
 API_ACTIONS = GET_ACTIONS | POST_ACTIONS | set(MULTIPART_FORM_DATA.keys())
+# actions which are rate-limited as edits, the remaining POST actions are
+# limited as writes and everything else as reads
+EDIT_ACTIONS = {
+    'changecontentmodel',
+    'delete',
+    'edit',
+    'filerevert',
+    'import',
+    'mergehistory',
+    'move',
+    'protect',
+    'revisiondelete',
+    'rollback',
+    'setpagelanguage',
+    'tag',
+    'undelete',
+    'upload',
+}
+# maximum number of retries after HTTP 429 responses or maxlag errors
+MAX_THROTTLE_RETRIES = 5
+# actions whose responses can be stored in the ResponseCache
+CACHEABLE_ACTIONS = {
+    'expandtemplates',
+    'parse',
+    'query',
+}
 
 class Connection:
     """
@@ -92,18 +127,46 @@ class Connection:
     :param str index_url: URL path to the wiki's ``index.php`` entry point
     :param requests.Session session: session created by :py:meth:`make_session`
     :param int timeout: connection timeout in seconds
+    :param cache:
+        an instance of :py:class:`ws.client.cache.ResponseCache` used for
+        read-only queries, or ``None`` to disable caching
+    :param limiter:
+        an instance of :py:class:`ws.utils.rate.RateLimiter` shared by all
+        requests made by the connection (a limiter with default rates is
+        created if ``None``)
+    :param int maxlag:
+        value of the `maxlag`_ parameter passed to all API queries, or ``None``
+    :param bool lazy_timestamps:
+        if ``True``, the timestamps in API responses are converted to
+        :py:class:`datetime.datetime` objects only when they are accessed,
+        see :py:func:`ws.utils.timestamps.wrap_timestamps`
+
+    Each API request can be traced by hooks, see :py:meth:`add_hook`.
+
+    .. _`maxlag`: https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
     """
 
-    def __init__(self, api_url, index_url, session, timeout=60):
+    def __init__(self, api_url, index_url, session, timeout=60, *, cache=None, limiter=None, maxlag=None,
+                 lazy_timestamps=False):
         self.api_url = api_url
         self.index_url = index_url
         self.session = session
         self.timeout = timeout
+        self.cache = cache
+        self._cache_validated = False
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.maxlag = maxlag
+        self.lazy_timestamps = lazy_timestamps
+        self.hooks = []
+        # per-thread state of the traced API call
+        self._trace = threading.local()
 
     @staticmethod
     def make_session(user_agent=DEFAULT_UA, max_retries=0,
                      cookie_file=None, cookiejar=None,
-                     http_user=None, http_password=None):
+                     http_user=None, http_password=None,
+                     cassette_file=None, cassette_mode="record",
+                     replay_latency=0, replay_bandwidth=None):
         """
         Creates a :py:class:`requests.Session` object for the connection.
 
@@ -118,6 +181,14 @@ class Connection:
             to requests where data has made it to the server.
         :param str cookie_file: path to a :py:class:`cookielib.FileCookieJar` file
         :param cookiejar: an existing :py:class:`cookielib.CookieJar` object
+        :param str cassette_file:
+            path to a cassette file for recording or replaying the HTTP
+            requests, see :py:mod:`ws.client.cassette`
+        :param str cassette_mode: either ``"record"`` or ``"replay"``
+        :param float replay_latency:
+            simulated latency of each replayed request in seconds
+        :param float replay_bandwidth:
+            simulated bandwidth for the replayed responses in bytes per second
         :returns: :py:class:`requests.Session` object
         """
         session = requests.Session()
@@ -141,8 +212,17 @@ class Connection:
         session.params.update({"format": "json"})
 
         # granular control over requests' retries: https://stackoverflow.com/a/35504626
-        retries = Retry(total=max_retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        # (429 is handled in Connection.request to let the rate limiter back off)
+        retries = Retry(total=max_retries, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
         adapter = TLSAdapter(max_retries=retries)
+        if cassette_file is not None:
+            from .cassette import RecordingAdapter, ReplayAdapter
+            if cassette_mode == "record":
+                adapter = RecordingAdapter(cassette_file, adapter)
+            elif cassette_mode == "replay":
+                adapter = ReplayAdapter(cassette_file, latency=replay_latency, bandwidth=replay_bandwidth)
+            else:
+                raise ValueError("invalid cassette mode: {}".format(cassette_mode))
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
@@ -169,6 +249,36 @@ class Connection:
                 help="connection timeout in seconds (default: %(default)s)")
         group.add_argument("--cookie-file", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
                 help="path to cookie file (default: %(default)s)")
+        group.add_argument("--api-cache", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
+                help="path to a file for caching responses of read-only API queries (default: %(default)s)")
+        group.add_argument("--api-cache-ttl", default=86400, type=int, metavar="SECONDS",
+                help="maximum age of the cached API responses in seconds (default: %(default)s)")
+        group.add_argument("--api-cache-max-size", default=256, type=int, metavar="MiB",
+                help="maximum size of the API response cache in MiB (default: %(default)s)")
+        group.add_argument("--connection-read-rate", default="10/3", type=ws.config.argtype_rate, metavar="N/SECONDS",
+                help="maximum rate of read requests (default: %(default)s)")
+        group.add_argument("--connection-write-rate", default="10/3", type=ws.config.argtype_rate, metavar="N/SECONDS",
+                help="maximum rate of write requests (default: %(default)s)")
+        group.add_argument("--connection-edit-rate", default="1/3", type=ws.config.argtype_rate, metavar="N/SECONDS",
+                help="maximum rate of edits (default: %(default)s)")
+        group.add_argument("--connection-rate-lock-file", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
+                help="path to a lock file for sharing the rate limits between multiple processes (default: %(default)s)")
+        group.add_argument("--connection-maxlag", type=int, metavar="SECONDS",
+                help="value of the maxlag parameter passed to API queries (default: %(default)s)")
+        group.add_argument("--connection-lazy-timestamps", action="store_true",
+                help="convert the timestamps in API responses only when they are accessed (default: %(default)s)")
+        group.add_argument("--cassette", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
+                help="path to a cassette file for recording or replaying all HTTP requests (default: %(default)s)")
+        group.add_argument("--cassette-mode", choices=["record", "replay"], default="record",
+                help="whether the HTTP requests are recorded into the cassette or replayed from it (default: %(default)s)")
+        group.add_argument("--cassette-latency", type=float, default=0, metavar="SECONDS",
+                help="simulated latency of each replayed request (default: %(default)s)")
+        group.add_argument("--cassette-bandwidth", type=float, metavar="BYTES_PER_SECOND",
+                help="simulated bandwidth for the replayed responses (default: unlimited)")
+        group.add_argument("--metrics-summary", action="store_true",
+                help="print a summary of the API requests at exit (default: %(default)s)")
+        group.add_argument("--metrics-file", type=ws.config.argtype_dirname_must_exist, metavar="PATH",
+                help="path to a file for logging all API requests in the JSON lines format (default: %(default)s)")
         # TODO: expose also user_agent, http_user, http_password?
 
     @classmethod
@@ -181,11 +291,157 @@ class Connection:
         :returns: an instance of :py:class:`Connection`
         """
         session = Connection.make_session(max_retries=args.connection_max_retries,
-                                          cookie_file=args.cookie_file)
-        return klass(args.api_url, args.index_url, session=session, timeout=args.connection_timeout)
+                                          cookie_file=args.cookie_file,
+                                          cassette_file=args.cassette,
+                                          cassette_mode=args.cassette_mode,
+                                          replay_latency=args.cassette_latency,
+                                          replay_bandwidth=args.cassette_bandwidth)
+        cache = None
+        if args.api_cache is not None:
+            from .cache import ResponseCache
+            cache = ResponseCache(args.api_cache,
+                                  ttl=args.api_cache_ttl,
+                                  max_size=args.api_cache_max_size * 1024 * 1024)
+        if args.cassette is not None and args.cassette_mode == "record":
+            import atexit
+            # the recording adapter writes a gzip stream which must be finished
+            atexit.register(session.close)
+        connection = klass(args.api_url, args.index_url, session=session, timeout=args.connection_timeout,
+                           cache=cache, limiter=Connection.make_limiter(args), maxlag=args.connection_maxlag,
+                           lazy_timestamps=args.connection_lazy_timestamps)
+        if args.metrics_summary or args.metrics_file is not None:
+            import atexit
+            from .metrics import SummarySink, JSONLinesSink
+            if args.metrics_summary:
+                summary = SummarySink()
+                connection.add_hook(summary)
+                atexit.register(summary.print_summary)
+            if args.metrics_file is not None:
+                sink = JSONLinesSink(args.metrics_file)
+                connection.add_hook(sink)
+                atexit.register(sink.close)
+        return connection
+
+    def add_hook(self, hook):
+        """
+        Registers a callable which is called after each API request made by
+        :py:meth:`call_api` with a dictionary describing the request. The event
+        has the following keys:
+
+        - ``timestamp``: the time when the call started (seconds since epoch)
+        - ``action``: the API action
+        - ``module``: the query modules, e.g. ``"generator=allpages prop=info"``
+          (empty for other actions)
+        - ``time``: wall time of the call in seconds
+        - ``bytes_out``: size of the request URLs and bodies
+        - ``bytes_in``: size of the response bodies
+        - ``retries``: number of requests retried due to HTTP 429 or maxlag
+        - ``sleep``: time spent waiting for the :py:attr:`limiter`
+        - ``continuation_round``: index of the request in the continuation
+          sequence (see :py:meth:`ws.client.api.API.query_continue`), or
+          ``None``
+        - ``cached``: whether the response was taken from :py:attr:`cache`
+        - ``error``: the API error code or exception name, or ``None``
+
+        The hooks may be called from multiple threads. See
+        :py:mod:`ws.client.metrics` for the built-in sinks.
+
+        :param hook: a callable taking the event dictionary
+        """
+        self.hooks.append(hook)
 
-    @RateLimited(10, 3)
-    def request(self, method, url, **kwargs):
+    @staticmethod
+    def _get_module(params):
+        modules = []
+        for key in ("list", "generator", "prop", "meta"):
+            if key in params:
+                value = params[key]
+                if not isinstance(value, str):
+                    value = "|".join(sorted(value))
+                modules.append("{}={}".format(key, value))
+        return " ".join(modules)
+
+    def _start_event(self, params, action):
+        """
+        Starts tracing an API call in the current thread. Returns ``None`` if
+        there are no hooks.
+        """
+        # the continuation round is set by query_continue for the next call only
+        continuation_round = getattr(self._trace, "continuation_round", None)
+        self._trace.continuation_round = None
+        if not self.hooks:
+            return None
+        stack = getattr(self._trace, "events", None)
+        if stack is None:
+            stack = self._trace.events = []
+        event = {
+            "timestamp": time.time(),
+            "action": action,
+            "module": self._get_module(params) if action == "query" else "",
+            "time": time.perf_counter(),
+            "bytes_out": 0,
+            "bytes_in": 0,
+            "retries": 0,
+            "sleep": 0.0,
+            "continuation_round": continuation_round,
+            "cached": False,
+            "error": None,
+        }
+        stack.append(event)
+        return event
+
+    def _current_event(self):
+        stack = getattr(self._trace, "events", None)
+        if stack:
+            return stack[-1]
+        return None
+
+    def _finish_event(self, event, error=None):
+        stack = self._trace.events
+        # streamed calls may be interleaved with other calls in the same thread
+        for i, e in enumerate(stack):
+            if e is event:
+                del stack[i]
+                break
+        event["time"] = time.perf_counter() - event["time"]
+        if event["error"] is None and error is not None:
+            event["error"] = type(error).__name__
+        for hook in self.hooks:
+            hook(event)
+
+    @staticmethod
+    def make_limiter(args):
+        """
+        Construct a :py:class:`ws.utils.rate.RateLimiter` object from arguments
+        parsed by :py:class:`argparse.ArgumentParser`.
+
+        :param args: an instance of :py:class:`argparse.Namespace`.
+        :returns: an instance of :py:class:`ws.utils.rate.RateLimiter`
+        """
+        rates = {
+            "read": args.connection_read_rate,
+            "write": args.connection_write_rate,
+            "edit": args.connection_edit_rate,
+        }
+        if getattr(args, "cassette", None) is not None and args.cassette_mode == "replay":
+            # replayed requests do not reach the server, the simulated latency
+            # and bandwidth are the only limits
+            rates = dict.fromkeys(rates, (10**9, 1))
+        return RateLimiter(rates, lock_file=args.connection_rate_lock_file)
+
+    @staticmethod
+    def get_rate_class(action):
+        """
+        Returns the class of the given API action for the :py:attr:`limiter`:
+        ``"edit"``, ``"write"`` or ``"read"``.
+        """
+        if action in EDIT_ACTIONS:
+            return "edit"
+        if action in POST_ACTIONS or action in MULTIPART_FORM_DATA:
+            return "write"
+        return "read"
+
+    def request(self, method, url, *, rate_class="read", **kwargs):
         """
         Simple HTTP request handler. It is basically a wrapper around
         :py:func:`requests.request()` using the established session including
@@ -195,6 +451,10 @@ class Connection:
         The parameters are the same as for :py:func:`requests.request()`, see
         `Requests documentation`_ for details.
 
+        The request is rate-limited by the :py:attr:`limiter` according to
+        ``rate_class``. Responses with the HTTP status 429 (Too Many Requests)
+        are retried after the delay given by the ``Retry-After`` header.
+
         There is no translation of exceptions, the :py:mod:`requests` exceptions
         (notably :py:exc:`requests.exceptions.ConnectionError`,
         :py:exc:`requests.exceptions.Timeout` and
@@ -202,10 +462,32 @@ class Connection:
 
         .. _`Requests documentation`: http://docs.python-requests.org/en/latest/api/
         """
-        response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        event = self._current_event()
+        retries = 0
+        while True:
+            # no rate-limiting inside tests
+            if not hasattr(ws, "_tests_are_running"):
+                delay = self.limiter.acquire(rate_class)
+                if event is not None:
+                    event["sleep"] += delay
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            if event is not None:
+                event["bytes_out"] += _get_request_size(response.request)
+                if not kwargs.get("stream"):
+                    event["bytes_in"] += len(response.content)
+            if response.status_code != 429 or retries >= MAX_THROTTLE_RETRIES:
+                break
+            retries += 1
+            if event is not None:
+                event["retries"] += 1
+            delay = get_retry_after(response, default=2 ** retries)
+            logger.warning("Server responded with 429 Too Many Requests, retrying in {} seconds [{}/{}]"
+                           .format(delay, retries, MAX_THROTTLE_RETRIES))
+            self.limiter.backoff(delay, rate_class)
 
         # raise HTTPError for bad requests (4XX client errors and 5XX server errors)
         response.raise_for_status()
+        self.limiter.success(rate_class)
 
         if isinstance(self.session.cookies, cookielib.FileCookieJar):
             self.session.cookies.save()
@@ -218,6 +500,8 @@ class Connection:
 
         Checks the ``action`` parameter (default is ``"help"`` as in the API),
         selects correct HTTP request method, handles API errors and warnings.
+        Responses of read-only queries are taken from :py:attr:`cache` if it
+        was set (see :py:meth:`_is_cacheable` for details).
 
         Parameters of the call can be passed either as a dict to ``params``, or
         as keyword arguments. ``params`` and ``kwargs`` cannot be specified at
@@ -243,6 +527,227 @@ class Connection:
             # utils.dmerge. Too complicated, not supported.
             raise ValueError("specifying 'params' and 'kwargs' at the same time is not supported")
 
+        result, _ = self._call_api(params, expand_result=expand_result, check_warnings=check_warnings)
+        return result
+
+    def _call_api(self, params, *, expand_result=True, check_warnings=True):
+        """
+        Implementation of :py:meth:`call_api`, which returns also the size of
+        the raw response body in bytes.
+
+        :returns: a tuple ``(result, size)``
+        """
+        action, method, request_kwargs = self._prepare_api_request(params)
+        event = self._start_event(params, action)
+        if event is None:
+            return self._call_api_impl(params, action, method, request_kwargs,
+                                       expand_result=expand_result, check_warnings=check_warnings)
+        error = None
+        try:
+            return self._call_api_impl(params, action, method, request_kwargs,
+                                       expand_result=expand_result, check_warnings=check_warnings)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish_event(event, error)
+
+    def _call_api_impl(self, params, action, method, request_kwargs, *, expand_result, check_warnings):
+        cache_key = None
+        if self.cache is not None and self._is_cacheable(action, request_kwargs):
+            if self._cache_validated is False:
+                # set the flag first, validation may call the API recursively
+                self._cache_validated = True
+                self._validate_cache()
+            cache_key = self.cache.make_key(self.api_url, request_kwargs.get("params") or request_kwargs.get("data"))
+            body = self.cache.get(cache_key)
+        else:
+            body = None
+
+        if body is not None:
+            result = self._decode_json(body)
+            event = self._current_event()
+            if event is not None:
+                event["cached"] = True
+                event["bytes_in"] += len(body)
+        else:
+            result, body = self._request_api(action, method, request_kwargs)
+            # errors are not cached
+            if cache_key is not None and "error" not in result:
+                self.cache.set(cache_key, body)
+            if "error" in result:
+                event = self._current_event()
+                if event is not None:
+                    event["error"] = result["error"].get("code")
+
+        result = self._process_api_response(params, action, result,
+                                            expand_result=expand_result, check_warnings=check_warnings,
+                                            lazy_timestamps=self.lazy_timestamps)
+        return result, len(body)
+
+    def _add_maxlag(self, request_kwargs):
+        """
+        Returns a copy of ``request_kwargs`` with the ``maxlag`` parameter
+        added to the query. The dicts passed by the caller are not modified.
+        """
+        if self.maxlag is None:
+            return request_kwargs
+        key = "params" if "params" in request_kwargs else "data"
+        request_kwargs = request_kwargs.copy()
+        request_kwargs[key] = dict(request_kwargs[key], maxlag=self.maxlag)
+        return request_kwargs
+
+    def _request_api(self, action, method, request_kwargs):
+        """
+        Makes the HTTP request for :py:meth:`call_api`. If the server responds
+        with the ``maxlag`` error, the :py:attr:`limiter` backs off and the
+        request is retried.
+
+        :returns: a tuple of the decoded response and the raw response body
+        """
+        rate_class = self.get_rate_class(action)
+        request_kwargs = self._add_maxlag(request_kwargs)
+
+        retries = 0
+        while True:
+            response = self.request(method, self.api_url, rate_class=rate_class, **request_kwargs)
+            result = self._decode_json(response.content)
+            if result.get("error", {}).get("code") != "maxlag" or retries >= MAX_THROTTLE_RETRIES:
+                return result, response.content
+            retries += 1
+            event = self._current_event()
+            if event is not None:
+                event["retries"] += 1
+            delay = get_retry_after(response, default=5)
+            logger.warning("Server lag exceeds maxlag={} ({}), retrying in {} seconds [{}/{}]"
+                           .format(self.maxlag, result["error"].get("info"), delay, retries, MAX_THROTTLE_RETRIES))
+            self.limiter.backoff(delay)
+
+    def _call_api_stream(self, params, container):
+        """
+        Streaming variant of :py:meth:`call_api` for responses with a large
+        collection of items, e.g. pages with content. The response is decoded
+        incrementally with :py:mod:`ijson` and the items of the array or object
+        at the ``container`` path (in the :py:mod:`ijson` prefix syntax, e.g.
+        ``"query.pages"``) are yielded as soon as they are decoded, so that
+        only one item is kept in memory at a time. The timestamps are parsed
+        in each item separately.
+
+        This is a generator whose return value is the rest of the response
+        (i.e. the full response with an empty container), which is checked for
+        errors and warnings the same way as in :py:meth:`call_api`. The
+        ``maxlag`` errors are retried, but the responses are never cached.
+
+        :param dict params: API parameters
+        :param str container: path to the collection in the response
+        """
+        if ijson is None:
+            raise ImportError("The ijson module is required for streaming API responses.")
+
+        action, method, request_kwargs = self._prepare_api_request(params)
+        event = self._start_event(params, action)
+        if event is None:
+            return (yield from self._call_api_stream_impl(params, container, action, method, request_kwargs, None))
+        error = None
+        try:
+            return (yield from self._call_api_stream_impl(params, container, action, method, request_kwargs, event))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish_event(event, error)
+
+    def _call_api_stream_impl(self, params, container, action, method, request_kwargs, event):
+        rate_class = self.get_rate_class(action)
+        request_kwargs = self._add_maxlag(request_kwargs)
+
+        retries = 0
+        while True:
+            response = self.request(method, self.api_url, rate_class=rate_class, stream=True, **request_kwargs)
+            try:
+                # let urllib3 handle the Content-Encoding
+                response.raw.decode_content = True
+                if event is None:
+                    rest = yield from _iter_json_items(response.raw, container, get_timestamp_keys(params),
+                                                       lazy=self.lazy_timestamps)
+                else:
+                    items = _iter_json_items(_CountingReader(response.raw, event), container, get_timestamp_keys(params),
+                                             lazy=self.lazy_timestamps)
+                    rest = yield from _exclude_consumer_time(items, event)
+            except ijson.JSONError:
+                raise APIJsonError("Failed to decode server response. Please make "
+                                   "sure that the API is enabled on the wiki and "
+                                   "that the API URL is correct.")
+            finally:
+                response.close()
+            if rest.get("error", {}).get("code") != "maxlag" or retries >= MAX_THROTTLE_RETRIES:
+                break
+            retries += 1
+            if event is not None:
+                event["retries"] += 1
+            delay = get_retry_after(response, default=5)
+            logger.warning("Server lag exceeds maxlag={} ({}), retrying in {} seconds [{}/{}]"
+                           .format(self.maxlag, rest["error"].get("info"), delay, retries, MAX_THROTTLE_RETRIES))
+            self.limiter.backoff(delay)
+
+        if event is not None and "error" in rest:
+            event["error"] = rest["error"].get("code")
+        return self._process_api_response(params, action, rest, expand_result=False,
+                                          lazy_timestamps=self.lazy_timestamps)
+
+    @staticmethod
+    def _decode_json(body):
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise APIJsonError("Failed to decode server response. Please make "
+                               "sure that the API is enabled on the wiki and "
+                               "that the API URL is correct.")
+
+    @staticmethod
+    def _is_cacheable(action, request_kwargs):
+        """
+        Checks if the response to an API call can be cached.
+
+        Only the ``query``, ``parse`` and ``expandtemplates`` actions are
+        cached, except for queries whose result depends on the session (tokens
+        and user info) or which are used for the cache invalidation
+        (``list=recentchanges``).
+        """
+        if action not in CACHEABLE_ACTIONS or "files" in request_kwargs:
+            return False
+        params = request_kwargs.get("params") or request_kwargs.get("data")
+        if "token" in params:
+            return False
+        if action == "query":
+            meta = set(str(params.get("meta", "")).split("|"))
+            lists = set(str(params.get("list", "")).split("|"))
+            if meta & {"tokens", "userinfo"} or "recentchanges" in lists:
+                return False
+        return True
+
+    def _validate_cache(self):
+        """
+        Called once before the first use of :py:attr:`cache` to drop stale
+        entries. The base class does not know how to detect changes on the
+        wiki, so it relies only on the TTL of the cache.
+        """
+        pass
+
+    @staticmethod
+    def _prepare_api_request(params):
+        """
+        Validates the API parameters and selects the HTTP method for the call.
+
+        This is the part of :py:meth:`call_api` which does not depend on the
+        HTTP library, so it is shared with :py:class:`ws.client.async_api.AsyncAPI`.
+
+        :param dict params: API parameters (the ``action`` key is set if missing)
+        :returns:
+            a tuple ``(action, method, request_kwargs)``, where
+            ``request_kwargs`` is a dict with the ``params``, ``data`` and
+            ``files`` keyword arguments for the HTTP request
+        """
         # check if action is valid
         action = params.setdefault("action", "help")
         if action not in API_ACTIONS:
@@ -262,23 +767,34 @@ class Connection:
             files = dict((k, v) for k, v in params.items() if k in MULTIPART_FORM_DATA[action])
             for k in files:
                 del params[k]
-            result = self.request("POST", self.api_url, data=params, files=files)
+            return action, "POST", {"data": params, "files": files}
         # we also form-encode queries with titles, revids and pageids because the
         # URL might be too long for GET, especially in case of titles
         elif action in POST_ACTIONS or (action == "query" and {"titles", "revids", "pageids"} & set(params.keys())):
             # passing `params` to `data` will cause form-encoding to take place,
             # which is necessary when editing pages longer than 8000 characters
-            result = self.request("POST", self.api_url, data=params)
+            return action, "POST", {"data": params}
         else:
-            result = self.request("GET", self.api_url, params=params)
-
-        try:
-            result = result.json()
-        except ValueError:
-            raise APIJsonError("Failed to decode server response. Please make "
-                               "sure that the API is enabled on the wiki and "
-                               "that the API URL is correct.")
+            return action, "GET", {"params": params}
 
+    @staticmethod
+    def _process_api_response(params, action, result, *, expand_result=True, check_warnings=True,
+                              lazy_timestamps=False):
+        """
+        Handles API errors and warnings in a decoded API response and parses
+        the timestamps.
+
+        This is the part of :py:meth:`call_api` which does not depend on the
+        HTTP library, so it is shared with :py:class:`ws.client.async_api.AsyncAPI`.
+
+        :param dict params: API parameters of the call (used for error reporting)
+        :param str action: the API action of the call
+        :param dict result: the JSON-decoded API response
+        :param bool lazy_timestamps:
+            if ``True``, the timestamps are converted on access (see
+            :py:func:`ws.utils.timestamps.wrap_timestamps`)
+        :returns: same as :py:meth:`call_api`
+        """
         # see if there are errors/warnings
         if "error" in result:
             raise APIError(params, result["error"])
@@ -289,7 +805,10 @@ class Connection:
             logger.warning(msg)
 
         # parse timestamps
-        parse_timestamps_in_struct(result)
+        if lazy_timestamps is True:
+            result = wrap_timestamps(result, get_timestamp_keys(params))
+        else:
+            parse_timestamps_in_struct(result, get_timestamp_keys(params))
 
         if expand_result is True:
             if action in result:
@@ -318,6 +837,114 @@ class Connection:
         """
         return requests.packages.urllib3.util.url.parse_url(self.api_url).hostname
 
+def _iter_json_items(fileobj, container, timestamp_keys=None, *, lazy=False):
+    """
+    Incrementally decodes a JSON document from ``fileobj`` and yields the items
+    of the array or the values of the object at the ``container`` prefix. The
+    timestamps in each item are parsed before it is yielded, see
+    :py:func:`ws.utils.timestamps.parse_timestamps_in_struct` for the meaning
+    of ``timestamp_keys``. If ``lazy`` is ``True``, the items are wrapped with
+    :py:func:`ws.utils.timestamps.wrap_timestamps` instead.
+
+    :returns: the rest of the document with an empty container
+    """
+    rest = ijson.ObjectBuilder()
+    item = None
+    depth = 0
+    inside = False
+    for prefix, event, value in ijson.parse(fileobj, use_float=True):
+        if item is not None:
+            item.event(event, value)
+            if event == "start_map" or event == "start_array":
+                depth += 1
+            elif event == "end_map" or event == "end_array":
+                depth -= 1
+            if depth == 0:
+                if lazy is True:
+                    yield wrap_timestamps(item.value, timestamp_keys)
+                else:
+                    parse_timestamps_in_struct(item.value, timestamp_keys)
+                    yield item.value
+                item = None
+        elif inside is True:
+            if prefix == container and (event == "end_map" or event == "end_array"):
+                inside = False
+                rest.event(event, value)
+            elif event != "map_key":
+                # start of a new item
+                item = ijson.ObjectBuilder()
+                item.event(event, value)
+                if event == "start_map" or event == "start_array":
+                    depth = 1
+                else:
+                    # scalar item
+                    yield item.value
+                    item = None
+        else:
+            rest.event(event, value)
+            if prefix == container and (event == "start_map" or event == "start_array"):
+                inside = True
+    return rest.value
+
+def _get_request_size(request):
+    """
+    Returns the size of the URL and body of a prepared request in bytes.
+    """
+    size = len(request.url)
+    if isinstance(request.body, (bytes, str)):
+        size += len(request.body)
+    return size
+
+class _CountingReader:
+    """
+    File-like wrapper which adds the number of bytes read to the ``bytes_in``
+    field of a traced event.
+    """
+    def __init__(self, fileobj, event):
+        self.fileobj = fileobj
+        self.event = event
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.event["bytes_in"] += len(data)
+        return data
+
+def _exclude_consumer_time(items, event):
+    """
+    Yields from the ``items`` generator and returns its value. The time spent
+    by the consumer between the items is excluded from the traced event.
+    """
+    try:
+        while True:
+            try:
+                item = next(items)
+            except StopIteration as e:
+                return e.value
+            paused = time.perf_counter()
+            yield item
+            # the "time" field holds the start time until the event is finished
+            event["time"] += time.perf_counter() - paused
+    finally:
+        items.close()
+
+def get_retry_after(response, default):
+    """
+    Returns the delay in seconds given by the ``Retry-After`` header of the
+    HTTP response, or ``default`` if the header is missing or invalid.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0, date.timestamp() - time.time())
+
 class APIWrongAction(Exception):
     """ Raised when a wrong API action is specified.
 
@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.client.metrics` module provides sinks for the events emitted by
+:py:class:`ws.client.connection.Connection` for each API request. A sink is any
+callable taking the event dictionary, see :py:meth:`Connection.add_hook
+<ws.client.connection.Connection.add_hook>` for the description of the event
+fields.
+
+Usage:
+
+.. code-block:: python
+
+    summary = SummarySink()
+    api.add_hook(summary)
+    api.add_hook(JSONLinesSink("requests.jsonl"))
+    ...
+    summary.print_summary()
+
+The sinks can be also enabled with the ``--metrics-summary`` and
+``--metrics-file`` options of
+:py:meth:`ws.client.connection.Connection.set_argparser`.
+"""
+
+import json
+import sys
+import threading
+
+__all__ = ["SummarySink", "JSONLinesSink"]
+
+class SummarySink:
+    """
+    Aggregates the events by the action and module and prints them as a table
+    with the totals of the numeric fields.
+    """
+
+    columns = ["requests", "cached", "errors", "retries", "time", "sleep", "bytes_out", "bytes_in"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows = {}
+
+    def __call__(self, event):
+        key = (event["action"], event["module"])
+        with self._lock:
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = dict.fromkeys(self.columns, 0)
+            row["requests"] += 1
+            row["cached"] += bool(event["cached"])
+            row["errors"] += event["error"] is not None
+            row["retries"] += event["retries"]
+            row["time"] += event["time"]
+            row["sleep"] += event["sleep"]
+            row["bytes_out"] += event["bytes_out"]
+            row["bytes_in"] += event["bytes_in"]
+
+    def format_table(self):
+        """
+        Returns the summary table as a string. The rows are sorted by the total
+        time in descending order.
+        """
+        header = ["action", "module"] + self.columns
+        with self._lock:
+            items = sorted(self.rows.items(), key=lambda item: item[1]["time"], reverse=True)
+        lines = [header]
+        for (action, module), row in items:
+            line = [action, module or "-"]
+            for column in self.columns:
+                value = row[column]
+                if isinstance(value, float):
+                    line.append("{:.3f}".format(value))
+                else:
+                    line.append(str(value))
+            lines.append(line)
+
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+        output = []
+        for line in lines:
+            # left-align the text columns and right-align the numbers
+            cells = [cell.ljust(width) if i < 2 else cell.rjust(width)
+                     for i, (cell, width) in enumerate(zip(line, widths))]
+            output.append("  ".join(cells).rstrip())
+        return "\n".join(output)
+
+    def print_summary(self, file=None):
+        """
+        Prints the summary table to ``file`` (the standard error output by
+        default).
+        """
+        if file is None:
+            file = sys.stderr
+        if not self.rows:
+            return
+        print("API requests summary:", file=file)
+        print(self.format_table(), file=file)
+
+class JSONLinesSink:
+    """
+    Writes each event as one JSON object per line into a file.
+
+    :param str path: path to the output file (it is overwritten)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line)
+            self._file.write("\n")
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
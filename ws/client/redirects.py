@@ -1,8 +1,12 @@
 #! /usr/bin/env python3
 
+import gzip
+import json
 import logging
+import os
+import sys
 
-from ..utils import LazyProperty
+from ..utils import LazyProperty, format_date, parse_date
 
 logger = logging.getLogger(__name__)
 
@@ -32,14 +36,31 @@ class Redirects:
 
     - Interwiki redirects are not included in the mapping.
 
+    The mapping for all namespaces (:py:attr:`map`) can be persisted in a
+    cache file. When the file exists, the mapping is loaded from it and updated
+    incrementally with the pages which were edited, created, moved or deleted
+    since the mapping was saved, so only the first run has to query all pages.
+
+    :param api: a :py:class:`ws.client.api.API` instance
+    :param str cache_file:
+        path to the file for persisting :py:attr:`map`, or ``None`` to fetch it
+        on each run
+
     .. _`first way`: https://www.mediawiki.org/wiki/API:Query#Resolving_redirects
     .. _`prop=redirects`: https://www.mediawiki.org/wiki/API:Redirects
     .. _`generator=allpages`: https://www.mediawiki.org/wiki/API:Allpages
     .. _`list=allredirects`: https://www.mediawiki.org/wiki/API:Allredirects
     """
 
-    def __init__(self, api):
+    # version of the cache file format
+    CACHE_VERSION = 1
+
+    def __init__(self, api, cache_file=None):
         self._api = api
+        self.cache_file = cache_file
+        # memoized results of resolve() for the current map
+        self._resolved = {}
+        self._resolved_map = None
 
     def fetch(self, source_namespaces="all", target_namespaces="all"):
         """
@@ -82,19 +103,119 @@ class Redirects:
                 target_title = page["title"]
                 for redirect in page.get("redirects", []):
                     source_title = redirect["title"]
-                    target_fragment = redirect.get("fragment")
-                    if target_fragment:
-                        redirects[source_title] = "{}#{}".format(target_title, target_fragment)
-                    else:
-                        redirects[source_title] = target_title
+                    redirects[source_title] = self._make_target(target_title, redirect.get("fragment"))
         return redirects
 
+    @staticmethod
+    def _make_target(title, fragment):
+        if fragment:
+            title = "{}#{}".format(title, fragment)
+        # many redirects share the same target, keep only one copy of the string
+        return sys.intern(title)
+
     @LazyProperty
     def map(self):
         """
         A lazily evaluated mapping for all namespaces on the wiki.
+
+        If :py:attr:`cache_file` is set, the mapping is loaded from the file and
+        updated incrementally (see :py:meth:`update`), or fetched and saved
+        into the file if it does not exist yet.
+        """
+        if self.cache_file is None:
+            return self.fetch()
+
+        # take the timestamp before fetching, the changes made during the
+        # fetching will be applied again on the next update
+        timestamp = self._get_current_timestamp()
+        redirects, since = self._load()
+        if redirects is None or not self.update(redirects, since):
+            logger.info("Fetching the redirects map for all namespaces...")
+            redirects = self.fetch()
+        self._save(redirects, timestamp)
+        return redirects
+
+    def _get_current_timestamp(self):
+        result = self._api.call_api(action="query", curtimestamp="", expand_result=False)
+        return result["curtimestamp"]
+
+    def _load(self):
+        """
+        Loads the mapping from :py:attr:`cache_file`.
+
+        :returns: a tuple ``(redirects, timestamp)``, or ``(None, None)`` if
+            the file does not exist or it is not valid for the current wiki
         """
-        return self.fetch()
+        try:
+            with gzip.open(self.cache_file, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to load the redirects cache {}: {}".format(self.cache_file, e))
+            return None, None
+        if data.get("version") != self.CACHE_VERSION or data.get("api_url") != self._api.api_url:
+            return None, None
+        redirects = dict((source, sys.intern(target)) for source, target in data["map"].items())
+        return redirects, parse_date(data["timestamp"])
+
+    def _save(self, redirects, timestamp):
+        data = {
+            "version": self.CACHE_VERSION,
+            "api_url": self._api.api_url,
+            "timestamp": format_date(timestamp),
+            "map": redirects,
+        }
+        # write into a temporary file first so that the cache is never left incomplete
+        tmp_file = self.cache_file + ".tmp"
+        with gzip.open(tmp_file, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def update(self, redirects, since):
+        """
+        Updates a mapping created by :py:meth:`fetch` with the changes made on
+        the wiki since the given time. The pages which were edited, created,
+        moved or deleted are queried again and their entries are replaced.
+
+        :param dict redirects: the mapping to be updated in place
+        :param datetime.datetime since: the time when the mapping was fetched
+        :returns:
+            ``True`` if the mapping was updated, ``False`` if the changes are
+            not available because the ``recentchanges`` table does not cover
+            the whole period
+        """
+        oldest = self._api.oldest_rc_timestamp
+        if oldest is None or oldest > since:
+            return False
+
+        titles = set()
+        for change in self._api.list(list="recentchanges", rcstart=since, rcdir="newer",
+                                     rctype="edit|new", rcprop="title", rclimit="max"):
+            titles.add(change["title"])
+        for logtype in ["move", "delete"]:
+            for logevent in self._api.list(list="logevents", letype=logtype, lestart=since, ledir="newer",
+                                           leprop="title|details", lelimit="max"):
+                # the title may be hidden by revision deletion
+                if "title" in logevent:
+                    titles.add(logevent["title"])
+                target = logevent.get("params", {}).get("target_title")
+                if target:
+                    titles.add(target)
+
+        if not titles:
+            return True
+        logger.info("Updating the redirects map for {} changed pages...".format(len(titles)))
+
+        for title in titles:
+            redirects.pop(title, None)
+        for chunk in self._api.call_api_autoiter_ids(action="query", titles=titles, redirects=""):
+            for redirect in chunk.get("redirects", []):
+                # interwiki redirects are not included in the mapping
+                if "tointerwiki" in redirect:
+                    continue
+                redirects[redirect["from"]] = self._make_target(redirect["to"], redirect.get("tofragment"))
+        return True
 
     def resolve(self, source):
         """
@@ -103,13 +224,29 @@ class Redirects:
         loop is detected, an error is logged and the page is treated as if it
         was not a redirect.
 
+        The results are memoized until the :py:attr:`map` property is reset.
+
         :param str source: the title to be resolved
         :returns:
             A string of the last non-redirect target page if ``source`` is a
             redirect page, otherwise ``None``.
         """
+        redirects = self.map
+        if self._resolved_map is not redirects:
+            self._resolved = {}
+            self._resolved_map = redirects
+        try:
+            return self._resolved[source]
+        except KeyError:
+            pass
+        result = self._resolve(redirects, source)
+        self._resolved[source] = result
+        return result
+
+    @staticmethod
+    def _resolve(redirects, source):
         def _get(source, anchor):
-            target = self.map.get(source)
+            target = redirects.get(source)
             if not target:
                 return None, None
             try:
@@ -121,11 +258,11 @@ class Redirects:
         intermediates = set()
         target, anchor = _get(source, None)
         source = target
-        while source in self.map and target not in intermediates:
+        while source in redirects and target not in intermediates:
             target, anchor = _get(source, anchor)
             intermediates.add(target)
             source = target
-        if target in self.map:
+        if target in redirects:
             logger.error("Failed to resolve last redirect target of '{}': detected infinite loop.".format(source))
             return None
         if anchor:
@@ -2,6 +2,7 @@
 
 import argparse
 import configparser
+import datetime
 import json
 import logging
 import os
@@ -15,8 +16,10 @@ __all__ = [
     "ConfigParser",
     "argtype_bool",
     "argtype_config",
+    "argtype_datetime",
     "argtype_dirname_must_exist",
     "argtype_existing_dir",
+    "argtype_rate",
     "getArgParser",
     "object_from_argparser",
 ]
@@ -136,6 +139,25 @@ def argtype_dirname_must_exist(string):
         raise argparse.ArgumentTypeError("directory '{}' does not exist".format(dirname))
     return string
 
+# rate in the N/SECONDS format (e.g. 10/3), converted to a tuple
+def argtype_rate(string):
+    try:
+        rate, per = string.split("/", 1)
+        rate = float(rate)
+        per = float(per)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid rate '{}', expected N/SECONDS".format(string))
+    if rate <= 0 or per <= 0:
+        raise argparse.ArgumentTypeError("invalid rate '{}', both values must be positive".format(string))
+    return rate, per
+
+# timestamp in the MediaWiki format (e.g. 2020-01-01T00:00:00Z)
+def argtype_datetime(string):
+    try:
+        return datetime.datetime.strptime(string, "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid timestamp '{}', expected YYYY-MM-DDTHH:MM:SSZ".format(string))
+
 
 def getArgParser(**kwargs):
     """
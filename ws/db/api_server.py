@@ -0,0 +1,343 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.db.api_server` module exposes the MediaWiki-like queries
+implemented in :py:mod:`ws.db.selects` as a read-only ``api.php`` endpoint.
+The :py:class:`APIServer` class is a WSGI application, so it can be run by any
+WSGI server or by :py:meth:`APIServer.make_server` for local use, e.g. with
+the ``api-server.py`` script.
+
+Only ``action=query`` is supported, with the following limitations:
+
+- Only one ``list`` module or one page set (``titles``, ``pageids`` or
+  ``generator``) can be used in a single query, together with ``prop``
+  modules and the ``siteinfo`` and ``userinfo`` meta modules.
+- Query continuation is implemented for the ``list`` and ``generator``
+  modules with keyset pagination, i.e. the ``<prefix>continue`` parameter
+  holds the sort key of the last returned item. The ``prop`` modules return
+  all values at once.
+- The output uses the JSON format version 1. Timestamps are formatted the same
+  way as in MediaWiki.
+"""
+
+import datetime
+import json
+import logging
+import socketserver
+import urllib.parse
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import ws
+from ws.utils import format_date, parse_timestamp
+from . import selects
+from .database import Database, LEGAL_TITLE_CHARS
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["APIServer"]
+
+# parameters of the query modules (without the prefix) which take a set of values
+SET_PARAMS = {"prop", "show", "type", "prtype", "prlevel", "level", "group", "excludegroup"}
+# parameters of the query modules which take a string or a set of strings
+STR_OR_SET_PARAMS = {"titles", "title", "templates", "images", "categories", "lang", "prefix"}
+# parameters of the query modules which take an integer or a set of integers
+INT_PARAMS = {"namespace", "minsize", "maxsize"}
+# parameters of the query modules which take a timestamp
+TIMESTAMP_PARAMS = {"start", "end"}
+# boolean parameters of the query modules
+BOOL_PARAMS = {"toponly", "witheditsonly", "activeusers"}
+
+class APIError(Exception):
+    """
+    Raised for queries which cannot be answered. It is reported to the client
+    as the ``error`` part of the response.
+    """
+    def __init__(self, code, info):
+        super().__init__(info)
+        self.code = code
+        self.info = info
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        if value == datetime.datetime.max:
+            return "infinity"
+        return format_date(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+def _convert_value(name, value):
+    """
+    Converts a string value of a query module parameter to the type expected
+    by :py:mod:`ws.db.selects`.
+    """
+    if name in SET_PARAMS:
+        return set(value.split("|"))
+    elif name in STR_OR_SET_PARAMS:
+        if "|" in value:
+            return set(value.split("|"))
+        return value
+    elif name in INT_PARAMS:
+        if "|" in value:
+            return set(int(v) for v in value.split("|"))
+        return int(value)
+    elif name in TIMESTAMP_PARAMS:
+        return parse_timestamp(value)
+    elif name in BOOL_PARAMS:
+        return True
+    return value
+
+def _get_limit(value, max_limit):
+    if value is None:
+        return 10
+    if value == "max":
+        return max_limit
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, max_limit)
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+class APIServer:
+    """
+    WSGI application serving the MediaWiki API from the SQL database.
+
+    :param ws.db.database.Database db: the database to query
+    :param int max_limit: the value used for ``<prefix>limit=max``
+    :param str sitename: the site name reported by ``meta=siteinfo``
+    """
+
+    def __init__(self, db, *, max_limit=5000, sitename="wiki-scripts"):
+        self.db = db
+        self.max_limit = max_limit
+        self.sitename = sitename
+
+    @staticmethod
+    def set_argparser(argparser):
+        """
+        Add arguments for constructing a :py:class:`APIServer` object to an
+        instance of :py:class:`argparse.ArgumentParser`.
+
+        See also the :py:mod:`ws.config` module.
+
+        :param argparser: an instance of :py:class:`argparse.ArgumentParser`
+        """
+        Database.set_argparser(argparser)
+        group = argparser.add_argument_group(title="API server parameters")
+        group.add_argument("--api-server-host", metavar="HOST", default="localhost",
+                help="hostname or address on which the server listens (default: %(default)s)")
+        group.add_argument("--api-server-port", metavar="PORT", type=int, default=8080,
+                help="port on which the server listens (default: %(default)s)")
+        group.add_argument("--api-server-max-limit", metavar="N", type=int, default=5000,
+                help="maximum number of items returned by list and generator modules (default: %(default)s)")
+        group.add_argument("--api-server-sitename", metavar="NAME", default="wiki-scripts",
+                help="site name reported by meta=siteinfo (default: %(default)s)")
+
+    @classmethod
+    def from_argparser(klass, args, db=None):
+        """
+        Construct a :py:class:`APIServer` object from arguments parsed by
+        :py:class:`argparse.ArgumentParser`.
+
+        :param args:
+            an instance of :py:class:`argparse.Namespace`. It is assumed that it
+            contains the arguments set by :py:meth:`APIServer.set_argparser`.
+        :param db: an existing :py:class:`ws.db.database.Database` object
+        :returns: an instance of :py:class:`APIServer`
+        """
+        if db is None:
+            db = Database.from_argparser(args)
+        return klass(db, max_limit=args.api_server_max_limit, sitename=args.api_server_sitename)
+
+    def make_server(self, host="localhost", port=8080):
+        """
+        Returns a multi-threaded :py:class:`wsgiref.simple_server.WSGIServer`
+        serving the application. Call its ``serve_forever()`` method to start
+        handling requests.
+        """
+        return make_server(host, port, self, server_class=ThreadingWSGIServer,
+                           handler_class=QuietWSGIRequestHandler)
+
+    def __call__(self, environ, start_response):
+        params = dict(urllib.parse.parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True))
+        if environ["REQUEST_METHOD"] == "POST":
+            content_type = environ.get("CONTENT_TYPE", "")
+            try:
+                length = int(environ.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                length = 0
+            body = environ["wsgi.input"].read(length)
+            if content_type.startswith("application/x-www-form-urlencoded"):
+                params.update(urllib.parse.parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+            else:
+                params = None
+
+        if params is None:
+            result = {"error": {"code": "badcontenttype", "info": "Only application/x-www-form-urlencoded POST requests are supported."}}
+        else:
+            result = self.handle(params)
+
+        body = json.dumps(result, default=_json_default, ensure_ascii=False).encode("utf-8")
+        headers = [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Content-Length", str(len(body))),
+        ]
+        # MediaWiki reports API errors with status 200 as well
+        start_response("200 OK", headers)
+        return [body]
+
+    def handle(self, params):
+        """
+        Answers an API query.
+
+        :param dict params: the API parameters as strings
+        :returns: the API response as a dict
+        """
+        action = params.get("action", "help")
+        try:
+            if action != "query":
+                raise APIError("unknown_action", "Unrecognized value for parameter \"action\": {}. Only action=query is supported.".format(action))
+            return self.query(params)
+        except APIError as e:
+            return {"error": {"code": e.code, "info": e.info}}
+        except NotImplementedError as e:
+            return {"error": {"code": "notimplemented", "info": str(e) or "The query is not implemented."}}
+        except (AssertionError, ValueError) as e:
+            return {"error": {"code": "badparams", "info": str(e) or "Invalid combination of parameters."}}
+
+    def _module_params(self, params, module, name):
+        """
+        Returns a dict with the converted parameters of a query module.
+        """
+        try:
+            prefix = selects.get_api_prefix(module, name)
+        except KeyError:
+            raise APIError("badvalue", "Unrecognized value for parameter \"{}\": {}.".format(module, name))
+        module_params = {}
+        for key, value in params.items():
+            if key.startswith(prefix) and key != module:
+                suffix = key[len(prefix):]
+                # limits and continuation are handled by the server
+                if suffix in {"limit", "continue"}:
+                    continue
+                module_params[key] = _convert_value(suffix, value)
+        return module_params
+
+    def query(self, params):
+        result = {}
+        query = {}
+
+        if "meta" in params:
+            for meta in params["meta"].split("|"):
+                if meta == "siteinfo":
+                    query.update(self.siteinfo(params.get("siprop", "general").split("|")))
+                elif meta == "userinfo":
+                    query["userinfo"] = self.userinfo()
+                else:
+                    raise APIError("badvalue", "Unrecognized value for parameter \"meta\": {}.".format(meta))
+
+        if "list" in params:
+            if "|" in params["list"] or {"titles", "pageids", "generator"} & set(params):
+                raise NotImplementedError("Only one list module without a page set is supported.")
+            list_ = params["list"]
+            list_params = self._module_params(params, "list", list_)
+            list_params["list"] = list_
+            prefix = selects.get_api_prefix("list", list_)
+            continuation = {"continue": params.get(prefix + "continue")}
+            limit = _get_limit(params.get(prefix + "limit"), self.max_limit)
+            query[list_] = list(selects.list(self.db, list_params, continuation=continuation, limit=limit))
+            if "continue" in continuation:
+                result["continue"] = {prefix + "continue": continuation["continue"], "continue": "-||"}
+        elif {"titles", "pageids", "generator"} & set(params):
+            pageset_params = {}
+            if "prop" in params:
+                prop = set(params["prop"].split("|"))
+                pageset_params["prop"] = prop
+                for p in prop:
+                    pageset_params.update(self._module_params(params, "prop", p))
+            if "generator" in params:
+                generator = params["generator"]
+                generator_params = self._module_params(params, "generator", generator)
+                generator_params["generator"] = generator
+                prefix = selects.get_api_prefix("generator", generator)
+                continuation = {"continue": params.get(prefix + "continue")}
+                limit = _get_limit(params.get(prefix + "limit"), self.max_limit)
+                pageids = selects.generator_pageids(self.db, generator_params, continuation=continuation, limit=limit)
+                if "continue" in continuation:
+                    result["continue"] = {prefix + "continue": continuation["continue"], "continue": "-||"}
+                if pageids:
+                    pageset_params["pageids"] = set(pageids)
+            elif "titles" in params:
+                pageset_params["titles"] = set(params["titles"].split("|"))
+            else:
+                pageset_params["pageids"] = set(int(p) for p in params["pageids"].split("|"))
+
+            if "titles" in pageset_params or "pageids" in pageset_params:
+                pages = {}
+                missing = 0
+                for page in selects.query_pageset(self.db, pageset_params):
+                    if "pageid" in page and "missing" not in page:
+                        pages[str(page["pageid"])] = page
+                    else:
+                        missing += 1
+                        pages[str(-missing)] = page
+                query["pages"] = pages
+
+        if query:
+            result["query"] = query
+        if "continue" not in result:
+            result["batchcomplete"] = ""
+        return result
+
+    def siteinfo(self, siprop):
+        """
+        Returns the ``meta=siteinfo`` part of the response for the given
+        properties.
+        """
+        info = {}
+        for prop in siprop:
+            if prop == "general":
+                info["general"] = {
+                    "sitename": self.sitename,
+                    "generator": "wiki-scripts {}".format(ws.__version__),
+                    "case": "first-letter",
+                    "legaltitlechars": LEGAL_TITLE_CHARS,
+                }
+            elif prop == "namespaces":
+                info["namespaces"] = selects.get_namespaces(self.db)
+            elif prop == "namespacealiases":
+                namespaces = selects.get_namespaces(self.db)
+                names = set()
+                for ns in namespaces.values():
+                    names.add(ns["*"])
+                    if "canonical" in ns:
+                        names.add(ns["canonical"])
+                info["namespacealiases"] = [{"id": id_, "*": name}
+                                            for name, id_ in sorted(selects.get_namespacenames(self.db).items())
+                                            if name not in names]
+            elif prop == "interwikimap":
+                info["interwikimap"] = list(selects.get_interwikimap(self.db).values())
+            else:
+                raise NotImplementedError("siprop={} is not implemented.".format(prop))
+        return info
+
+    def userinfo(self):
+        """
+        Returns the ``meta=userinfo`` part of the response. The server is
+        read-only, so the client is always an anonymous user. It is given the
+        ``apihighlimits`` right, because the limits of the production wiki do
+        not apply to the local database.
+        """
+        return {
+            "id": 0,
+            "name": "127.0.0.1",
+            "anon": "",
+            "groups": ["*"],
+            "rights": ["read", "apihighlimits"],
+        }
@@ -20,18 +20,24 @@ import alembic.config
 import alembic.migration
 
 from . import schema, selects, grabbers, parser_cache
+from .text_storage import TextStorage
 from ..parser_helpers.title import Context, Title
 
 __all__ = ["Database"]
 
 logger = logging.getLogger(__name__)
 
+# legaltitlechars are not stored in the database, it will hardly ever
+# change so let's just hardcode it
+LEGAL_TITLE_CHARS = " %!\"$&'()*,\\-.\\/0-9:;=?@A-Z\\\\^_`a-z~\\x80-\\xFF+"
+
 class Database:
     # it doesn't make sense to even test anything else
     charset = "utf8"
 
     # TODO: take parameters
-    def __init__(self, engine_or_url, async_engine_or_url):
+    def __init__(self, engine_or_url, async_engine_or_url, *, text_compression=None,
+                 text_compression_level=3, text_dictionary=None, text_keyframe_interval=None):
         """
         :param engine_or_url:
             either an existing :py:class:`sqlalchemy.engine.Engine` instance
@@ -39,11 +45,29 @@ class Database:
         :param async_engine_or_url:
             either an existing :py:class:`sqlalchemy.ext.asyncio.AsyncEngine`
             instance or a :py:class:`sqlalchemy.engine.url.URL`
+        :param str text_compression:
+            compression of the revision text (``None`` or ``"zstd"``), see
+            :py:mod:`ws.db.text_storage`
+        :param int text_compression_level: the compression level
+        :param int text_dictionary: ID of the compression dictionary
+        :param int text_keyframe_interval:
+            maximum length of the chains of revision text deltas (``None``
+            disables the deltas)
         """
 
         # limit for continuation
         self.chunk_size = 5000
 
+        # load the initial imports of the grabbers with COPY, see
+        # ws.db.execution.CopyExecutionQueue
+        self.bulk_load = True
+
+        # commit the initial imports of the grabbers with a checkpoint after
+        # the given number of entries or seconds (None disables the limit), see
+        # ws.db.grabbers.GrabberBase.GrabberBase.insert
+        self.checkpoint_rows = 100000
+        self.checkpoint_interval = 600
+
         if isinstance(engine_or_url, sa.engine.Engine):
             self.engine = engine_or_url
         else:
@@ -59,6 +83,11 @@ class Database:
         self.metadata = sa.MetaData()
         schema.create_tables(self.metadata)
 
+        self.text_storage = TextStorage(self, compression=text_compression,
+                                        level=text_compression_level,
+                                        dictionary_id=text_dictionary,
+                                        keyframe_interval=text_keyframe_interval)
+
         alembic_cfg_path = os.path.join(os.path.dirname(__file__), "../..", "alembic.ini")
         alembic_cfg = alembic.config.Config(alembic_cfg_path)
 
@@ -110,6 +139,15 @@ class Database:
                 help="port on which the database server listens (default: %(default)s)")
         group.add_argument("--db-name", metavar="DATABASE", required=True,
                 help="name of the database (default: %(default)s)")
+        group.add_argument("--db-text-compression", choices=["none", "zstd"], default="none",
+                help="compression of the newly stored revision text (default: %(default)s)")
+        group.add_argument("--db-text-compression-level", metavar="LEVEL", type=int, default=3,
+                help="zstd compression level (default: %(default)s)")
+        group.add_argument("--db-text-dictionary", metavar="ID", type=int,
+                help="ID of a trained zstd dictionary used for the compression (default: %(default)s)")
+        group.add_argument("--db-text-keyframe-interval", metavar="N", type=int,
+                help="store the revision text as deltas against the parent revision, with a full text "
+                     "every N revisions (default: %(default)s, i.e. no deltas)")
 
     @classmethod
     def from_argparser(klass, args):
@@ -140,7 +178,12 @@ class Database:
                                              host=args.db_host,
                                              port=args.db_port,
                                              database=args.db_name)
-        return klass(url, async_url)
+        text_compression = None if args.db_text_compression == "none" else args.db_text_compression
+        return klass(url, async_url,
+                     text_compression=text_compression,
+                     text_compression_level=args.db_text_compression_level,
+                     text_dictionary=args.db_text_dictionary,
+                     text_keyframe_interval=args.db_text_keyframe_interval)
 
     def __getattr__(self, table_name):
         """
@@ -153,7 +196,8 @@ class Database:
             raise AttributeError("Table '{}' does not exist in the database.".format(table_name))
         return self.metadata.tables[table_name]
 
-    def sync_with_api(self, api, *, with_content=False, check_needs_update=True):
+    def sync_with_api(self, api, *, with_content=False, check_needs_update=True, concurrency=4,
+                      import_concurrency=1):
         """
         Sync the local data with a remote MediaWiki instance.
 
@@ -163,10 +207,18 @@ class Database:
         :param bool check_needs_update:
             whether to use the ``recentchanges`` table to check if the
             synchronization is needed and otherwise exit early
+        :param int concurrency:
+            number of grabbers running at the same time (independent tables
+            are synchronized concurrently)
+        :param int import_concurrency:
+            number of parallel workers for the initial import of the
+            ``revision`` and ``logging`` tables, which is split into time
+            shards
         """
-        grabbers.synchronize(self, api, with_content=with_content, check_needs_update=check_needs_update)
+        grabbers.synchronize(self, api, with_content=with_content, check_needs_update=check_needs_update,
+                             concurrency=concurrency, import_concurrency=import_concurrency)
 
-    def sync_revisions_content(self, api, *, mode="latest"):
+    def sync_revisions_content(self, api, *, mode="latest", concurrency=1, priority_namespaces=None):
         """
         Sync the revisions content with a remote MediaWiki instance.
 
@@ -178,9 +230,17 @@ class Database:
 
                 - `"latest"`: the content of the latest revisions of all pags on
                   the wiki will be synchronized
-                - `"all"`: the content of all revisions will be synchronized
+                - `"all"`: the content of all revisions will be synchronized,
+                  including the deleted revisions (if the user has the
+                  ``deletedtext`` right)
+        :param int concurrency:
+            number of API queries for the content made at the same time
+        :param list priority_namespaces:
+            numbers of namespaces whose pages are synchronized first, e.g.
+            ``[10, 828]`` for templates and modules
         """
-        grabbers.GrabberRevisions(api, self).sync_revisions_content(mode=mode)
+        grabbers.GrabberRevisions(api, self).sync_revisions_content(mode=mode, concurrency=concurrency,
+                                                                    priority_namespaces=priority_namespaces)
 
     def query(self, *args, **kwargs):
         """
@@ -200,10 +260,7 @@ class Database:
         iwmap = selects.get_interwikimap(self)
         namespacenames = selects.get_namespacenames(self)
         namespaces = selects.get_namespaces(self)
-        # legaltitlechars are not stored in the database, it will hardly ever
-        # change so let's just hardcode it
-        legaltitlechars = " %!\"$&'()*,\\-.\\/0-9:;=?@A-Z\\\\^_`a-z~\\x80-\\xFF+"
-        context = Context(iwmap, namespacenames, namespaces, legaltitlechars)
+        context = Context(iwmap, namespacenames, namespaces, LEGAL_TITLE_CHARS)
         return Title(context, title)
 
     def update_parser_cache(self):
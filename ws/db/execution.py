@@ -1,5 +1,13 @@
 #! /usr/bin/env python3
 
+import logging
+
+import sqlalchemy as sa
+
+__all__ = ["DeferrableExecutionQueue", "CopyExecutionQueue", "restore_indexes"]
+
+logger = logging.getLogger(__name__)
+
 class DeferrableExecutionQueue:
     """
     An execution wrapper which defers the execution of statements until the
@@ -72,3 +80,170 @@ class DeferrableExecutionQueue:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.execute_deferred()
+
+
+class CopyExecutionQueue(DeferrableExecutionQueue):
+    """
+    A variant of :py:class:`DeferrableExecutionQueue` for bulk loading, which
+    streams the rows of plain ``INSERT`` statements into empty tables with
+    PostgreSQL's ``COPY ... FROM STDIN`` instead of *executemany*.
+
+    A queued statement is copied if it is an ``INSERT`` into a table without
+    explicit ``VALUES``, its parameters are exactly column names of the table,
+    and the table was empty when the queue was flushed for the first time.
+    The ``ON CONFLICT`` clauses of the copied statements are ignored, so it
+    is a precondition that the rows inserted into each copied table by the
+    caller do not contain duplicate keys. All other statements are executed
+    the same way as by :py:class:`DeferrableExecutionQueue`, preserving the
+    order of the queues.
+
+    Copying requires the ``psycopg`` driver, other drivers fall back to
+    *executemany* for all statements.
+
+    :param sqlalchemy.engine.Connection conn:
+        a connection (with an established transaction) to the database where the
+        statements are executed
+    :param int chunk_size:
+        maximum queue size
+    :param defer_indexes:
+        names of the tables whose non-unique indexes are dropped when they are
+        filled by ``COPY`` and created again from the metadata (see
+        :py:mod:`ws.db.schema`) when the queue is closed, which is much faster
+        than updating them for each row. Dropping an index locks the table
+        until the transaction is committed, so only the tables which are not
+        read by other connections during the load (including the connections
+        used by the caller for lookups) may be listed. When the transaction
+        is committed before the queue is closed, the tables stay without the
+        indexes until then (see :py:func:`restore_indexes`).
+    :param dict copy_tables:
+        a dict mapping table names to a bool indicating if the table is filled
+        by ``COPY``. It can be shared between multiple queues which insert
+        disjoint sets of rows in concurrent transactions, so that the tables
+        are checked only once.
+    """
+    def __init__(self, conn, chunk_size, *, defer_indexes=(), copy_tables=None):
+        super().__init__(conn, chunk_size)
+        self.defer_indexes = frozenset(defer_indexes)
+        self.copy_supported = conn.dialect.driver == "psycopg"
+        if copy_tables is None:
+            copy_tables = {}
+        self.copy_tables = copy_tables
+        # indexes to be created when the queue is closed
+        self.deferred_indexes = []
+        # number of copied rows per table
+        self.copied_rows = {}
+
+    def _is_copy_target(self, table):
+        if table.name not in self.copy_tables:
+            sel = sa.select(sa.literal(1)).select_from(table).limit(1)
+            empty = self.conn.execute(sel).first() is None
+            self.copy_tables[table.name] = empty
+            if empty and table.name in self.defer_indexes:
+                self._drop_indexes(table)
+        return self.copy_tables[table.name]
+
+    def _drop_indexes(self, table):
+        # unique indexes are kept, they may be needed for ON CONFLICT clauses
+        # and foreign keys
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if not index.unique:
+                self.conn.execute(sa.text("DROP INDEX IF EXISTS {}".format(
+                    self.conn.dialect.identifier_preparer.quote(index.name))))
+                self.deferred_indexes.append(index)
+
+    def _can_copy(self, statement, entries):
+        if not self.copy_supported:
+            return False
+        if not isinstance(statement, sa.sql.dml.Insert):
+            return False
+        if not isinstance(statement.table, sa.Table):
+            return False
+        if statement._values is not None or statement._returning:
+            return False
+        keys = entries[0].keys()
+        if not keys or any(key not in statement.table.c for key in keys):
+            return False
+        if any(entry.keys() != keys for entry in entries):
+            return False
+        return self._is_copy_target(statement.table)
+
+    def _copy(self, table, entries):
+        dialect = self.conn.dialect
+        preparer = dialect.identifier_preparer
+        names = list(entries[0])
+        # the values are converted the same way as for the INSERT statements
+        processors = [table.c[name].type.dialect_impl(dialect).bind_processor(dialect)
+                      for name in names]
+        query = "COPY {} ({}) FROM STDIN".format(preparer.format_table(table),
+                                                ", ".join(preparer.quote(name) for name in names))
+
+        driver_connection = self.conn.connection.driver_connection
+        with driver_connection.cursor() as cursor:
+            with cursor.copy(query) as copy:
+                for entry in entries:
+                    row = []
+                    for name, processor in zip(names, processors):
+                        value = entry[name]
+                        if processor is not None:
+                            value = processor(value)
+                        row.append(value)
+                    copy.write_row(row)
+
+        self.copied_rows.setdefault(table.name, 0)
+        self.copied_rows[table.name] += len(entries)
+
+    def execute_deferred(self):
+        """
+        Copy or execute all deferred statements and clear the queue.
+        """
+        for statement in self.ordered_keys:
+            if statement in self.stmt_queues:
+                entries = self.stmt_queues[statement]
+                if self._can_copy(statement, entries):
+                    self._copy(statement.table, entries)
+                else:
+                    self.conn.execute(statement, entries)
+
+        # don't clear self.ordered_keys to preserve the order from first execution
+        self.stmt_queues.clear()
+
+    def finalize(self):
+        """
+        Create the deferred indexes and update the planner statistics of the
+        tables filled by ``COPY``.
+        """
+        for index in self.deferred_indexes:
+            logger.info("Creating index {}".format(index.name))
+            self.conn.execute(sa.schema.CreateIndex(index))
+        self.deferred_indexes.clear()
+
+        preparer = self.conn.dialect.identifier_preparer
+        for name, count in self.copied_rows.items():
+            logger.info("Copied {} rows into the {} table".format(count, name))
+            self.conn.execute(sa.text("ANALYZE {}".format(preparer.quote(name))))
+        self.copied_rows.clear()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the transaction is rolled back on errors, including the dropped indexes
+        if exc_type is None:
+            self.execute_deferred()
+            self.finalize()
+
+
+def restore_indexes(conn, tables):
+    """
+    Creates the indexes of the given tables which are defined in the metadata
+    but do not exist in the database. This is needed when a transaction which
+    dropped the indexes in :py:class:`CopyExecutionQueue` was committed, but
+    the queue was not closed (e.g. an interrupted import with checkpoints).
+
+    :param sqlalchemy.engine.Connection conn: a connection to the database
+    :param tables: an iterable of :py:class:`sqlalchemy.Table` objects
+    """
+    inspector = sa.inspect(conn)
+    for table in tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                logger.info("Creating missing index {}".format(index.name))
+                conn.execute(sa.schema.CreateIndex(index))
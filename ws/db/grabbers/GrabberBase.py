@@ -1,18 +1,129 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import datetime
 import logging
+import time
 
 from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert
 
 from ws.client.api import ShortRecentChangesError
-from ws.db.execution import DeferrableExecutionQueue
+from ws.db.execution import DeferrableExecutionQueue, CopyExecutionQueue, restore_indexes
 
-__all__ = ["GrabberBase"]
+__all__ = ["GrabberBase", "Checkpoint", "ShardProgress", "split_time_range"]
 
 logger = logging.getLogger(__name__)
 
+def split_time_range(start, end, count):
+    """
+    Splits the time range from ``start`` to ``end`` into ``count`` shards of
+    equal length. The shard boundaries are whole seconds and each shard is
+    a closed interval, so that they can be passed directly as the ``start``
+    and ``end`` parameters of the API list modules. The first shard has no
+    lower bound and the last shard has no upper bound (``None``), so that
+    nothing is missed regardless of the estimated range.
+
+    :param datetime.datetime start: the oldest timestamp
+    :param datetime.datetime end: the newest timestamp
+    :param int count: the number of shards
+    :returns: a list of ``(start, end)`` tuples
+    """
+    step = (end - start) / count
+    bounds = []
+    for i in range(1, count):
+        bound = (start + i * step).replace(microsecond=0)
+        if bound > start and (not bounds or bound > bounds[-1]):
+            bounds.append(bound)
+
+    shards = []
+    prev = None
+    for bound in bounds:
+        shards.append((prev, bound - datetime.timedelta(seconds=1)))
+        prev = bound
+    shards.append((prev, None))
+    return shards
+
+class ShardProgress:
+    """
+    Progress and ETA report for one shard of a time-sharded import. The
+    grabbers call :py:meth:`update` with the timestamp of each fetched entry
+    and the progress is logged periodically.
+
+    :param str name: name of the import
+    :param int index: index of the shard (starting from 1)
+    :param int count: total number of shards
+    :param datetime.datetime start: the oldest timestamp in the shard
+    :param datetime.datetime end: the newest timestamp in the shard
+    :param float interval: minimum interval between two reports in seconds
+    """
+    def __init__(self, name, index, count, start, end, *, interval=30):
+        self.name = name
+        self.index = index
+        self.count = count
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.items = 0
+        self.timestamp = start
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def fraction(self):
+        """
+        Returns the fraction of the time range of the shard which has been
+        fetched.
+        """
+        total = (self.end - self.start).total_seconds()
+        if total <= 0:
+            return 1.0
+        done = (self.timestamp - self.start).total_seconds()
+        return min(max(done / total, 0.0), 1.0)
+
+    def eta(self):
+        """
+        Returns the estimated remaining time in seconds, or ``None`` if it
+        cannot be estimated yet.
+        """
+        fraction = self.fraction()
+        if fraction <= 0:
+            return None
+        elapsed = time.time() - self.start_time
+        return elapsed / fraction * (1 - fraction)
+
+    def update(self, timestamp, items=1):
+        self.items += items
+        if timestamp is not None and timestamp > self.timestamp:
+            self.timestamp = timestamp
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        eta = self.eta()
+        eta = "unknown" if eta is None else str(datetime.timedelta(seconds=int(eta)))
+        logger.info("{} shard {}/{}: {} entries fetched, {:.1f}% of the time range, ETA {}"
+                    .format(self.name, self.index, self.count, self.items, 100 * self.fraction(), eta))
+
+    def finish(self):
+        logger.info("{} shard {}/{}: finished {} entries in {:.2f} seconds"
+                    .format(self.name, self.index, self.count, self.items, time.time() - self.start_time))
+
+class Checkpoint:
+    """
+    A marker yielded by the generators of the initial import at the points
+    where the import can be interrupted and resumed later. All entries yielded
+    before the marker belong to the part of the import which is done when the
+    import is resumed from ``state``.
+
+    :param dict state: a JSON-serializable position in the import
+    """
+    __slots__ = ("state",)
+
+    def __init__(self, state):
+        self.state = state
+
 class GrabberBase:
 
     # class attributes that should be overridden in subclasses
@@ -22,9 +133,30 @@ class GrabberBase:
     # be here.
     INSERT_PREDELETE_TABLES = []
 
-    def __init__(self, api, db):
+    # Names of grabber classes which must finish before this grabber starts,
+    # because it reads their tables or references them by foreign keys (see
+    # ws.db.grabbers.synchronize).
+    DEPENDS_ON = []
+
+    # Names of tables whose non-unique indexes are dropped during the bulk
+    # initial import (see ws.db.execution.CopyExecutionQueue). Dropping an
+    # index locks the table until the import is committed, so the tables must
+    # not be read during the import, e.g. by lookups on another connection.
+    BULK_DEFER_INDEXES = []
+
+    # Number of shards per worker for the time-sharded import. Using more
+    # shards than workers balances the load when the history is not uniform.
+    SHARDS_PER_WORKER = 4
+
+    def __init__(self, api, db, *, import_concurrency=1):
         self.api = api
         self.db = db
+        # number of parallel workers for the time-sharded initial import, see
+        # insert_sharded
+        self.import_concurrency = import_concurrency
+        # state of the checkpoint from which the import is resumed, see
+        # gen_resumable_list
+        self._resume_state = None
 
     def _set_sync_timestamp(self, timestamp, conn=None):
         """
@@ -68,6 +200,88 @@ class GrabberBase:
             return row[0]
         return None
 
+    def _set_checkpoint(self, timestamp, state, conn):
+        """
+        Set the checkpoint of an initial import of the grabber. Writes into
+        the custom ``ws_sync_checkpoint`` table.
+
+        :param datetime.datetime timestamp: the sync timestamp of the import
+        :param dict state: the state of the :py:class:`Checkpoint`
+        :param conn: an existing :py:obj:`sqlalchemy.engine.Connection` object
+            to be re-used for execution of the SQL query
+        """
+        table = self.db.ws_sync_checkpoint
+        ins = insert(table)
+        ins = ins.on_conflict_do_update(
+                    constraint=table.primary_key,
+                    set_={
+                        "wssc_timestamp": ins.excluded.wssc_timestamp,
+                        "wssc_state": ins.excluded.wssc_state,
+                        "wssc_updated": ins.excluded.wssc_updated,
+                    }
+                )
+        entry = {
+            "wssc_key": self.__class__.__name__,
+            "wssc_timestamp": timestamp,
+            "wssc_state": state,
+            "wssc_updated": datetime.datetime.utcnow(),
+        }
+        conn.execute(ins, entry)
+
+    def _get_checkpoint(self):
+        """
+        Returns a ``(timestamp, state)`` tuple of the checkpoint of an
+        interrupted initial import, or ``None`` if there is no checkpoint.
+        """
+        table = self.db.ws_sync_checkpoint
+        sel = select(table.c.wssc_timestamp, table.c.wssc_state) \
+              .where(table.c.wssc_key == self.__class__.__name__)
+
+        with self.db.engine.connect() as conn:
+            row = conn.execute(sel).fetchone()
+        if row:
+            return row[0], row[1]
+        return None
+
+    def _clear_checkpoint(self, conn):
+        table = self.db.ws_sync_checkpoint
+        conn.execute(table.delete().where(table.c.wssc_key == self.__class__.__name__))
+
+    def gen_resumable_list(self, stage, params, gen_entries, **kwargs):
+        """
+        Yields the database entries generated by ``gen_entries`` for each item
+        of ``self.api.list(params, **kwargs)`` and a :py:class:`Checkpoint`
+        marker before each API response, so that the import can be resumed
+        from the last committed response.
+
+        When the import is resumed, the lists preceding the ``stage`` of the
+        checkpoint are skipped and the list of the ``stage`` is continued from
+        the stored continuation parameters. Hence the stages of one
+        :py:meth:`gen_insert` call must have distinct names and be executed in
+        a fixed order.
+
+        :param str stage: name of the list in the import
+        :param dict params: parameters for :py:meth:`ws.client.api.API.list`
+        :param gen_entries:
+            a function which takes an item of the list and returns an
+            iterable of the database entries
+        :param kwargs: other parameters for :py:meth:`ws.client.api.API.list`
+        """
+        continuation = {}
+        if self._resume_state is not None:
+            if self._resume_state["stage"] != stage:
+                # the checkpoint is in a later stage
+                return
+            continuation["continue"] = self._resume_state["continue"]
+            self._resume_state = None
+
+        last = None
+        for item in self.api.list(params, continuation=continuation, **kwargs):
+            if continuation["continue"] is not last:
+                last = continuation["continue"]
+                yield Checkpoint({"stage": stage, "continue": last})
+            yield from gen_entries(item)
+
     def gen_insert(self):
         """
         A generator for database entries which assumes that the tables are
@@ -86,6 +300,10 @@ class GrabberBase:
           to exploit the *executemany* execution strategy.
         - Or it can yield ``stmt`` objects directly, if the *executemany*
           execution strategy is not applicable.
+
+        Additionally, it can yield :py:class:`Checkpoint` markers (e.g. via
+        :py:meth:`gen_resumable_list`) to allow the import to be committed
+        periodically and resumed after an interruption.
         """
         raise NotImplementedError
 
@@ -105,18 +323,140 @@ class GrabberBase:
         """
         raise NotImplementedError
 
-    def insert(self):
+    def get_oldest_timestamp(self):
+        """
+        Returns the timestamp of the oldest entry fetched by
+        :py:meth:`gen_insert_shard`, or ``None`` if there are no entries.
+
+        To be implemented in subclasses which support the time-sharded import
+        (together with :py:meth:`gen_insert_shard`).
+        """
+        raise NotImplementedError
+
+    def gen_insert_shard(self, start, end, progress):
+        """
+        A generator for database entries which assumes that the tables are
+        empty, limited to the entries with timestamps between ``start`` and
+        ``end`` (inclusive, ``None`` means unbounded).
+
+        To be implemented in subclasses which support the time-sharded import.
+        The yielded values should follow the same rules as the
+        :py:meth:`gen_insert` method.
+
+        :param progress:
+            a :py:class:`ShardProgress` instance whose :py:meth:`update
+            <ShardProgress.update>` method should be called for each fetched
+            entry
+        """
+        raise NotImplementedError
+
+    def gen_insert_unsharded(self):
+        """
+        A generator for the database entries of the time-sharded import which
+        cannot be limited to a time range, e.g. because the API module does
+        not support it. They are fetched in one pass with a single cursor,
+        which runs in its own transaction alongside the shards.
+
+        The default implementation yields nothing. The yielded values should
+        follow the same rules as the :py:meth:`gen_insert` method.
+        """
+        yield from ()
+
+    def supports_sharding(self):
+        return type(self).gen_insert_shard is not GrabberBase.gen_insert_shard
+
+    def insert(self, *, resume=True):
+        """
+        Imports all data from scratch. If a previous import was interrupted
+        after a checkpoint was committed and ``resume`` is ``True``, the import
+        is resumed from the checkpoint instead.
+        """
+        checkpoint = self._get_checkpoint() if resume is True else None
+        if checkpoint is not None:
+            sync_timestamp, self._resume_state = checkpoint
+            logger.info("{}: resuming the interrupted import from {}".format(self.__class__.__name__, self._resume_state))
+            # the interrupted COPY could leave the deferred indexes dropped
+            with self.db.engine.begin() as conn:
+                restore_indexes(conn, self.db.metadata.sorted_tables)
+            gen = self.gen_insert()
+            self._execute(gen, sync_timestamp, bulk=self.db.bulk_load, resume=True)
+            return
+
+        sync_timestamp = datetime.datetime.utcnow()
+
+        if self.import_concurrency > 1 and self.supports_sharding():
+            oldest = self.get_oldest_timestamp()
+            if oldest is not None:
+                self.insert_sharded(oldest, sync_timestamp)
+                return
+
+        if self.db.bulk_load is True:
+            # the tables are emptied in the same transaction as the load, see _execute
+            gen = self.gen_insert()
+            self._execute(gen, sync_timestamp, bulk=True)
+            return
+
         # delete everything and start over, otherwise the invalid rows would
         # stay in the tables
         with self.db.engine.begin() as conn:
             for table in self.INSERT_PREDELETE_TABLES:
                 conn.execute(self.db.metadata.tables[table].delete())
 
-        sync_timestamp = datetime.datetime.utcnow()
-
         gen = self.gen_insert()
         self._execute(gen, sync_timestamp)
 
+    def insert_sharded(self, oldest, sync_timestamp):
+        """
+        Like :py:meth:`insert`, but the time range from ``oldest`` to
+        ``sync_timestamp`` is split into shards which are fetched by
+        :py:attr:`import_concurrency` parallel workers. Each shard is written
+        in its own transaction and the sync timestamp is set after all shards
+        have been written.
+        """
+        # delete everything and start over, otherwise the invalid rows would
+        # stay in the tables
+        with self.db.engine.begin() as conn:
+            for table in self.INSERT_PREDELETE_TABLES:
+                conn.execute(self.db.metadata.tables[table].delete())
+
+        name = self.__class__.__name__
+        shards = split_time_range(oldest, sync_timestamp, self.import_concurrency * self.SHARDS_PER_WORKER)
+        logger.info("{}: importing {} time shards with {} workers".format(name, len(shards), self.import_concurrency))
+
+        # The shards are disjoint, so the result of the check if a table is
+        # empty is shared between the queues (it has to be done before the
+        # first shard is committed).
+        copy_tables = {}
+
+        def write(gen):
+            with self.db.engine.begin() as conn:
+                if self.db.bulk_load is True:
+                    # the indexes cannot be dropped, they are used by the other shards
+                    queue = CopyExecutionQueue(conn, self.db.chunk_size, copy_tables=copy_tables)
+                else:
+                    queue = DeferrableExecutionQueue(conn, self.db.chunk_size)
+                with queue as dfe:
+                    self._execute_items(dfe, gen)
+
+        def run(index, start, end):
+            progress = ShardProgress(name, index, len(shards), start or oldest, end or sync_timestamp)
+            write(self.gen_insert_shard(start, end, progress))
+            progress.finish()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.import_concurrency) as executor:
+            futures = [executor.submit(write, self.gen_insert_unsharded())]
+            futures += [executor.submit(run, i + 1, start, end) for i, (start, end) in enumerate(shards)]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except Exception:
+                # don't start the remaining shards
+                for future in futures:
+                    future.cancel()
+                raise
+
+        self._set_sync_timestamp(sync_timestamp)
+
     def update(self, *, since=None):
         sync_timestamp = datetime.datetime.utcnow()
 
@@ -133,16 +473,76 @@ class GrabberBase:
             logger.warning("The recent changes table on the wiki has been recently purged, so {} must start from scratch.".format(self.__class__.__name__))
             self.insert()
 
-    def _execute(self, gen, sync_timestamp):
-        with self.db.engine.begin() as conn:
-            with DeferrableExecutionQueue(conn, self.db.chunk_size) as dfe:
+    def _checkpoint_due(self, rows, last_commit):
+        if self.db.checkpoint_rows is not None and rows >= self.db.checkpoint_rows:
+            return True
+        if self.db.checkpoint_interval is not None and time.time() - last_commit >= self.db.checkpoint_interval:
+            return True
+        return False
+
+    def _execute(self, gen, sync_timestamp, *, bulk=False, resume=False):
+        with self.db.engine.connect() as conn:
+            if bulk is True:
+                if resume is False:
+                    # delete everything and start over, otherwise the invalid
+                    # rows would stay in the tables (the empty tables are then
+                    # filled with COPY)
+                    for table in self.INSERT_PREDELETE_TABLES:
+                        conn.execute(self.db.metadata.tables[table].delete())
+                if self.db.checkpoint_rows is None and self.db.checkpoint_interval is None:
+                    defer_indexes = self.BULK_DEFER_INDEXES
+                else:
+                    # the dropped indexes would be committed at the first
+                    # checkpoint and missing until the end of the import
+                    defer_indexes = ()
+                queue = CopyExecutionQueue(conn, self.db.chunk_size, defer_indexes=defer_indexes)
+            else:
+                queue = DeferrableExecutionQueue(conn, self.db.chunk_size)
+
+            with queue as dfe:
+                # number of entries since the last commit
+                rows = 0
+                last_commit = time.time()
                 for item in gen:
-                    if isinstance(item, tuple):
-                        # unpack the tuple
-                        dfe.execute(*item)
-                    else:
-                        # probably a single value
-                        dfe.execute(item)
+                    if isinstance(item, Checkpoint):
+                        if self._checkpoint_due(rows, last_commit):
+                            # commit the data with the position where the import can be resumed
+                            dfe.execute_deferred()
+                            self._set_checkpoint(sync_timestamp, item.state, conn)
+                            conn.commit()
+                            logger.info("{}: committed {} entries, checkpoint {}".format(self.__class__.__name__, rows, item.state))
+                            rows = 0
+                            last_commit = time.time()
+                        continue
+                    self._execute_item(dfe, item)
+                    rows += 1
+
+            if self._resume_state is not None:
+                # the generator did not reach the checkpoint
+                state = self._resume_state
+                self._resume_state = None
+                conn.rollback()
+                self._clear_checkpoint(conn)
+                conn.commit()
+                raise RuntimeError("{}: the checkpoint {} was not found, the import has to start from scratch."
+                                   .format(self.__class__.__name__, state))
 
             # set the sync timestamp, in the same transaction as the data
             self._set_sync_timestamp(sync_timestamp, conn)
+            self._clear_checkpoint(conn)
+            conn.commit()
+
+    @staticmethod
+    def _execute_item(dfe, item):
+        if isinstance(item, tuple):
+            # unpack the tuple
+            dfe.execute(*item)
+        else:
+            # probably a single value
+            dfe.execute(item)
+
+    @staticmethod
+    def _execute_items(dfe, gen):
+        for item in gen:
+            if not isinstance(item, Checkpoint):
+                GrabberBase._execute_item(dfe, item)
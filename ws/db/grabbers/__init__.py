@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import logging
 import time
 
@@ -17,7 +18,122 @@ from ws.db.grabbers.logging_ import GrabberLogging
 
 logger = logging.getLogger(__name__)
 
-def synchronize(db, api, *, with_content=False, check_needs_update=True):
+# all grabbers in an order which satisfies their dependencies
+GRABBERS = [
+    GrabberNamespaces,
+    GrabberTags,
+    GrabberRecentChanges,
+    GrabberUsers,
+    GrabberLogging,
+    GrabberUserMerge,
+    GrabberInterwiki,
+    GrabberIPBlocks,
+    GrabberPages,
+    GrabberProtectedTitles,
+    GrabberRevisions,
+]
+
+def check_dependencies(grabbers):
+    """
+    Checks that the ``DEPENDS_ON`` attributes of the grabber classes refer to
+    grabbers which precede them in the given list, which also excludes
+    dependency cycles.
+
+    :param list grabbers: list of grabber classes
+    :raises ValueError: if the order is invalid
+    """
+    seen = set()
+    for grabber in grabbers:
+        for dependency in grabber.DEPENDS_ON:
+            if dependency not in seen:
+                raise ValueError("{} depends on {}, which does not precede it".format(grabber.__name__, dependency))
+        seen.add(grabber.__name__)
+
+def run_grabbers(grabbers, run, *, concurrency=1):
+    """
+    Runs the grabbers as a dependency graph: each grabber is started as soon as
+    all grabbers in its ``DEPENDS_ON`` list have finished, at most
+    ``concurrency`` grabbers are running at the same time. When a grabber
+    fails, no other grabbers are started and the exception is raised after the
+    running ones finish.
+
+    :param list grabbers: list of grabber classes ordered by their dependencies
+    :param run: a callable which takes a grabber class and runs it
+    :param int concurrency: maximum number of grabbers running concurrently
+    :returns: a dict mapping the grabber names to their wall times in seconds
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be positive")
+    check_dependencies(grabbers)
+
+    def timed_run(grabber):
+        start = time.perf_counter()
+        run(grabber)
+        return time.perf_counter() - start
+
+    durations = {}
+    waiting = list(grabbers)
+    running = {}
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while waiting or running:
+            # start all grabbers whose dependencies are satisfied
+            if error is None:
+                for grabber in list(waiting):
+                    if len(running) >= concurrency:
+                        break
+                    if all(dependency in durations for dependency in grabber.DEPENDS_ON):
+                        waiting.remove(grabber)
+                        running[executor.submit(timed_run, grabber)] = grabber
+            else:
+                waiting.clear()
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                grabber = running.pop(future)
+                try:
+                    durations[grabber.__name__] = future.result()
+                except Exception as e:
+                    logger.error("{} failed: {}".format(grabber.__name__, e))
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+    return durations
+
+def get_critical_path(grabbers, durations):
+    """
+    Returns the chain of dependent grabbers with the largest total wall time,
+    which bounds the wall time of the whole synchronization.
+
+    :param list grabbers: list of grabber classes ordered by their dependencies
+    :param dict durations: wall times returned by :py:func:`run_grabbers`
+    :returns: a tuple ``(path, total)``, where ``path`` is a list of grabber names
+    """
+    # longest chain ending in each grabber, computed in the topological order
+    chains = {}
+    for grabber in grabbers:
+        name = grabber.__name__
+        best = ([], 0)
+        for dependency in grabber.DEPENDS_ON:
+            if chains[dependency][1] > best[1]:
+                best = chains[dependency]
+        chains[name] = (best[0] + [name], best[1] + durations[name])
+    return max(chains.values(), key=lambda chain: chain[1])
+
+def synchronize(db, api, *, with_content=False, check_needs_update=True, concurrency=4, import_concurrency=1,
+                only=None):
+    """
+    Synchronizes the database with the wiki by running all grabbers in
+    :py:data:`GRABBERS`, see :py:meth:`ws.db.database.Database.sync_with_api`.
+
+    :param set only:
+        names of the grabbers to run, the other grabbers are skipped (their
+        tables are assumed to be up to date). ``None`` means all grabbers.
+    """
     time1 = time.time()
 
     # if no recent change has been added, it's safe to assume that the other tables are up to date as well
@@ -26,17 +142,21 @@ def synchronize(db, api, *, with_content=False, check_needs_update=True):
         logger.info("No new changes since the last database synchronization.")
         return
 
-    GrabberNamespaces(api, db).update()
-    GrabberTags(api, db).update()
-    GrabberRecentChanges(api, db).update()
-    GrabberUsers(api, db).update()
-    GrabberLogging(api, db).update()
-    GrabberUserMerge(api, db).update()
-    GrabberInterwiki(api, db).update()
-    GrabberIPBlocks(api, db).update()
-    GrabberPages(api, db).update()
-    GrabberProtectedTitles(api, db).update()
-    GrabberRevisions(api, db, with_content=with_content).update()
+    def run(grabber):
+        if only is not None and grabber.__name__ not in only:
+            return
+        # each grabber executes its queries in its own connection and transaction
+        if grabber is GrabberRevisions:
+            grabber(api, db, with_content=with_content, import_concurrency=import_concurrency).update()
+        elif grabber is GrabberLogging:
+            grabber(api, db, import_concurrency=import_concurrency).update()
+        else:
+            grabber(api, db).update()
+
+    durations = run_grabbers(GRABBERS, run, concurrency=concurrency)
 
     time2 = time.time()
     logger.info("Synchronization of the database took {:.2f} seconds.".format(time2 - time1))
+    path, total = get_critical_path(GRABBERS, durations)
+    logger.info("Critical path ({:.2f} seconds): {}".format(
+        total, " -> ".join("{} ({:.2f}s)".format(name, durations[name]) for name in path)))
@@ -7,6 +7,7 @@ from .GrabberBase import GrabberBase
 class GrabberInterwiki(GrabberBase):
 
     INSERT_PREDELETE_TABLES = ["interwiki"]
+    DEPENDS_ON = ["GrabberLogging"]
 
     def __init__(self, api, db):
         super().__init__(api, db)
@@ -11,6 +11,7 @@ from .GrabberBase import GrabberBase
 class GrabberIPBlocks(GrabberBase):
 
     INSERT_PREDELETE_TABLES = ["ipblocks"]
+    DEPENDS_ON = ["GrabberUsers", "GrabberLogging", "GrabberUserMerge"]
 
     def __init__(self, api, db):
         super().__init__(api, db)
@@ -9,8 +9,12 @@ from .GrabberBase import GrabberBase
 
 class GrabberLogging(GrabberBase):
 
-    def __init__(self, api, db):
-        super().__init__(api, db)
+    DEPENDS_ON = ["GrabberNamespaces", "GrabberTags", "GrabberRecentChanges", "GrabberUsers"]
+
+    BULK_DEFER_INDEXES = ["logging"]
+
+    def __init__(self, api, db, *, import_concurrency=1):
+        super().__init__(api, db, import_concurrency=import_concurrency)
 
         ins_logging = sa.dialects.postgresql.insert(db.logging)
         ins_tgle = sa.dialects.postgresql.insert(db.tagged_logevent)
@@ -112,8 +116,30 @@ class GrabberLogging(GrabberBase):
             yield self.sql["insert", "tagged_logevent"], db_entry
 
     def gen_insert(self):
-        for logevent in self.api.list(self.le_params):
+        yield from self.gen_resumable_list("logevents", self.le_params, self.gen_inserts_from_logevent)
+
+    def get_oldest_timestamp(self):
+        params = {
+            "list": "logevents",
+            "leprop": "timestamp",
+            "lelimit": 1,
+            "ledir": "newer",
+        }
+        for logevent in self.api.list(params):
+            return logevent["timestamp"]
+        return None
+
+    def gen_insert_shard(self, start, end, progress):
+        params = self.le_params.copy()
+        params["ledir"] = "newer"
+        if start is not None:
+            params["lestart"] = start
+        if end is not None:
+            params["leend"] = end
+
+        for logevent in self.api.list(params):
             yield from self.gen_inserts_from_logevent(logevent)
+            progress.update(logevent["timestamp"])
 
     def gen_update(self, since):
         params = self.le_params.copy()
@@ -10,6 +10,12 @@ from .GrabberBase import GrabberBase
 class GrabberPages(GrabberBase):
 
     INSERT_PREDELETE_TABLES = ["page", "page_props", "page_restrictions"]
+    DEPENDS_ON = [
+        "GrabberNamespaces",
+        "GrabberRecentChanges",
+        "GrabberLogging",
+        "GrabberUserMerge",
+    ]
 
     def __init__(self, api, db):
         super().__init__(api, db)
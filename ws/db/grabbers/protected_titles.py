@@ -11,6 +11,7 @@ from .GrabberBase import GrabberBase
 class GrabberProtectedTitles(GrabberBase):
 
     INSERT_PREDELETE_TABLES = ["protected_titles"]
+    DEPENDS_ON = ["GrabberNamespaces", "GrabberRecentChanges"]
 
     def __init__(self, api, db):
         super().__init__(api, db)
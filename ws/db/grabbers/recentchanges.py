@@ -15,6 +15,7 @@ logger = logging.getLogger(__name__)
 class GrabberRecentChanges(GrabberBase):
 
     INSERT_PREDELETE_TABLES = ["recentchanges"]
+    DEPENDS_ON = ["GrabberNamespaces", "GrabberTags"]
 
     def __init__(self, api, db):
         super().__init__(api, db)
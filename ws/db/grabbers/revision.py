@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import logging
+import queue
+import threading
 import time
 
 import sqlalchemy as sa
@@ -8,15 +10,78 @@ import sqlalchemy as sa
 from ws.utils import value_or_none, parse_date
 import ws.db.mw_constants as mwconst
 
+from ws.db.execution import DeferrableExecutionQueue
+from ws.db.text_storage import TextDeduplicator
 from .GrabberBase import GrabberBase
 
 logger = logging.getLogger(__name__)
 
+def _prefetch(iterable, maxsize):
+    """
+    Iterates over ``iterable`` in a background thread and yields its items
+    from a bounded queue, so that the producer runs ahead of the consumer by
+    at most ``maxsize`` items. Exceptions raised by the producer are re-raised
+    in the consumer. When the consumer stops early, the producer is stopped
+    after its current item.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # block while the queue is full, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    break
+            else:
+                put((done, None))
+        except Exception as e:
+            put((done, e))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
 # TODO: are truncated results due to PHP cache reflected by changing the query-continuation parameter accordingly or do we actually lose some revisions?
 class GrabberRevisions(GrabberBase):
 
-    def __init__(self, api, db, *, with_content=False):
-        super().__init__(api, db)
+    DEPENDS_ON = [
+        "GrabberTags",
+        "GrabberRecentChanges",
+        "GrabberUsers",
+        "GrabberLogging",
+        "GrabberUserMerge",
+        "GrabberPages",
+    ]
+
+    # the text table is read by the deduplication (see TextDeduplicator.prefetch)
+    BULK_DEFER_INDEXES = ["revision", "archive"]
+
+    def __init__(self, api, db, *, with_content=False, import_concurrency=1):
+        super().__init__(api, db, import_concurrency=import_concurrency)
         self.with_content = with_content
 
         ins_text = sa.dialects.postgresql.insert(db.text)
@@ -26,12 +91,24 @@ class GrabberRevisions(GrabberBase):
         ins_tgar = sa.dialects.postgresql.insert(db.tagged_archived_revision)
         ins_tgrc = sa.dialects.postgresql.insert(db.tagged_recentchange)
 
+        # (rev_id, tag_name) pairs passed as two arrays of the same length
+        changed_tags = sa.func.unnest(
+                sa.bindparam("b_rev_ids", type_=sa.dialects.postgresql.ARRAY(sa.Integer)),
+                sa.bindparam("b_tag_names", type_=sa.dialects.postgresql.ARRAY(sa.UnicodeText)),
+            ).table_valued(sa.column("rev_id", sa.Integer), sa.column("tag_name", sa.UnicodeText)) \
+            .render_derived(name="changed_tags")
+
         self.sql = {
             ("insert", "text"):
                 ins_text.on_conflict_do_update(
                     constraint=db.text.primary_key,
                     set_={
                         "old_text":  ins_text.excluded.old_text,
+                        "old_flags":  ins_text.excluded.old_flags,
+                        "old_blob":  ins_text.excluded.old_blob,
+                        "old_base_id":  ins_text.excluded.old_base_id,
+                        "old_sha1":  ins_text.excluded.old_sha1,
+                        "old_len":  ins_text.excluded.old_len,
                     }),
             ("insert", "revision"):
                 ins_revision.on_conflict_do_update(
@@ -72,22 +149,47 @@ class GrabberRevisions(GrabberBase):
                     tgrc_tag_id=sa.select(db.tag.c.tag_id).scalar_subquery()
                                     .where(db.tag.c.tag_name == sa.bindparam("b_tag_name")))
                     .on_conflict_do_nothing(),
-            ("delete", "tagged_revision"):
+            # set-based queries for the tag updates, see self.gen_tag_updates
+            ("insert-set", "tagged_revision"):
+                ins_tgrev.from_select(
+                    [db.tagged_revision.c.tgrev_rev_id, db.tagged_revision.c.tgrev_tag_id],
+                    sa.select(db.revision.c.rev_id, db.tag.c.tag_id)
+                        .select_from(changed_tags
+                                     .join(db.revision, db.revision.c.rev_id == changed_tags.c.rev_id)
+                                     .join(db.tag, db.tag.c.tag_name == changed_tags.c.tag_name)))
+                    .on_conflict_do_nothing(),
+            ("insert-set", "tagged_archived_revision"):
+                ins_tgar.from_select(
+                    [db.tagged_archived_revision.c.tgar_rev_id, db.tagged_archived_revision.c.tgar_tag_id],
+                    sa.select(db.archive.c.ar_rev_id, db.tag.c.tag_id)
+                        .select_from(changed_tags
+                                     .join(db.archive, db.archive.c.ar_rev_id == changed_tags.c.rev_id)
+                                     .join(db.tag, db.tag.c.tag_name == changed_tags.c.tag_name)))
+                    .on_conflict_do_nothing(),
+            ("insert-set", "tagged_recentchange"):
+                ins_tgrc.from_select(
+                    [db.tagged_recentchange.c.tgrc_rc_id, db.tagged_recentchange.c.tgrc_tag_id],
+                    sa.select(db.recentchanges.c.rc_id, db.tag.c.tag_id)
+                        .select_from(changed_tags
+                                     .join(db.recentchanges, db.recentchanges.c.rc_this_oldid == changed_tags.c.rev_id)
+                                     .join(db.tag, db.tag.c.tag_name == changed_tags.c.tag_name)))
+                    .on_conflict_do_nothing(),
+            ("delete-set", "tagged_revision"):
                 db.tagged_revision.delete()
-                    .where(sa.and_(db.tagged_revision.c.tgrev_rev_id == sa.bindparam("b_rev_id"),
-                                   db.tagged_revision.c.tgrev_tag_id == sa.select(db.tag.c.tag_id).scalar_subquery()
-                                            .where(db.tag.c.tag_name == sa.bindparam("b_tag_name")))),
-            ("delete", "tagged_archived_revision"):
+                    .where(db.tagged_revision.c.tgrev_rev_id == changed_tags.c.rev_id)
+                    .where(db.tagged_revision.c.tgrev_tag_id == db.tag.c.tag_id)
+                    .where(db.tag.c.tag_name == changed_tags.c.tag_name),
+            ("delete-set", "tagged_archived_revision"):
                 db.tagged_archived_revision.delete()
-                    .where(sa.and_(db.tagged_archived_revision.c.tgar_rev_id == sa.bindparam("b_rev_id"),
-                                   db.tagged_archived_revision.c.tgar_tag_id == sa.select(db.tag.c.tag_id).scalar_subquery()
-                                            .where(db.tag.c.tag_name == sa.bindparam("b_tag_name")))),
-            ("delete", "tagged_recentchange"):
+                    .where(db.tagged_archived_revision.c.tgar_rev_id == changed_tags.c.rev_id)
+                    .where(db.tagged_archived_revision.c.tgar_tag_id == db.tag.c.tag_id)
+                    .where(db.tag.c.tag_name == changed_tags.c.tag_name),
+            ("delete-set", "tagged_recentchange"):
                 db.tagged_recentchange.delete()
-                    .where(sa.and_(db.tagged_recentchange.c.tgrc_rc_id == sa.select(db.recentchanges.c.rc_id).scalar_subquery()
-                                            .where(db.recentchanges.c.rc_this_oldid == sa.bindparam("b_rev_id")),
-                                   db.tagged_recentchange.c.tgrc_tag_id == sa.select(db.tag.c.tag_id).scalar_subquery()
-                                            .where(db.tag.c.tag_name == sa.bindparam("b_tag_name")))),
+                    .where(db.tagged_recentchange.c.tgrc_rc_id == db.recentchanges.c.rc_id)
+                    .where(db.recentchanges.c.rc_this_oldid == changed_tags.c.rev_id)
+                    .where(db.tagged_recentchange.c.tgrc_tag_id == db.tag.c.tag_id)
+                    .where(db.tag.c.tag_name == changed_tags.c.tag_name),
             # query for updating archive.ar_page_id
             ("update", "archive.ar_page_id"):
                 db.archive.update()
@@ -114,6 +216,10 @@ class GrabberRevisions(GrabberBase):
             ("update", "revision"):
                 db.revision.update()
                     .where(db.revision.c.rev_id == sa.bindparam("b_rev_id")),
+            # query for updating archive.ar_text_id
+            ("update", "archive"):
+                db.archive.update()
+                    .where(db.archive.c.ar_rev_id == sa.bindparam("b_rev_id")),
             # query for suppressing deleted pages
             ("suppress-page", "archive"):
                 db.archive.update()
@@ -194,27 +300,72 @@ class GrabberRevisions(GrabberBase):
 #            logger.warning("You need the 'patrol' right to request the patrolled flag. "
 #                           "Skipping it, but the sync will be incomplete.")
 
-    # TODO: text.old_id is auto-increment, but revision.rev_text_id has to be set accordingly. SQL should be able to do it automatically.
     def _get_text_id_gen(self):
-        with self.db.engine.connect() as conn:
-            result = conn.execute(sa.select(sa.sql.func.max(self.db.text.c.old_id)))
-            value = result.fetchone()[0]
-            if value is None:
-                value = 0
-            while True:
-                value += 1
-                yield value
-
-    def gen_text(self, rev, text_id):
-        db_entry = {
-            "old_id": text_id,
-            # TODO: do multi-content revisions properly when MediaWiki actually
-            # starts using them for more than just the main slot
-            "old_text": rev["slots"]["main"]["*"],
-        }
+        """
+        Yields new values for ``text.old_id`` from the ``text_old_id_seq``
+        sequence. The values are reserved in batches of growing size with one
+        query per batch, so that concurrent writers (e.g. the content sync
+        running in another process) never get the same values.
+        """
+        batch = 16
+        while True:
+            query = sa.select(sa.func.nextval("text_old_id_seq")) \
+                      .select_from(sa.func.generate_series(1, batch))
+            with self.db.engine.connect() as conn:
+                values = conn.execute(query).scalars().all()
+            yield from sorted(values)
+            batch = min(2 * batch, self.db.chunk_size)
+
+    def _get_locked_text_id_gen(self):
+        """
+        Returns an iterator over the values of :py:meth:`_get_text_id_gen`.
+        Unlike the generator, the iterator can be shared by multiple threads
+        (e.g. the shards in :py:meth:`insert_sharded`).
+        """
+        gen = self._get_text_id_gen()
+        lock = threading.Lock()
+        def next_text_id():
+            with lock:
+                return next(gen)
+        return iter(next_text_id, None)
+
+    def _new_text_handlers(self, *, per_thread=False):
+        # we need one instance per transaction (or per thread with per_thread=True)
+        self.text_encoder = self.db.text_storage.make_encoder(per_thread=per_thread)
+        self.text_dedup = TextDeduplicator(self.db, per_thread=per_thread)
+
+    def prefetch_texts(self, revisions):
+        """
+        Looks up the existing texts of the given revisions in the database,
+        see :py:meth:`gen_text`.
+        """
+        keys = [TextDeduplicator.get_key(rev["slots"]["main"]["*"]) for rev in revisions]
+        self.text_dedup.prefetch(keys)
+
+    def gen_text(self, rev):
+        """
+        Yields the query inserting the text of the revision, unless the same
+        text is already stored. Returns the ``old_id`` of the text.
+        """
+        # TODO: do multi-content revisions properly when MediaWiki actually
+        # starts using them for more than just the main slot
+        text = rev["slots"]["main"]["*"]
+        key = TextDeduplicator.get_key(text)
+        text_id = self.text_dedup.get(key)
+        if text_id is not None:
+            return text_id
+
+        text_id = next(self.text_id_gen)
+        db_entry = self.text_encoder.encode(text, text_id=text_id,
+                                            rev_id=rev["revid"], parent_id=rev.get("parentid"))
+        db_entry["old_id"] = text_id
+        db_entry.update(self.text_dedup.add(key, text_id))
         yield self.sql["insert", "text"], db_entry
+        return text_id
 
     def gen_revisions(self, page):
+        if self.with_content is True:
+            self.prefetch_texts(page["revisions"])
         for rev in page["revisions"]:
             db_entry = {
                 "rev_id": rev["revid"],
@@ -235,9 +386,7 @@ class GrabberRevisions(GrabberBase):
             }
 
             if self.with_content is True:
-                text_id = next(self.text_id_gen)
-                db_entry["rev_text_id"] = text_id
-                yield from self.gen_text(rev, text_id)
+                db_entry["rev_text_id"] = yield from self.gen_text(rev)
 
             yield self.sql["insert", "revision"], db_entry
 
@@ -250,6 +399,8 @@ class GrabberRevisions(GrabberBase):
 
     def gen_deletedrevisions(self, page):
         title = self.db.Title(page["title"])
+        if self.with_content is True:
+            self.prefetch_texts(page["revisions"])
         for rev in page["revisions"]:
             db_entry = {
                 "ar_namespace": page["ns"],
@@ -274,9 +425,7 @@ class GrabberRevisions(GrabberBase):
             }
 
             if self.with_content is True:
-                text_id = next(self.text_id_gen)
-                db_entry["ar_text_id"] = text_id
-                yield from self.gen_text(rev, text_id)
+                db_entry["ar_text_id"] = yield from self.gen_text(rev)
 
             yield self.sql["insert", "archive"], db_entry
 
@@ -288,17 +437,58 @@ class GrabberRevisions(GrabberBase):
                 yield self.sql["insert", "tagged_archived_revision"], db_entry
 
     def gen_insert(self):
-        # we need one instance per transaction
+        # one instance for the whole import (the checkpoints are committed sequentially)
         self.text_id_gen = self._get_text_id_gen()
+        self._new_text_handlers()
 
-        for page in self.api.list(self.arv_params):
+        # stream the responses when fetching content to keep the memory usage low
+        yield from self.gen_resumable_list("allrevisions", self.arv_params, self.gen_revisions,
+                                           stream=self.with_content)
+        yield from self.gen_resumable_list("alldeletedrevisions", self.adr_params, self.gen_deletedrevisions,
+                                           stream=self.with_content)
+
+    def get_oldest_timestamp(self):
+        params = {
+            "list": "allrevisions",
+            "arvprop": "timestamp",
+            "arvlimit": 1,
+            "arvdir": "newer",
+        }
+        for page in self.api.list(params):
+            return page["revisions"][0]["timestamp"]
+        return None
+
+    def insert_sharded(self, oldest, sync_timestamp):
+        # one instance shared by all shards
+        self.text_id_gen = self._get_locked_text_id_gen()
+        # each shard is imported in its own transaction
+        self._new_text_handlers(per_thread=True)
+        super().insert_sharded(oldest, sync_timestamp)
+
+    def gen_insert_shard(self, start, end, progress):
+        arv_params = self.arv_params.copy()
+        arv_params["arvdir"] = "newer"
+        if start is not None:
+            arv_params["arvstart"] = start
+        if end is not None:
+            arv_params["arvend"] = end
+
+        # stream the responses when fetching content to keep the memory usage low
+        for page in self.api.list(arv_params, stream=self.with_content):
             yield from self.gen_revisions(page)
-        for page in self.api.list(self.adr_params):
+            for rev in page["revisions"]:
+                progress.update(rev["timestamp"])
+
+    def gen_insert_unsharded(self):
+        # adrstart and adrend can be used only along with adruser (see gen_update),
+        # so the deleted revisions cannot be split into time shards
+        for page in self.api.list(self.adr_params, stream=self.with_content):
             yield from self.gen_deletedrevisions(page)
 
     def gen_update(self, since):
         # we need one instance per transaction
         self.text_id_gen = self._get_text_id_gen()
+        self._new_text_handlers()
 
         # save new revids for the tag updates
         new_revids = set()
@@ -307,7 +497,7 @@ class GrabberRevisions(GrabberBase):
         arv_params = self.arv_params.copy()
         arv_params["arvdir"] = "newer"
         arv_params["arvstart"] = since
-        for page in self.api.list(arv_params):
+        for page in self.api.list(arv_params, stream=self.with_content):
             yield from self.gen_revisions(page)
             for rev in page["revisions"]:
                 new_revids.add(rev["revid"])
@@ -420,10 +610,8 @@ class GrabberRevisions(GrabberBase):
             "drvdir": "newer",
             "drvslots": "main",
         }
-        for result in self.api.call_api_autoiter_ids(params, expand_result=False):
-            # TODO: handle 'drvcontinue'
-            if "drvcontinue" in result:
-                raise NotImplementedError("Handling of the 'drvcontinue' parameter is not implemented.")
+        # the continuation is merged, so each page contains all its deleted revisions
+        for result in self.api.call_api_autoiter_ids(params, expand_result=False, merge_continuation=True):
             # this can happen when a page was deleted before adding an interwiki prefix, which makes
             # the deleted revisions completely unavailable
             if "pages" not in result["query"]:
@@ -451,10 +639,7 @@ class GrabberRevisions(GrabberBase):
             "rvslots": "main",
             "drvslots": "main",
         }
-        for result in self.api.call_api_autoiter_ids(params, expand_result=False):
-            # TODO: handle 'rvcontinue' and 'drvcontinue'
-            if "rvcontinue" in result or "drvcontinue" in result:
-                raise NotImplementedError("Handling of the 'rvcontinue' and 'drvcontinue' parameters is not implemented.")
+        for result in self.api.call_api_autoiter_ids(params, expand_result=False, merge_continuation=True):
             for page in result["query"]["pages"].values():
                 if "revisions" in page:
                     yield from self.gen_revisions(page)
@@ -497,125 +682,247 @@ class GrabberRevisions(GrabberBase):
             yield self.sql["suppress-page", "archive"], {"b_ns": ns, "b_title": title, "ar_deleted": ar_deleted }
 
         # update tags
-        for revid, added in added_tags.items():
-            for tag in added:
-                # Deleted revisions cannot be tagged in MediaWiki, but they might be
-                # undeleted, tagged, and deleted again before the sync. For inserts we
-                # have to check manually if it is normal or archived revision, otherwise
-                # we would get foreign key errors. New revisions added in this sync are
-                # skipped, so we don't mind if the queued queries were not executed yet.
-                db_entry = {
-                    "b_rev_id": revid,
-                    "b_tag_name": tag,
-                }
-                with self.db.engine.connect() as conn:
-                    result = conn.execute(sa.select(
-                                sa.exists().where(self.db.revision.c.rev_id == revid)
-                            ))
-                    if result.fetchone()[0]:
-                        yield self.sql["insert", "tagged_revision"], db_entry
-                    else:
-                        yield self.sql["insert", "tagged_archived_revision"], db_entry
-                    # check if it is a recent change and tag it as well
-                    result = conn.execute(sa.select(
-                                sa.exists().where(self.db.recentchanges.c.rc_this_oldid == revid)
-                            ))
-                    if result.fetchone()[0]:
-                        yield self.sql["insert", "tagged_recentchange"], db_entry
-
-        for revid, removed in removed_tags.items():
-            for tag in removed:
-                # we don't care if the revisions actually exist in the revision or archive
-                # or recentchanges tables, some queries will just not do anything
-                db_entry = {
-                    "b_rev_id": revid,
-                    "b_tag_name": tag,
-                }
-                yield self.sql["delete", "tagged_revision"], db_entry
-                yield self.sql["delete", "tagged_archived_revision"], db_entry
-                yield self.sql["delete", "tagged_recentchange"], db_entry
-
+        yield from self.gen_tag_updates(added_tags, removed_tags)
+
+    def gen_tag_updates(self, added_tags, removed_tags):
+        """
+        Generates the queries for tags added to and removed from existing
+        revisions.
+
+        Each kind of change is applied with one set-based statement per
+        table, so that the number of queries does not depend on the number of
+        changed revisions. The inserts join the (rev_id, tag_name) pairs with
+        the ``revision``, ``archive`` and ``recentchanges`` tables, so the
+        pairs end up only where the revisions actually are. Deleted revisions
+        cannot be tagged in MediaWiki, but they might be undeleted, tagged,
+        and deleted again before the sync. New revisions added in this sync
+        are skipped by the caller, their tags are added in
+        :py:meth:`gen_revisions` and :py:meth:`gen_deletedrevisions`.
+
+        :param dict added_tags: mapping of revids to sets of added tag names
+        :param dict removed_tags: mapping of revids to sets of removed tag names
+        """
+        def make_entry(tags):
+            pairs = sorted((revid, tag) for revid, names in tags.items() for tag in names)
+            return {
+                "b_rev_ids": [revid for revid, _ in pairs],
+                "b_tag_names": [tag for _, tag in pairs],
+            }
 
-    def sync_revisions_content(self, *, mode="latest"):
+        tables = ["tagged_revision", "tagged_archived_revision", "tagged_recentchange"]
+        for action, tags in [("insert-set", added_tags), ("delete-set", removed_tags)]:
+            db_entry = make_entry(tags)
+            if not db_entry["b_rev_ids"]:
+                continue
+            for table in tables:
+                yield self.sql[action, table], db_entry
+
+    def link_known_texts(self, *, deleted=False):
+        """
+        Sets ``rev_text_id`` of the revisions whose text is already stored in
+        the ``text`` table, based on ``rev_sha1`` and ``rev_len``. Returns the
+        number of updated revisions.
+
+        :param bool deleted: whether to set ``ar_text_id`` of the deleted
+            revisions in the ``archive`` table instead
+        """
+        text = self.db.text
+        if deleted is True:
+            ar = self.db.archive
+            query = ar.update() \
+                      .where(ar.c.ar_text_id == None) \
+                      .where(ar.c.ar_sha1 == text.c.old_sha1) \
+                      .where(ar.c.ar_len == text.c.old_len) \
+                      .values(ar_text_id=text.c.old_id)
+        else:
+            rev = self.db.revision
+            query = rev.update() \
+                       .where(rev.c.rev_text_id == None) \
+                       .where(rev.c.rev_sha1 == text.c.old_sha1) \
+                       .where(rev.c.rev_len == text.c.old_len) \
+                       .values(rev_text_id=text.c.old_id)
+        with self.db.engine.begin() as conn:
+            result = conn.execute(query)
+        return result.rowcount
+
+    def sync_revisions_content(self, *, mode="latest", concurrency=1, priority_namespaces=None):
+        """
+        Fetches the content of revisions whose ``rev_text_id`` is not set. In
+        the ``"all"`` mode, the content of the deleted revisions whose
+        ``ar_text_id`` is not set is fetched too (this requires the
+        ``deletedtext`` right).
+
+        The chunks of revisions are fetched by a background producer which
+        feeds a bounded queue, while the chunks are written into the database
+        in the calling thread, each in its own transaction. The producer runs
+        ahead of the writer by at most ``2 * concurrency`` chunks. The revids
+        are selected from the database in batches of ``db.chunk_size`` as the
+        producer consumes them, so the memory usage does not depend on the
+        number of revisions. The revisions whose text is already stored are
+        not fetched at all, see :py:meth:`link_known_texts`.
+
+        :param str mode: ``"latest"`` or ``"all"``, see
+            :py:meth:`ws.db.database.Database.sync_revisions_content`
+        :param int concurrency: number of chunks fetched at the same time
+        :param list priority_namespaces:
+            numbers of namespaces whose pages are fetched first, in the given
+            order (e.g. ``[10, 828]`` for templates and modules, so that the
+            parser cache can be built early)
+        """
         assert mode in {"latest", "all"}
 
         time1 = time.time()
         counter = 0
 
-        def get_latest_revids():
-            rev = self.db.revision
-            page = self.db.page
-            query = sa.select(rev.c.rev_id).select_from(
-                        rev.join(page, (rev.c.rev_page == page.c.page_id) &
-                                       (rev.c.rev_id == page.c.page_latest))
-                    ).where(rev.c.rev_text_id == None).order_by(rev.c.rev_id)
-            conn = self.db.engine.connect()
-            result = conn.execute(query)
-            return [r[0] for r in result]
+        def iter_keyset(query, column):
+            # keyset pagination: each batch is selected in a short transaction,
+            # so that the revids are streamed while the previous chunks are
+            # being fetched and written
+            query = query.order_by(column).limit(self.db.chunk_size)
+            last = None
+            while True:
+                batch = query if last is None else query.where(column > last)
+                with self.db.engine.connect() as conn:
+                    revids = conn.execute(batch).scalars().all()
+                yield from revids
+                if len(revids) < self.db.chunk_size:
+                    break
+                last = revids[-1]
 
-        def get_all_revids():
+        def get_revids(where):
             rev = self.db.revision
-            query = sa.select(rev.c.rev_id).select_from(
-                        rev
-                    ).where(rev.c.rev_text_id == None).order_by(rev.c.rev_id)
-            conn = self.db.engine.connect()
-            result = conn.execute(query)
-            return [r[0] for r in result]
-
-        params = {
-            "action": "query",
-            "revids": get_latest_revids() if mode == "latest" else get_all_revids(),
-            "prop": "revisions",
-            "rvprop": "ids|content",
-            "rvslots": "main",
-        }
-        for result in self.api.call_api_autoiter_ids(params, expand_result=False):
-            fetched_revids = set()
-
-            # we need one instance per chunk/transaction
-            self.text_id_gen = self._get_text_id_gen()
-
-            def gen():
-                nonlocal counter
-                nonlocal fetched_revids
-                for page in result["query"]["pages"].values():
-                    if "revisions" not in page and "missing" in page:
+            page = self.db.page
+            if mode == "latest":
+                join = rev.join(page, (rev.c.rev_page == page.c.page_id) &
+                                      (rev.c.rev_id == page.c.page_latest))
+            else:
+                join = rev.outerjoin(page, rev.c.rev_page == page.c.page_id)
+            query = sa.select(rev.c.rev_id).select_from(join) \
+                        .where(rev.c.rev_text_id == None) \
+                        .where(where(page.c.page_namespace))
+            return iter_keyset(query, rev.c.rev_id)
+
+        def get_deleted_revids():
+            ar = self.db.archive
+            # skip the revisions whose text is suppressed, it is not available
+            # even to administrators (the text which is only deleted is)
+            suppressed = mwconst.DELETED_TEXT | mwconst.DELETED_RESTRICTED
+            query = sa.select(ar.c.ar_rev_id) \
+                        .where(ar.c.ar_text_id == None) \
+                        .where(ar.c.ar_deleted.op("&")(suppressed) != suppressed)
+            return iter_keyset(query, ar.c.ar_rev_id)
+
+        def get_groups():
+            priority = list(priority_namespaces or [])
+            groups = [("revision", get_revids(lambda ns_column, ns=ns: ns_column == ns)) for ns in priority]
+            # the last group is for the other namespaces (including the
+            # revisions without a page in the "all" mode)
+            if priority:
+                groups.append(("revision", get_revids(lambda ns_column: sa.or_(ns_column == None, ns_column.notin_(priority)))))
+            else:
+                groups.append(("revision", get_revids(lambda ns_column: sa.true())))
+            if mode == "all":
+                groups.append(("archive", get_deleted_revids()))
+            return groups
+
+        def fetch_chunks(groups):
+            # the groups are fetched sequentially to preserve the priority,
+            # the revids of each group are consumed lazily by call_api_autoiter_ids
+            for table, revids in groups:
+                if table == "archive":
+                    params = {
+                        "action": "query",
+                        "revids": revids,
+                        "prop": "deletedrevisions",
+                        "drvprop": "ids|content",
+                        "drvslots": "main",
+                    }
+                else:
+                    params = {
+                        "action": "query",
+                        "revids": revids,
+                        "prop": "revisions",
+                        "rvprop": "ids|content",
+                        "rvslots": "main",
+                    }
+                # the content of a chunk may not fit into one response, the
+                # continuation is followed by the worker fetching the chunk
+                for result in self.api.call_api_autoiter_ids(params, expand_result=False, concurrency=concurrency,
+                                                             continuation=True):
+                    yield table, result
+
+        def gen(table, result, fetched_revids):
+            nonlocal counter
+            key = "deletedrevisions" if table == "archive" else "revisions"
+            for page in result["query"]["pages"].values():
+                if key not in page:
+                    if "missing" in page and table == "revision":
                         # skip pages which were deleted since the last synchronization
                         # (their revisions have to be synchronized later)
                         logger.warning("Skipping synchronization of revisions from deleted page [[{}]].".format(page["title"]))
-                        continue
-                    for rev in page["revisions"]:
-                        text_id = next(self.text_id_gen)
-                        db_entry = {
-                            "b_rev_id": rev["revid"],
-                            "rev_text_id": text_id
-                        }
-                        yield from self.gen_text(rev, text_id)
-                        yield self.sql["update", "revision"], db_entry
-                        counter += 1
-                        fetched_revids.add(rev["revid"])
-
-            # execute each chunk of the revids in its own transaction
-            # (if there are many chunks, we risk the API connection to be interrupted
-            # and losing lots of data)
-            from ws.db.execution import DeferrableExecutionQueue
-            with self.db.engine.begin() as conn:
-                with DeferrableExecutionQueue(conn, self.db.chunk_size) as dfe:
-                    for item in gen():
-                        if isinstance(item, tuple):
-                            # unpack the tuple
-                            dfe.execute(*item)
-                        else:
-                            # probably a single value
-                            dfe.execute(item)
-
-            if mode == "all" and fetched_revids:
-                logger.info("Fetched revids {}-{}.".format(min(fetched_revids), max(fetched_revids)))
-
-        # TODO: sync content of all deleted revisions when mode == "all"
+                    continue
+                # the text of some revisions may be hidden
+                revisions = [rev for rev in page[key] if "*" in rev["slots"]["main"]]
+                self.prefetch_texts(revisions)
+                for rev in revisions:
+                    db_entry = {
+                        "b_rev_id": rev["revid"],
+                    }
+                    text_id = yield from self.gen_text(rev)
+                    if table == "archive":
+                        db_entry["ar_text_id"] = text_id
+                    else:
+                        db_entry["rev_text_id"] = text_id
+                    yield self.sql["update", table], db_entry
+                    counter += 1
+                    fetched_revids.add(rev["revid"])
+
+        # time spent by the writer waiting for the API and writing into the database
+        wait_time = 0
+        write_time = 0
+
+        # the values are reserved in the sequence, so one instance can be used for all chunks
+        self.text_id_gen = self._get_text_id_gen()
+        # the chunks are committed in order, so the texts may refer to the previous chunks
+        self._new_text_handlers()
+
+        # link the revisions whose text is already stored to avoid fetching it
+        linked = self.link_known_texts()
+        if mode == "all":
+            linked += self.link_known_texts(deleted=True)
+        if linked > 0:
+            logger.info("Linked {} revisions to the already stored texts.".format(linked))
+
+        chunks = _prefetch(fetch_chunks(get_groups()), maxsize=2 * concurrency)
+        try:
+            while True:
+                t = time.time()
+                item = next(chunks, None)
+                wait_time += time.time() - t
+                if item is None:
+                    break
+                table, result = item
+
+                t = time.time()
+                fetched_revids = set()
+
+                # execute each chunk of the revids in its own transaction
+                # (if there are many chunks, we risk the API connection to be interrupted
+                # and losing lots of data)
+                with self.db.engine.begin() as conn:
+                    with DeferrableExecutionQueue(conn, self.db.chunk_size) as dfe:
+                        self._execute_items(dfe, gen(table, result, fetched_revids))
+                write_time += time.time() - t
+
+                if mode == "all" and fetched_revids:
+                    what = "deleted revids" if table == "archive" else "revids"
+                    logger.info("Fetched {} {}-{}.".format(what, min(fetched_revids), max(fetched_revids)))
+        finally:
+            chunks.close()
 
         time2 = time.time()
         if counter > 0:
             logger.info("Synchronization of {} revisions content for {} pages took {:.2f} seconds.".format(mode, counter, time2 - time1))
+            logger.info("The writer waited {:.2f} seconds for the API and spent {:.2f} seconds writing into the database.".format(wait_time, write_time))
         else:
             logger.info("The content of {} revisions is already fetched.".format(mode))
@@ -6,6 +6,8 @@ from .GrabberBase import GrabberBase
 
 class GrabberUserMerge(GrabberBase):
 
+    DEPENDS_ON = ["GrabberUsers", "GrabberLogging"]
+
     def __init__(self, api, db):
         super().__init__(api, db)
 
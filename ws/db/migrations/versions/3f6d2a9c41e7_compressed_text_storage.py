@@ -0,0 +1,42 @@
+"""compressed text storage
+
+Revision ID: 3f6d2a9c41e7
+Revises: 7bdc8c859895
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6d2a9c41e7'
+down_revision = '7bdc8c859895'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('text', sa.Column('old_flags', sa.UnicodeText(), server_default='', nullable=False))
+    op.add_column('text', sa.Column('old_blob', sa.LargeBinary(), nullable=True))
+    op.alter_column('text', 'old_text', existing_type=sa.UnicodeText(), nullable=True)
+    op.create_check_constraint('text_old_text_or_old_blob', 'text', '(old_text IS NULL) <> (old_blob IS NULL)')
+    op.create_table('ws_text_dictionary',
+    sa.Column('wstd_id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('wstd_dictionary', sa.LargeBinary(), nullable=False),
+    sa.Column('wstd_timestamp', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('wstd_id')
+    )
+
+
+def downgrade():
+    conn = op.get_bind()
+    count = conn.execute(sa.text("SELECT count(*) FROM text WHERE old_blob IS NOT NULL")).scalar()
+    if count > 0:
+        raise RuntimeError("The text table contains {} compressed rows, they have to be "
+                           "decompressed before the downgrade.".format(count))
+    op.drop_table('ws_text_dictionary')
+    op.drop_constraint('text_old_text_or_old_blob', 'text', type_='check')
+    op.alter_column('text', 'old_text', existing_type=sa.UnicodeText(), nullable=False)
+    op.drop_column('text', 'old_blob')
+    op.drop_column('text', 'old_flags')
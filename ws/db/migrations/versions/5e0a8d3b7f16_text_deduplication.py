@@ -0,0 +1,39 @@
+"""text deduplication
+
+Revision ID: 5e0a8d3b7f16
+Revises: 9b41c7e2d5a8
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0a8d3b7f16'
+down_revision = '9b41c7e2d5a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('text', sa.Column('old_sha1', sa.LargeBinary(length=31), nullable=True))
+    op.add_column('text', sa.Column('old_len', sa.Integer(), nullable=True))
+    # fill the keys of the existing texts from the revisions
+    op.execute("""
+        UPDATE text SET old_sha1 = r.rev_sha1, old_len = r.rev_len
+        FROM (
+            SELECT DISTINCT ON (rev_text_id) rev_text_id, rev_sha1, rev_len
+            FROM revision
+            WHERE rev_text_id IS NOT NULL AND rev_sha1 IS NOT NULL AND rev_len IS NOT NULL
+        ) AS r
+        WHERE text.old_id = r.rev_text_id
+    """)
+    # not unique: concurrent writers may store the same text
+    op.create_index('text_sha1_len', 'text', ['old_sha1', 'old_len'], unique=False)
+
+
+def downgrade():
+    op.drop_index('text_sha1_len', table_name='text')
+    op.drop_column('text', 'old_len')
+    op.drop_column('text', 'old_sha1')
@@ -0,0 +1,31 @@
+"""text deltas
+
+Revision ID: 9b41c7e2d5a8
+Revises: 3f6d2a9c41e7
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b41c7e2d5a8'
+down_revision = '3f6d2a9c41e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('text', sa.Column('old_base_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('text_old_base_id_fkey', 'text', 'text', ['old_base_id'], ['old_id'], initially='DEFERRED', deferrable=True)
+
+
+def downgrade():
+    conn = op.get_bind()
+    count = conn.execute(sa.text("SELECT count(*) FROM text WHERE old_base_id IS NOT NULL")).scalar()
+    if count > 0:
+        raise RuntimeError("The text table contains {} delta rows, they have to be "
+                           "materialized before the downgrade.".format(count))
+    op.drop_constraint('text_old_base_id_fkey', 'text', type_='foreignkey')
+    op.drop_column('text', 'old_base_id')
@@ -0,0 +1,29 @@
+"""text old_id sequence
+
+Revision ID: c2e87f4a9d03
+Revises: 5e0a8d3b7f16
+Create Date: 2026-10-16 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e87f4a9d03'
+down_revision = '5e0a8d3b7f16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the sequence exists if the table was created as serial, but it was not
+    # used for the allocation of the values until now
+    op.execute("CREATE SEQUENCE IF NOT EXISTS text_old_id_seq OWNED BY text.old_id")
+    op.execute("ALTER TABLE text ALTER COLUMN old_id SET DEFAULT nextval('text_old_id_seq')")
+    op.execute("SELECT setval('text_old_id_seq', COALESCE(max(old_id), 0) + 1, false) FROM text")
+
+
+def downgrade():
+    # the sequence is kept, it is harmless for the previous code
+    pass
@@ -0,0 +1,30 @@
+"""sync checkpoints
+
+Revision ID: e4b19a6c3f58
+Revises: c2e87f4a9d03
+Create Date: 2026-10-16 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b19a6c3f58'
+down_revision = 'c2e87f4a9d03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ws_sync_checkpoint',
+    sa.Column('wssc_key', sa.UnicodeText(), nullable=False),
+    sa.Column('wssc_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('wssc_state', sa.UnicodeText(), nullable=False),
+    sa.Column('wssc_updated', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('wssc_key')
+    )
+
+
+def downgrade():
+    op.drop_table('ws_sync_checkpoint')
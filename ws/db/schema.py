@@ -50,8 +50,8 @@ Known incompatibilities from MediaWiki schema:
 from sqlalchemy import \
         Table, Column, ForeignKey, Index, PrimaryKeyConstraint, ForeignKeyConstraint, CheckConstraint
 from sqlalchemy.types import \
-        Boolean, SmallInteger, Integer, Float, \
-        UnicodeText, Enum, DateTime, Interval, ARRAY
+        Boolean, SmallInteger, Integer, BigInteger, Float, \
+        UnicodeText, LargeBinary, Enum, DateTime, Interval, ARRAY
 
 from .sql_types import \
         MWTimestamp, SHA1, JSONEncodedDict
@@ -106,6 +106,17 @@ def create_custom_tables(metadata):
         Column("wss_timestamp", DateTime, nullable=False)
     )
 
+    # checkpoints of the interrupted initial imports (see GrabberBase.insert)
+    ws_sync_checkpoint = Table("ws_sync_checkpoint", metadata,
+        Column("wssc_key", UnicodeText, nullable=False, primary_key=True),
+        # sync timestamp of the import, it is used when the import is resumed
+        Column("wssc_timestamp", DateTime, nullable=False),
+        # position from which the import can be resumed
+        Column("wssc_state", JSONEncodedDict, nullable=False),
+        # time of the last commit
+        Column("wssc_updated", DateTime, nullable=False),
+    )
+
 
 def create_site_tables(metadata):
     # MW incompatibility: dropped the iw_wikiid column
@@ -370,11 +381,33 @@ def create_revisions_tables(metadata):
     Index("rev_page_user_timestamp", revision.c.rev_page, revision.c.rev_user, revision.c.rev_timestamp)
 
     text = Table("text", metadata,
+        # the values are allocated from the text_old_id_seq sequence (created
+        # for the serial column), see GrabberRevisions._get_text_id_gen
         Column("old_id", Integer, primary_key=True, nullable=False),
-        Column("old_text", UnicodeText, nullable=False),
-        # MW incompatibility: there is no old_flags column because it is useless for us
-        # (everything is utf-8, compression is done transparently by PostgreSQL, PHP
-        # objects are not supported and we will never support external storage)
+        # uncompressed text (NULL if the text is compressed)
+        Column("old_text", UnicodeText),
+        # MW incompatibility: the flags are used only for the compression and deltas (see
+        # ws.db.text_storage), everything is utf-8, PHP objects are not supported
+        # and we will never support external storage
+        Column("old_flags", UnicodeText, nullable=False, server_default=""),
+        # compressed text or delta (NULL if the text is not compressed)
+        Column("old_blob", LargeBinary),
+        # base text of the delta (NULL if the text is not a delta)
+        Column("old_base_id", Integer, ForeignKey("text.old_id", deferrable=True, initially="DEFERRED")),
+        # SHA1 hash and length of the utf-8 encoded text for the deduplication
+        # (the index is not unique, concurrent writers may store the same text)
+        Column("old_sha1", SHA1),
+        Column("old_len", Integer),
+        CheckConstraint("(old_text IS NULL) <> (old_blob IS NULL)", name="text_old_text_or_old_blob"),
+    )
+    Index("text_sha1_len", text.c.old_sha1, text.c.old_len)
+
+    # dictionaries for the compression of the text table
+    ws_text_dictionary = Table("ws_text_dictionary", metadata,
+        # dictionary ID stored in the headers of the zstd frames
+        Column("wstd_id", BigInteger, primary_key=True, autoincrement=False, nullable=False),
+        Column("wstd_dictionary", LargeBinary, nullable=False),
+        Column("wstd_timestamp", DateTime, nullable=False),
     )
 
     tagged_revision = Table("tagged_revision", metadata,
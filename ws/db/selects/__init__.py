@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 from collections import OrderedDict
+import datetime
 
 import sqlalchemy as sa
 
+from ws.utils import format_date, parse_date
+
 from .namespaces import *
 from .interwiki import *
 
@@ -74,7 +77,158 @@ __classes_props = {
     "sections": Sections,  # custom module
 }
 
-def list(db, params):
+def get_api_prefix(module, name):
+    """
+    Returns the parameter prefix of an API module.
+
+    :param str module: module type, i.e. ``"list"``, ``"generator"`` or ``"prop"``
+    :param str name: module name
+    :returns: the prefix (``"g"`` is prepended for generators)
+    """
+    if module == "list":
+        return __classes_lists[name].API_PREFIX
+    elif module == "generator":
+        return "g" + __classes_generators[name].API_PREFIX
+    elif module == "prop":
+        return __classes_props[name].API_PREFIX
+    raise ValueError("Invalid module type: {}".format(module))
+
+# prefix of the labels of the sort key columns added by _keyset_select
+_KEYSET_LABEL = "_keyset_"
+
+def _get_sort_key(query):
+    """
+    Returns the columns of the ``ORDER BY`` clause of a query and whether they
+    are sorted in descending order.
+    """
+    columns = []
+    descending = set()
+    for clause in query._order_by_clauses:
+        columns.append(getattr(clause, "element", clause))
+        descending.add(getattr(clause, "modifier", None) is sa.sql.operators.desc_op)
+    if not columns or len(descending) != 1:
+        raise NotImplementedError("Query continuation requires the results to be sorted in one direction.")
+    return columns, descending.pop()
+
+def _get_unique_keys(table):
+    """
+    Yields the column lists of the primary key and unique indexes of a table
+    or its alias.
+    """
+    yield tuple(table.primary_key.columns)
+    element = getattr(table, "element", table)
+    for index in getattr(element, "indexes", ()):
+        if index.unique:
+            yield tuple(table.corresponding_column(c) for c in index.columns)
+
+def _get_tie_breaker(query, columns):
+    """
+    Returns the primary key columns of the tables selected in a query which
+    have to be appended to the sort key to make it unique. Otherwise the rows
+    with the same key as the last returned row would be skipped by the
+    continued query.
+    """
+    def contains(columns, column):
+        return any(column is c for c in columns)
+
+    def is_unique(table, columns):
+        return any(all(contains(columns, c) for c in key) for key in _get_unique_keys(table))
+
+    def walk(clause):
+        if isinstance(clause, sa.sql.expression.Join):
+            yield from walk(clause.left)
+            # a table joined on its unique key does not add rows
+            equated = []
+            for expr in sa.sql.visitors.iterate(clause.onclause):
+                if isinstance(expr, sa.sql.expression.BinaryExpression) and expr.operator is sa.sql.operators.eq:
+                    equated += [expr.left, expr.right]
+            if not is_unique(clause.right, equated):
+                yield from walk(clause.right)
+        elif isinstance(clause, (sa.Table, sa.sql.expression.Alias)):
+            yield clause
+
+    tie_breaker = []
+    for from_ in query.get_final_froms():
+        for table in walk(from_):
+            if is_unique(table, columns + tie_breaker):
+                continue
+            for column in table.primary_key.columns:
+                if contains(columns + tie_breaker, column):
+                    continue
+                # the grouped queries can be sorted only by the grouped columns
+                if query._group_by_clauses and not contains(query.selected_columns, column):
+                    continue
+                tie_breaker.append(column)
+    return tie_breaker
+
+def _encode_continue(values):
+    return "|".join("" if v is None else format_date(v) if isinstance(v, datetime.datetime) else str(v) for v in values)
+
+def _decode_continue(columns, value):
+    parts = value.split("|")
+    if len(parts) != len(columns):
+        raise ValueError("Invalid value for the continue parameter: {}".format(value))
+    values = []
+    for column, part in zip(columns, parts):
+        type_ = getattr(column.type, "impl_instance", column.type)
+        # NULL values come from the outer joins, e.g. the primary keys of the
+        # joined tables in the tie breaker
+        if part == "":
+            values.append(None)
+        elif isinstance(type_, sa.DateTime):
+            values.append(parse_date(part))
+        elif isinstance(type_, sa.Integer):
+            values.append(int(part))
+        else:
+            values.append(part)
+    return values
+
+def _keyset_select(query, continuation, limit):
+    """
+    Adds the sort key columns, the keyset predicate for the continuation and
+    the limit to a query. One more row than ``limit`` is selected to find out
+    if the query has to be continued.
+
+    :returns: a tuple of the new query and the number of sort key columns
+    """
+    columns, descending = _get_sort_key(query)
+    tie_breaker = _get_tie_breaker(query, columns)
+    if tie_breaker:
+        query = query.order_by(*(c.desc() if descending else c.asc() for c in tie_breaker))
+        columns += tie_breaker
+    value = continuation.get("continue")
+    if value:
+        key = sa.tuple_(*columns)
+        values = sa.tuple_(*(sa.bindparam(None, v, type_=c.type)
+                             for c, v in zip(columns, _decode_continue(columns, value))))
+        if descending:
+            query = query.where(key < values)
+        else:
+            query = query.where(key > values)
+    query = query.add_columns(*(c.label(_KEYSET_LABEL + str(i)) for i, c in enumerate(columns)))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query, len(columns)
+
+def _split_keyset_row(row, key_length):
+    """
+    Splits a row selected by a query from :py:func:`_keyset_select` into the
+    original row mapping and the sort key values.
+    """
+    row = dict(row)
+    key = [row.pop(_KEYSET_LABEL + str(i)) for i in range(key_length)]
+    return row, key
+
+def list(db, params, *, continuation=None, limit=None):
+    """
+    :param dict continuation:
+        If not ``None``, the query is continued with keyset pagination: the
+        rows after the sort key encoded in ``continuation["continue"]`` are
+        selected. When the generator is exhausted, ``continuation["continue"]``
+        holds the value for the next query, or it is deleted if there are no
+        more rows.
+    :param int limit: maximum number of rows to return
+    """
     assert "list" in params
     list = params.pop("list")
     if list not in __classes_lists:
@@ -85,12 +239,30 @@ def list(db, params):
     s.set_defaults(list_params)
     s.sanitize_params(list_params)
     query = s.get_select(list_params)
+    if continuation is None:
+        if limit is not None:
+            query = query.limit(limit)
+        key_length = None
+    else:
+        query, key_length = _keyset_select(query, continuation, limit)
 
     # TODO: some lists like allrevisions should group the results per page like MediaWiki
     result = s.execute_sql(query)
-    for row in result.mappings():
-        yield s.db_to_api(row)
-    result.close()
+    try:
+        count = 0
+        key = None
+        for row in result.mappings():
+            if key_length is not None:
+                if count == limit:
+                    continuation["continue"] = _encode_continue(key)
+                    return
+                row, key = _split_keyset_row(row, key_length)
+            yield s.db_to_api(row)
+            count += 1
+        if continuation is not None:
+            continuation.pop("continue", None)
+    finally:
+        result.close()
 
 def get_pageset(db, titles=None, pageids=None):
     """
@@ -123,6 +295,44 @@ def get_pageset(db, titles=None, pageids=None):
 
     return tail, s, ex
 
+def generator_pageids(db, params, *, continuation=None, limit=None):
+    """
+    Returns the IDs of the pages produced by a generator module, in the order
+    of the generator.
+
+    :param dict continuation: same as for :py:func:`list`
+    :param int limit: maximum number of pages to return
+    """
+    params_copy = params.copy()
+    generator = params_copy.pop("generator")
+    if generator not in __classes_generators:
+        raise NotImplementedError("Module generator={} is not implemented yet.".format(generator))
+    s = __classes_generators[generator](db)
+    generator_params = s.filter_params(params_copy, generator=True)
+    s.set_defaults(generator_params)
+    s.sanitize_params(generator_params)
+    pageset, tail = s.get_pageset(generator_params)
+
+    query = pageset.select_from(tail)
+    if continuation is None:
+        if limit is not None:
+            query = query.limit(limit)
+        result = s.execute_sql(query)
+        pageids = [row.page_id for row in result]
+        result.close()
+        return pageids
+
+    query, key_length = _keyset_select(query, continuation, limit)
+    result = s.execute_sql(query)
+    rows = [_split_keyset_row(row, key_length) for row in result.mappings()]
+    result.close()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        continuation["continue"] = _encode_continue(rows[-1][1])
+    else:
+        continuation.pop("continue", None)
+    return [row["page_id"] for row, key in rows]
+
 def query_pageset(db, params):
     params_copy = params.copy()
 
@@ -90,6 +90,9 @@ class Revisions(SelectBase):
         if "content" in prop:
             tail = tail.outerjoin(self.db.text, rev.c.rev_text_id == self.db.text.c.old_id)
             s = s.column(self.db.text.c.old_text)
+            s = s.column(self.db.text.c.old_flags)
+            s = s.column(self.db.text.c.old_blob)
+            s = s.column(self.db.text.c.old_base_id)
         if "tags" in prop:
             tag = self.db.tag
             tgrev = self.db.tagged_revision
@@ -128,8 +131,7 @@ class Revisions(SelectBase):
 
         return s, tail
 
-    @classmethod
-    def db_to_api(klass, row):
+    def db_to_api(self, row):
         flags = {
             "rev_id": "revid",
             "rev_parent_id": "parentid",
@@ -166,6 +168,9 @@ class Revisions(SelectBase):
             elif key in slot_flags:
                 slot = api_entry.setdefault("slots", {"main": {}})["main"]
                 api_key = slot_flags[key]
+                if key == "old_text":
+                    # the text may be compressed
+                    value = self.db.text_storage.decode(value, row["old_flags"], row["old_blob"], row["old_base_id"])
                 if value is not None:
                     slot[api_key] = value
             elif key in bool_flags:
@@ -199,10 +204,9 @@ class Revisions(SelectBase):
 
         return api_entry
 
-    @classmethod
-    def db_to_api_subentry(klass, page, row):
+    def db_to_api_subentry(self, page, row):
         subentries = page.setdefault("revisions", [])
-        api_entry = klass.db_to_api(row)
+        api_entry = self.db_to_api(row)
         del api_entry["pageid"]
         del api_entry["ns"]
         del api_entry["title"]
@@ -0,0 +1,318 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.db.sync_daemon` module keeps the database synchronized with
+the wiki in a long-running process, see the ``sync-daemon.py`` script.
+
+Instead of running the full :py:func:`ws.db.grabbers.synchronize` chain
+periodically, :py:class:`SyncDaemon` polls the ``list=recentchanges`` API
+module for the changes made since the last poll and runs only the grabbers
+whose tables are affected by them. The polling interval is adaptive: it is
+reset to the minimum after each change and grows exponentially up to the
+maximum while the wiki is idle.
+
+Some events are not recorded in the ``recentchanges`` table on the wiki
+(e.g. changes of the tags of existing revisions, patrol logs or the
+namespace configuration), so the full synchronization is still run
+periodically.
+
+After each synchronization, a notification is sent to the PostgreSQL
+``LISTEN``/``NOTIFY`` channel (``ws_sync`` by default) with a JSON payload
+containing the names of the synchronized grabbers and the timestamp of the
+newest change, so that other processes (e.g. an updater of the parser cache)
+can react to the changes:
+
+.. code-block:: python
+
+    with psycopg.connect(..., autocommit=True) as conn:
+        conn.execute("LISTEN ws_sync")
+        for notify in conn.notifies():
+            payload = json.loads(notify.payload)
+            ...
+"""
+
+import json
+import logging
+import time
+
+import sqlalchemy as sa
+
+from ws.client import API
+from ws.utils import format_date
+from . import grabbers
+from .database import Database
+
+__all__ = ["SyncDaemon", "get_affected_grabbers"]
+
+logger = logging.getLogger(__name__)
+
+# grabbers which are run for any change (all changes are recorded in the
+# recentchanges table and all log events in the logging table)
+COMMON_GRABBERS = {"GrabberRecentChanges", "GrabberLogging"}
+
+# grabbers affected by the recent changes of the given type
+RC_TYPE_GRABBERS = {
+    "edit": {"GrabberPages", "GrabberRevisions"},
+    "new": {"GrabberPages", "GrabberRevisions", "GrabberProtectedTitles"},
+    # categorization of pages is recorded with the edits
+    "categorize": set(),
+    # changes on external sites (e.g. Wikidata)
+    "external": set(),
+}
+
+# grabbers affected by the log events of the given type
+LOG_TYPE_GRABBERS = {
+    "newusers": {"GrabberUsers"},
+    "rights": {"GrabberUsers"},
+    "renameuser": {"GrabberUsers"},
+    "usermerge": {"GrabberUsers", "GrabberUserMerge"},
+    "block": {"GrabberIPBlocks"},
+    "interwiki": {"GrabberInterwiki"},
+    "managetags": {"GrabberTags"},
+    "tag": {"GrabberTags", "GrabberRevisions"},
+    "protect": {"GrabberPages", "GrabberProtectedTitles"},
+    "delete": {"GrabberPages", "GrabberRevisions", "GrabberProtectedTitles"},
+    "suppress": {"GrabberPages", "GrabberRevisions", "GrabberProtectedTitles"},
+    "move": {"GrabberPages", "GrabberRevisions", "GrabberProtectedTitles"},
+    "import": {"GrabberPages", "GrabberRevisions"},
+    "merge": {"GrabberPages", "GrabberRevisions"},
+    "upload": set(),
+    "patrol": set(),
+    "create": set(),
+    "thanks": set(),
+}
+
+def get_affected_grabbers(changes):
+    """
+    Returns the names of the grabbers whose tables have to be updated for the
+    given recent changes. All grabbers are returned for changes of an unknown
+    type.
+
+    :param changes: an iterable of recent changes as returned by the API
+        (with the ``type`` and ``logtype`` properties)
+    :returns: a set of grabber names
+    """
+    names = set()
+    for change in changes:
+        if change["type"] == "log":
+            affected = LOG_TYPE_GRABBERS.get(change.get("logtype"))
+        else:
+            affected = RC_TYPE_GRABBERS.get(change["type"])
+        if affected is None:
+            logger.debug("Unknown change {}, all grabbers will be run".format(change))
+            return set(grabber.__name__ for grabber in grabbers.GRABBERS)
+        names |= COMMON_GRABBERS
+        names |= affected
+    return names
+
+class SyncDaemon:
+    """
+    Keeps the database synchronized with the wiki.
+
+    :param ws.client.api.API api: interface to the remote MediaWiki instance
+    :param ws.db.database.Database db: the database
+    :param float min_interval: minimum polling interval in seconds
+    :param float max_interval: maximum polling interval in seconds
+    :param float backoff: factor of the polling interval after an idle poll
+    :param float full_sync_interval:
+        interval of the full synchronization in seconds (``None`` disables
+        the periodic full synchronization)
+    :param str channel: name of the PostgreSQL notification channel
+        (``None`` disables the notifications)
+    :param bool with_content: whether to synchronize the content of all revisions
+    :param int concurrency: number of grabbers running at the same time
+    """
+
+    def __init__(self, api, db, *, min_interval=5, max_interval=300, backoff=2, full_sync_interval=3600,
+                 channel="ws_sync", with_content=False, concurrency=4):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("invalid polling intervals: {} - {}".format(min_interval, max_interval))
+        if backoff < 1:
+            raise ValueError("backoff must be at least 1")
+        self.api = api
+        self.db = db
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.full_sync_interval = full_sync_interval
+        self.channel = channel
+        self.with_content = with_content
+        self.concurrency = concurrency
+
+        self.interval = min_interval
+        # the newest change synchronized into the database
+        self.last_timestamp = None
+        self.last_rcid = None
+        self.last_full_sync = None
+
+    @staticmethod
+    def set_argparser(argparser):
+        """
+        Add arguments for constructing a :py:class:`SyncDaemon` object to an
+        instance of :py:class:`argparse.ArgumentParser`.
+
+        See also the :py:mod:`ws.config` module.
+
+        :param argparser: an instance of :py:class:`argparse.ArgumentParser`
+        """
+        API.set_argparser(argparser)
+        Database.set_argparser(argparser)
+        group = argparser.add_argument_group(title="Sync daemon parameters")
+        group.add_argument("--sync-daemon-min-interval", metavar="SECONDS", type=float, default=5,
+                help="minimum interval between two polls of the recent changes (default: %(default)s)")
+        group.add_argument("--sync-daemon-max-interval", metavar="SECONDS", type=float, default=300,
+                help="maximum interval between two polls of the recent changes when the wiki is idle (default: %(default)s)")
+        group.add_argument("--sync-daemon-full-sync-interval", metavar="SECONDS", type=float, default=3600,
+                help="interval of the full synchronization of all tables (default: %(default)s)")
+        group.add_argument("--sync-daemon-channel", metavar="NAME", default="ws_sync",
+                help="PostgreSQL channel for the notifications about the synchronized changes (default: %(default)s)")
+        group.add_argument("--sync-daemon-with-content", action="store_true",
+                help="synchronize the content of all revisions")
+        group.add_argument("--sync-daemon-concurrency", metavar="N", type=int, default=4,
+                help="number of grabbers running at the same time (default: %(default)s)")
+
+    @classmethod
+    def from_argparser(klass, args, api=None, db=None):
+        """
+        Construct a :py:class:`SyncDaemon` object from arguments parsed by
+        :py:class:`argparse.ArgumentParser`.
+
+        :param args:
+            an instance of :py:class:`argparse.Namespace`. It is assumed that it
+            contains the arguments set by :py:meth:`SyncDaemon.set_argparser`.
+        :param api: an existing :py:class:`ws.client.api.API` object
+        :param db: an existing :py:class:`ws.db.database.Database` object
+        :returns: an instance of :py:class:`SyncDaemon`
+        """
+        if api is None:
+            api = API.from_argparser(args)
+        if db is None:
+            db = Database.from_argparser(args)
+        return klass(api, db,
+                     min_interval=args.sync_daemon_min_interval,
+                     max_interval=args.sync_daemon_max_interval,
+                     full_sync_interval=args.sync_daemon_full_sync_interval,
+                     channel=args.sync_daemon_channel,
+                     with_content=args.sync_daemon_with_content,
+                     concurrency=args.sync_daemon_concurrency)
+
+    def _load_last_change(self):
+        rc = self.db.recentchanges
+        query = sa.select(sa.func.max(rc.c.rc_timestamp), sa.func.max(rc.c.rc_id))
+        with self.db.engine.connect() as conn:
+            self.last_timestamp, self.last_rcid = conn.execute(query).fetchone()
+
+    def _synchronize(self, only=None):
+        grabbers.synchronize(self.db, self.api, with_content=self.with_content, check_needs_update=False,
+                             concurrency=self.concurrency, only=only)
+
+    def full_sync(self):
+        """
+        Runs all grabbers and sends a notification.
+        """
+        logger.info("Running the full synchronization")
+        self._synchronize()
+        self.last_full_sync = time.monotonic()
+        self._load_last_change()
+        self.notify(set(grabber.__name__ for grabber in grabbers.GRABBERS))
+
+    def get_changes(self):
+        """
+        Returns the list of recent changes on the wiki which are newer than
+        the last synchronized change.
+        """
+        params = {
+            "list": "recentchanges",
+            "rcprop": "ids|timestamp|loginfo",
+            "rclimit": "max",
+            "rcdir": "newer",
+        }
+        if self.last_timestamp is not None:
+            # the start is inclusive, the changes with the same timestamp are
+            # filtered by their ID
+            params["rcstart"] = self.last_timestamp
+        changes = []
+        for change in self.api.list(params):
+            if self.last_rcid is not None and change["rcid"] <= self.last_rcid:
+                continue
+            changes.append(change)
+        return changes
+
+    def poll(self):
+        """
+        Synchronizes the changes made since the last poll.
+
+        :returns: the set of names of the synchronized grabbers (empty if
+            there were no changes)
+        """
+        changes = self.get_changes()
+        if not changes:
+            return set()
+        names = get_affected_grabbers(changes)
+        logger.info("Synchronizing {} new changes: {}".format(len(changes), ", ".join(sorted(names))))
+        self._synchronize(only=names)
+        self.last_timestamp = max(change["timestamp"] for change in changes)
+        self.last_rcid = max(change["rcid"] for change in changes)
+        self.notify(names)
+        return names
+
+    def notify(self, names):
+        """
+        Sends a notification about the synchronized grabbers to the PostgreSQL
+        channel.
+        """
+        if self.channel is None:
+            return
+        payload = {
+            "grabbers": sorted(names),
+            "timestamp": format_date(self.last_timestamp) if self.last_timestamp is not None else None,
+        }
+        with self.db.engine.begin() as conn:
+            conn.execute(sa.select(sa.func.pg_notify(self.channel, json.dumps(payload))))
+
+    def next_interval(self, changed):
+        """
+        Returns the interval until the next poll: the minimum interval after
+        a poll with changes, otherwise the current interval multiplied by the
+        backoff factor, up to the maximum interval.
+        """
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def _full_sync_due(self):
+        if self.last_full_sync is None:
+            return True
+        if self.full_sync_interval is None:
+            return False
+        return time.monotonic() - self.last_full_sync >= self.full_sync_interval
+
+    def run(self, *, iterations=None):
+        """
+        Runs the polling loop.
+
+        :param int iterations:
+            maximum number of polls (``None`` means that the loop runs until
+            it is interrupted)
+        """
+        i = 0
+        while iterations is None or i < iterations:
+            i += 1
+            changed = False
+            try:
+                if self._full_sync_due():
+                    self.full_sync()
+                    changed = True
+                else:
+                    changed = bool(self.poll())
+            except Exception:
+                # the grabbers commit their own transactions and the sync
+                # timestamps, so the next poll continues from the last
+                # successful synchronization
+                logger.exception("The synchronization failed")
+            interval = self.next_interval(changed)
+            if iterations is None or i < iterations:
+                logger.debug("Next poll in {:.1f} seconds".format(interval))
+                time.sleep(interval)
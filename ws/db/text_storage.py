@@ -0,0 +1,437 @@
+#! /usr/bin/env python3
+
+"""
+Transparent compression of the revision text stored in the ``text`` table.
+
+The text is stored either uncompressed in the ``old_text`` column (with empty
+``old_flags``), or compressed with `zstd`_ in the ``old_blob`` column (with
+``old_flags`` set to ``"zstd"``). The compression may use a dictionary trained
+on a sample of the texts (see :py:meth:`TextStorage.train_dictionary`), which
+improves the compression ratio of short texts. The dictionaries are stored in
+the ``ws_text_dictionary`` table and their ID is stored in the header of each
+compressed frame, so the rows compressed with different dictionaries can be
+mixed in the table.
+
+Optionally, the texts of successive revisions of a page can be stored as line
+deltas against the text of the parent revision (``old_flags`` contains
+``"delta"`` and ``old_base_id`` refers to the base text). Every
+``keyframe_interval``-th revision in a chain is stored in full (a *keyframe*),
+so reading a revision requires at most ``keyframe_interval - 1`` deltas to be
+applied. The recently materialized base texts are kept in an LRU cache. The
+deltas are created by :py:class:`TextEncoder` which remembers the recently
+encoded revisions.
+
+Identical texts (e.g. after reverts) are stored only once: the SHA1 hash and
+length of each text are stored in the ``old_sha1`` and ``old_len`` columns and
+:py:class:`TextDeduplicator` finds the existing rows for new revisions.
+
+The compression requires the optional :py:mod:`zstandard` module.
+
+.. _zstd: https://facebook.github.io/zstd/
+"""
+
+import collections
+import datetime
+import difflib
+import hashlib
+import json
+import logging
+import threading
+
+import sqlalchemy as sa
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ["TextStorage", "TextEncoder", "TextDeduplicator", "FLAG_ZSTD", "FLAG_DELTA"]
+
+logger = logging.getLogger(__name__)
+
+#: The flag of texts compressed with zstd.
+FLAG_ZSTD = "zstd"
+#: The flag of texts stored as a delta against the ``old_base_id`` text.
+FLAG_DELTA = "delta"
+
+def make_delta(base, text):
+    """
+    Returns a line delta which transforms ``base`` into ``text``. The delta is
+    a list of ``[start, end]`` pairs, which copy the lines ``start:end`` of
+    the base, and strings, which are inserted literally.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif tag in {"replace", "insert"}:
+            delta.append("".join(lines[j1:j2]))
+    return delta
+
+def apply_delta(base, delta):
+    """
+    Reconstructs the text from ``base`` and a delta created by
+    :py:func:`make_delta`.
+    """
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return "".join(parts)
+
+class TextStorage:
+    """
+    Converts the revision text to and from the values of the ``old_text``,
+    ``old_flags`` and ``old_blob`` columns.
+
+    :param ws.db.database.Database db: the database
+    :param str compression:
+        the compression used for new texts: ``None`` or ``"zstd"``
+    :param int level: the zstd compression level
+    :param int dictionary_id:
+        ID of the dictionary used for the compression of new texts (see
+        :py:meth:`train_dictionary`), or ``None`` to not use a dictionary
+    :param int keyframe_interval:
+        maximum length of a chain of deltas including the keyframe, or
+        ``None`` to store all texts in full (see :py:class:`TextEncoder`)
+    :param int cache_size:
+        number of materialized base texts kept in the LRU cache
+    """
+    def __init__(self, db, *, compression=None, level=3, dictionary_id=None, keyframe_interval=None,
+                 cache_size=128):
+        if compression not in {None, FLAG_ZSTD}:
+            raise ValueError("Unsupported text compression: {}".format(compression))
+        if compression is not None and zstandard is None:
+            raise ImportError("The zstandard module is required for the text compression.")
+        if keyframe_interval is not None and keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be positive")
+        self.db = db
+        self.compression = compression
+        self.level = level
+        self.dictionary_id = dictionary_id
+        self.keyframe_interval = keyframe_interval
+
+        # LRU cache of the materialized base texts, indexed by old_id
+        self._texts = collections.OrderedDict()
+        self._cache_size = cache_size
+
+        # loaded dictionaries, indexed by their ID
+        self._dictionaries = {}
+        self._lock = threading.Lock()
+        # zstd compressors and decompressors cannot be shared by multiple threads
+        self._local = threading.local()
+
+    def _get_dictionary(self, dictionary_id):
+        with self._lock:
+            dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            table = self.db.ws_text_dictionary
+            query = sa.select(table.c.wstd_dictionary).where(table.c.wstd_id == dictionary_id)
+            with self.db.engine.connect() as conn:
+                data = conn.execute(query).scalar()
+            if data is None:
+                raise ValueError("The text compression dictionary {} does not exist in the database.".format(dictionary_id))
+            dictionary = zstandard.ZstdCompressionDict(bytes(data))
+            with self._lock:
+                self._dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+    def _get_compressor(self):
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            dictionary = None
+            if self.dictionary_id is not None:
+                dictionary = self._get_dictionary(self.dictionary_id)
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+            self._local.compressor = compressor
+        return compressor
+
+    def _get_decompressor(self, dictionary_id):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dictionary_id)
+        if decompressor is None:
+            dictionary = None
+            if dictionary_id != 0:
+                dictionary = self._get_dictionary(dictionary_id)
+            decompressor = decompressors[dictionary_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor
+
+    def _compress(self, data):
+        if self.compression is None:
+            return data, []
+        return self._get_compressor().compress(data), [FLAG_ZSTD]
+
+    def _decompress(self, blob):
+        if zstandard is None:
+            raise ImportError("The zstandard module is required to read compressed texts.")
+        blob = bytes(blob)
+        dictionary_id = zstandard.get_frame_parameters(blob).dict_id
+        return self._get_decompressor(dictionary_id).decompress(blob)
+
+    def encode(self, text, *, base_id=None, delta=None):
+        """
+        Returns a dict with the values of the ``old_text``, ``old_flags``,
+        ``old_blob`` and ``old_base_id`` columns for the given text.
+
+        :param int base_id: ID of the base text if ``delta`` is given
+        :param list delta: the delta created by :py:func:`make_delta`
+        """
+        if delta is not None:
+            data = json.dumps(delta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            blob, flags = self._compress(data)
+            flags = [FLAG_DELTA] + flags
+            return {"old_text": None, "old_flags": ",".join(flags), "old_blob": blob, "old_base_id": base_id}
+        if self.compression is None:
+            return {"old_text": text, "old_flags": "", "old_blob": None, "old_base_id": None}
+        blob, flags = self._compress(text.encode("utf-8"))
+        return {"old_text": None, "old_flags": ",".join(flags), "old_blob": blob, "old_base_id": None}
+
+    def decode(self, text, flags, blob, base_id=None):
+        """
+        Returns the text stored in the given values of the ``old_text``,
+        ``old_flags``, ``old_blob`` and ``old_base_id`` columns.
+        """
+        if not flags:
+            return text
+        flags = flags.split(",")
+        unknown = set(flags) - {FLAG_ZSTD, FLAG_DELTA}
+        if unknown:
+            raise ValueError("Unsupported flags of the text: {}".format(",".join(sorted(unknown))))
+
+        data = bytes(blob)
+        if FLAG_ZSTD in flags:
+            data = self._decompress(data)
+        if FLAG_DELTA in flags:
+            delta = json.loads(data.decode("utf-8"))
+            return apply_delta(self.get_text(base_id), delta)
+        return data.decode("utf-8")
+
+    def get_text(self, text_id):
+        """
+        Returns the text with the given ``old_id``. The texts are cached, since
+        they are typically needed as bases of multiple deltas.
+        """
+        with self._lock:
+            text = self._texts.get(text_id)
+            if text is not None:
+                self._texts.move_to_end(text_id)
+                return text
+
+        table = self.db.text
+        query = sa.select(table.c.old_text, table.c.old_flags, table.c.old_blob, table.c.old_base_id) \
+                  .where(table.c.old_id == text_id)
+        with self.db.engine.connect() as conn:
+            row = conn.execute(query).fetchone()
+        if row is None:
+            raise ValueError("The text {} does not exist in the database.".format(text_id))
+        text = self.decode(*row)
+
+        with self._lock:
+            self._texts[text_id] = text
+            while len(self._texts) > self._cache_size:
+                self._texts.popitem(last=False)
+        return text
+
+    def make_encoder(self, **kwargs):
+        """
+        Returns a new :py:class:`TextEncoder` for this storage.
+        """
+        return TextEncoder(self, **kwargs)
+
+    def train_dictionary(self, samples=None, *, sample_count=2000, size=112640):
+        """
+        Trains a zstd dictionary, stores it in the ``ws_text_dictionary`` table
+        and returns its ID. The ID can be then passed as ``dictionary_id`` to
+        the constructor (or the ``--db-text-dictionary`` option).
+
+        :param list samples:
+            the sample texts, or ``None`` to use a random sample of
+            ``sample_count`` texts from the ``text`` table
+        :param int size: the maximum size of the dictionary in bytes
+        """
+        if zstandard is None:
+            raise ImportError("The zstandard module is required for the text compression.")
+        if samples is None:
+            text = self.db.text
+            query = sa.select(text.c.old_text, text.c.old_flags, text.c.old_blob, text.c.old_base_id) \
+                      .order_by(sa.func.random()).limit(sample_count)
+            with self.db.engine.connect() as conn:
+                rows = conn.execute(query).fetchall()
+            samples = [self.decode(*row) for row in rows]
+
+        dictionary = zstandard.train_dictionary(size, [sample.encode("utf-8") for sample in samples])
+        dictionary_id = dictionary.dict_id()
+        entry = {
+            "wstd_id": dictionary_id,
+            "wstd_dictionary": dictionary.as_bytes(),
+            "wstd_timestamp": datetime.datetime.utcnow(),
+        }
+        with self.db.engine.begin() as conn:
+            conn.execute(self.db.ws_text_dictionary.insert(), entry)
+        logger.info("Trained text compression dictionary {} ({} bytes) on {} samples."
+                    .format(dictionary_id, len(entry["wstd_dictionary"]), len(samples)))
+        return dictionary_id
+
+class TextEncoder:
+    """
+    Encodes the texts of revisions for the ``text`` table. When the
+    ``keyframe_interval`` of the storage is set, the text of a revision whose
+    parent was recently encoded by the same encoder is stored as a delta
+    against the text of the parent, unless the chain of deltas would become
+    longer than the interval or the delta is not smaller than the text.
+    Otherwise the text is stored in full.
+
+    The encoded rows have to be written in the same transaction as the rows of
+    their bases, or later. The encoder can be shared by multiple threads; when
+    each thread writes in its own transaction, ``per_thread`` must be set so
+    that the deltas refer only to the texts encoded by the same thread.
+
+    :param TextStorage storage: the storage
+    :param int cache_size: number of recently encoded revisions to remember
+    :param bool per_thread: whether to remember the revisions per thread
+    """
+    def __init__(self, storage, *, cache_size=256, per_thread=False):
+        self.storage = storage
+        self.cache_size = cache_size
+        # recently encoded revisions: rev_id -> (text_id, text, chain length)
+        self._revisions = collections.OrderedDict()
+        self._local = threading.local() if per_thread else None
+        self._lock = threading.Lock()
+
+    def _get_revisions(self):
+        if self._local is None:
+            return self._revisions
+        revisions = getattr(self._local, "revisions", None)
+        if revisions is None:
+            revisions = self._local.revisions = collections.OrderedDict()
+        return revisions
+
+    def encode(self, text, *, text_id, rev_id=None, parent_id=None):
+        """
+        Returns a dict with the values of the ``old_text``, ``old_flags``,
+        ``old_blob`` and ``old_base_id`` columns for the given text.
+
+        :param int text_id: the ``old_id`` of the new text
+        :param int rev_id: ID of the revision
+        :param int parent_id: ID of the parent revision
+        """
+        interval = self.storage.keyframe_interval
+        if interval is None or rev_id is None:
+            return self.storage.encode(text)
+
+        revisions = self._get_revisions()
+        parent = None
+        if parent_id:
+            with self._lock:
+                parent = revisions.get(parent_id)
+
+        entry = None
+        length = 1
+        if parent is not None and parent[2] < interval:
+            base_id, base_text, base_length = parent
+            delta = make_delta(base_text, text)
+            # don't bother if the delta is not smaller than the text
+            if len(json.dumps(delta, ensure_ascii=False)) < len(text):
+                entry = self.storage.encode(text, base_id=base_id, delta=delta)
+                length = base_length + 1
+        if entry is None:
+            entry = self.storage.encode(text)
+
+        with self._lock:
+            revisions[rev_id] = (text_id, text, length)
+            revisions.move_to_end(rev_id)
+            while len(revisions) > self.cache_size:
+                revisions.popitem(last=False)
+        return entry
+
+class TextDeduplicator:
+    """
+    Finds the rows of the ``text`` table with the same content as a new text.
+    The texts are identified by the SHA1 hash and length of their utf-8
+    encoding (see :py:meth:`get_key`), which are stored in the ``old_sha1``
+    and ``old_len`` columns with an index.
+
+    The texts committed in the database are looked up in batches by
+    :py:meth:`prefetch`, the texts stored in the current transaction are
+    remembered by :py:meth:`add`. Like :py:class:`TextEncoder`, the
+    deduplicator can be shared by multiple threads which write in their own
+    transactions if ``per_thread`` is set. The deduplication is best-effort:
+    texts stored at the same time by different transactions (threads or
+    processes) are not visible to each other, so each stores its own copy.
+    The index is not unique, so the copies do not conflict.
+
+    :param ws.db.database.Database db: the database
+    :param bool per_thread: whether to remember the added texts per thread
+    """
+    def __init__(self, db, *, per_thread=False):
+        self.db = db
+        # texts found in the database or added in the transaction: key -> text_id
+        self._texts = {}
+        self._local = threading.local() if per_thread else None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(text):
+        """
+        Returns the key of the given text: a tuple of the hexadecimal SHA1 hash
+        and the length of the utf-8 encoded text.
+        """
+        data = text.encode("utf-8")
+        return hashlib.sha1(data).hexdigest(), len(data)
+
+    def _get_added(self):
+        if self._local is None:
+            return self._texts
+        added = getattr(self._local, "texts", None)
+        if added is None:
+            added = self._local.texts = {}
+        return added
+
+    def prefetch(self, keys):
+        """
+        Looks up the given keys in the database with one query.
+        """
+        added = self._get_added()
+        with self._lock:
+            missing = {key for key in keys if key not in self._texts and key not in added}
+        if not missing:
+            return
+        text = self.db.text
+        query = sa.select(text.c.old_id, text.c.old_sha1, text.c.old_len) \
+                  .where(text.c.old_sha1.in_({sha1 for sha1, length in missing})) \
+                  .order_by(text.c.old_id)
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        with self._lock:
+            for text_id, sha1, length in rows:
+                # the first copy wins if there are duplicates
+                if (sha1, length) in missing:
+                    self._texts.setdefault((sha1, length), text_id)
+
+    def get(self, key):
+        """
+        Returns the ``old_id`` of the text with the given key, or ``None`` if
+        it is not known.
+        """
+        with self._lock:
+            text_id = self._texts.get(key)
+            if text_id is None and self._local is not None:
+                text_id = self._get_added().get(key)
+        return text_id
+
+    def add(self, key, text_id):
+        """
+        Remembers a new text and returns a dict with the values of the
+        ``old_sha1`` and ``old_len`` columns for it.
+        """
+        with self._lock:
+            self._get_added()[key] = text_id
+        return {"old_sha1": key[0], "old_len": key[1]}
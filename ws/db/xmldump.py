@@ -0,0 +1,581 @@
+#! /usr/bin/env python3
+
+"""
+The :py:mod:`ws.db.xmldump` module imports a MediaWiki XML dump, e.g. a
+``pages-meta-history.xml.bz2`` file created by ``dumpBackup.php`` or a file
+from ``Special:Export``, into the database. This is much faster than the
+initial import of the pages and revisions with
+:py:meth:`ws.db.database.Database.sync_with_api` on big wikis.
+
+The dump is parsed incrementally with :py:func:`xml.etree.ElementTree.iterparse`
+and the elements are discarded as soon as they are processed, so the memory
+usage does not depend on the size of the dump. The following tables are
+populated:
+
+- ``namespace``, ``namespace_name`` and ``namespace_starname`` from the
+  ``<siteinfo>`` element (existing rows are not modified),
+- ``page``, ``revision`` and ``text`` from the ``<page>`` elements,
+- ``user`` with the IDs and names of the contributors (existing rows are not
+  modified).
+
+Stub dumps without the revision text are also supported, in that case the
+content can be synchronized later with
+:py:meth:`ws.db.database.Database.sync_revisions_content`.
+
+The dumps do not contain everything that the :py:class:`GrabberPages
+<ws.db.grabbers.page.GrabberPages>` and :py:class:`GrabberRevisions
+<ws.db.grabbers.revision.GrabberRevisions>` grabbers import: the deleted
+revisions (``archive``), the change tags (``tag``, ``tagged_revision`` and
+``tagged_archived_revision``), the page properties and protections
+(``page_props`` and ``page_restrictions``) and ``page.page_lang``. If an API
+is given to the importer, these are fetched in a follow-up pass after the dump
+(see :py:meth:`XMLDumpImporter.gen_insert_from_api`), which is still much
+faster than importing the revisions from the API.
+
+The sync timestamps of both grabbers are set to the timestamp of the newest
+revision in the dump (or an explicit timestamp, e.g. the date of the dump), so
+that the next :py:meth:`sync_with_api <ws.db.database.Database.sync_with_api>`
+fetches only the changes made after the dump. The other grabbers do their
+usual initial import. Without the follow-up pass, the tables listed above
+contain only the changes made after the dump.
+
+Usage:
+
+.. code-block:: python
+
+    importer = XMLDumpImporter(db, api)
+    importer.import_dump("archwiki-20200101-pages-meta-history.xml.bz2")
+
+See also the ``import-dump.py`` script.
+"""
+
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import xml.etree.ElementTree as ET
+
+import sqlalchemy as sa
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import ws.config
+import ws.db.mw_constants as mwconst
+from ws.utils import parse_date
+from ws.db.execution import DeferrableExecutionQueue, CopyExecutionQueue
+from ws.db.grabbers.GrabberBase import GrabberBase
+from ws.db.grabbers.page import GrabberPages
+from ws.db.grabbers.revision import GrabberRevisions
+from ws.db.grabbers.tags import GrabberTags
+from ws.client import API
+from .database import Database
+
+__all__ = ["open_dump", "parse_dump", "XMLDumpImporter"]
+
+logger = logging.getLogger(__name__)
+
+def open_dump(path):
+    """
+    Opens a dump file for reading in binary mode. Files compressed with gzip,
+    bzip2, xz or zstd are decompressed on the fly based on their extension.
+    The zstd decompression requires the optional :py:mod:`zstandard` module.
+
+    :param str path: path to the dump file
+    :returns: a binary file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    elif path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    elif path.endswith(".xz") or path.endswith(".lzma"):
+        return lzma.open(path, "rb")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("The zstandard module is required to read zstd-compressed dumps.")
+        f = open(path, "rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True))
+    return open(path, "rb")
+
+def _local_name(tag):
+    # strip the "{http://www.mediawiki.org/xml/export-0.11/}" namespace
+    return tag.rsplit("}", 1)[-1]
+
+def _children(elem):
+    """
+    Returns a dict mapping the local names of the child elements to the
+    elements (the last one wins for repeated names).
+    """
+    return dict((_local_name(child.tag), child) for child in elem)
+
+def _is_deleted(elem):
+    return elem is not None and elem.get("deleted") == "deleted"
+
+def _sha1_base36_to_hex(value):
+    if not value:
+        return None
+    return "{:040x}".format(int(value, 36))
+
+def _parse_siteinfo(elem):
+    children = _children(elem)
+    siteinfo = {
+        "sitename": children["sitename"].text if "sitename" in children else None,
+        "dbname": children["dbname"].text if "dbname" in children else None,
+        "case": children["case"].text if "case" in children else "first-letter",
+        "namespaces": {},
+    }
+    if "namespaces" in children:
+        for ns in children["namespaces"]:
+            ns_id = int(ns.get("key"))
+            siteinfo["namespaces"][ns_id] = {
+                "id": ns_id,
+                "case": ns.get("case", siteinfo["case"]),
+                "*": ns.text or "",
+            }
+    return siteinfo
+
+def _parse_revision(elem):
+    """
+    Converts a ``<revision>`` element into a dict in the format of the
+    ``revisions`` list of the API, including the ``texthidden``,
+    ``commenthidden`` and ``userhidden`` flags.
+    """
+    children = _children(elem)
+    rev = {
+        "revid": int(children["id"].text),
+        "timestamp": parse_date(children["timestamp"].text),
+    }
+    if "parentid" in children:
+        rev["parentid"] = int(children["parentid"].text)
+    if "minor" in children:
+        rev["minor"] = ""
+
+    contributor = children.get("contributor")
+    if contributor is None or _is_deleted(contributor):
+        rev["userhidden"] = ""
+    else:
+        contributor = _children(contributor)
+        if "username" in contributor:
+            rev["user"] = contributor["username"].text or ""
+            rev["userid"] = int(contributor["id"].text) if "id" in contributor else 0
+        else:
+            rev["user"] = contributor["ip"].text if "ip" in contributor else ""
+            rev["userid"] = 0
+
+    comment = children.get("comment")
+    if _is_deleted(comment):
+        rev["commenthidden"] = ""
+    else:
+        rev["comment"] = (comment.text or "") if comment is not None else ""
+
+    slot = {}
+    if "model" in children:
+        slot["contentmodel"] = children["model"].text
+    if "format" in children:
+        slot["contentformat"] = children["format"].text
+
+    text = children.get("text")
+    size = None
+    if _is_deleted(text):
+        rev["texthidden"] = ""
+    elif text is not None:
+        if text.get("bytes") is not None:
+            size = int(text.get("bytes"))
+        # stub dumps have only the ID of the text in the attributes
+        if text.get("id") is None or text.text is not None:
+            slot["*"] = text.text or ""
+            if size is None:
+                size = len(slot["*"].encode("utf-8"))
+    rev["size"] = size
+    rev["slots"] = {"main": slot}
+
+    sha1 = children.get("sha1")
+    rev["sha1"] = _sha1_base36_to_hex(sha1.text) if sha1 is not None else None
+    return rev
+
+def parse_dump(f):
+    """
+    Parses a MediaWiki XML dump and yields the following events:
+
+    - ``("siteinfo", siteinfo)`` for the ``<siteinfo>`` element, where
+      ``siteinfo`` is a dict with the ``sitename``, ``dbname``, ``case``
+      and ``namespaces`` keys (the namespaces map the namespace numbers to
+      dicts with the ``id``, ``case`` and ``*`` keys like in the API)
+    - ``("revision", page, rev)`` for each ``<revision>`` element, where
+      ``page`` is a dict with the ``pageid``, ``ns`` and ``title`` keys (and
+      ``redirect`` for redirects) and ``rev`` is a dict in the format of the
+      ``revisions`` list of the API
+    - ``("page", page)`` after all revisions of the page
+
+    The same ``page`` dict is passed with all events of the page. The
+    elements are removed from the tree after they are processed, so the
+    memory usage is constant.
+
+    :param f: a binary file object, see :py:func:`open_dump`
+    """
+    root = None
+    # stack of the local names of the open elements
+    path = []
+    page = None
+    page_elem = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            name = _local_name(elem.tag)
+            path.append(name)
+            if path == ["mediawiki", "page"]:
+                page = {}
+                page_elem = elem
+            continue
+
+        name = path.pop()
+        parent = path[-1] if path else None
+        if parent == "mediawiki":
+            if name == "siteinfo":
+                yield "siteinfo", _parse_siteinfo(elem)
+            elif name == "page":
+                yield "page", page
+                page = None
+                page_elem = None
+            root.remove(elem)
+        elif path == ["mediawiki", "page"]:
+            if name == "title":
+                page["title"] = elem.text
+            elif name == "ns":
+                page["ns"] = int(elem.text)
+            elif name == "id":
+                page["pageid"] = int(elem.text)
+            elif name == "redirect":
+                page["redirect"] = ""
+            elif name == "revision":
+                yield "revision", page, _parse_revision(elem)
+                # discard the text as soon as possible
+                page_elem.remove(elem)
+
+class XMLDumpImporter:
+    """
+    Imports the events of :py:func:`parse_dump` into the database.
+
+    :param ws.db.database.Database db: the database
+    :param ws.client.api.API api:
+        interface to the wiki for the follow-up pass (see
+        :py:meth:`gen_insert_from_api`), or ``None`` to skip it
+    :param bool with_content: whether to import the revision text
+    :param int batch_size:
+        number of revisions of a page whose text is looked up in the database
+        with one query (see :py:class:`ws.db.text_storage.TextDeduplicator`)
+    """
+
+    def __init__(self, db, api=None, *, with_content=True, batch_size=1000):
+        self.db = db
+        self.api = api
+        self.with_content = with_content
+        self.batch_size = batch_size
+        # the statements and sync timestamps of the grabbers are reused
+        self.tags = GrabberTags(api, db)
+        self.pages = GrabberPages(api, db)
+        self.revisions = GrabberRevisions(api, db, with_content=with_content)
+        # timestamp of the newest revision in the dump
+        self.newest_timestamp = None
+
+        ins_ns = sa.dialects.postgresql.insert(db.namespace)
+        ins_nsn = sa.dialects.postgresql.insert(db.namespace_name)
+        ins_nss = sa.dialects.postgresql.insert(db.namespace_starname)
+        ins_user = sa.dialects.postgresql.insert(db.user)
+
+        self.sql = {
+            ("insert", "namespace"):
+                ins_ns.on_conflict_do_nothing(),
+            ("insert", "namespace_name"):
+                ins_nsn.on_conflict_do_nothing(),
+            ("insert", "namespace_starname"):
+                ins_nss.on_conflict_do_nothing(),
+            ("insert", "user"):
+                ins_user.on_conflict_do_nothing(),
+        }
+
+    @staticmethod
+    def set_argparser(argparser):
+        """
+        Add arguments for constructing a :py:class:`XMLDumpImporter` object to
+        an instance of :py:class:`argparse.ArgumentParser`.
+
+        See also the :py:mod:`ws.config` module.
+
+        :param argparser: an instance of :py:class:`argparse.ArgumentParser`
+        """
+        API.set_argparser(argparser)
+        Database.set_argparser(argparser)
+        group = argparser.add_argument_group(title="XML dump import parameters")
+        group.add_argument("--dump-file", metavar="PATH", required=True,
+                help="path to the XML dump (optionally compressed with gzip, bzip2, xz or zstd)")
+        group.add_argument("--dump-without-content", action="store_true",
+                help="do not import the revision text from the dump")
+        group.add_argument("--dump-sync-timestamp", metavar="TIMESTAMP", type=ws.config.argtype_datetime,
+                help="timestamp from which the next synchronization with the API starts "
+                     "(default: timestamp of the newest revision in the dump)")
+        group.add_argument("--dump-without-api", action="store_true",
+                help="do not fetch the deleted revisions, change tags, page properties and protections "
+                     "from the API after the dump (they will contain only the changes made after the dump)")
+
+    @classmethod
+    def from_argparser(klass, args, api=None, db=None):
+        """
+        Construct a :py:class:`XMLDumpImporter` object from arguments parsed
+        by :py:class:`argparse.ArgumentParser`.
+
+        :param args:
+            an instance of :py:class:`argparse.Namespace`. It is assumed that it
+            contains the arguments set by :py:meth:`XMLDumpImporter.set_argparser`.
+        :param api: an existing :py:class:`ws.client.api.API` object
+        :param db: an existing :py:class:`ws.db.database.Database` object
+        :returns: an instance of :py:class:`XMLDumpImporter`
+        """
+        if api is None and not args.dump_without_api:
+            api = API.from_argparser(args)
+        if db is None:
+            db = Database.from_argparser(args)
+        return klass(db, api, with_content=not args.dump_without_content)
+
+    def gen_siteinfo(self, siteinfo):
+        for ns in siteinfo["namespaces"].values():
+            ns_entry = {
+                "ns_id": ns["id"],
+                "ns_case": ns["case"],
+                "ns_content": False,
+                "ns_subpages": False,
+                "ns_nonincludable": False,
+                "ns_defaultcontentmodel": None,
+                "ns_protection": None,
+            }
+            yield self.sql["insert", "namespace"], ns_entry
+            yield self.sql["insert", "namespace_name"], {"nsn_id": ns["id"], "nsn_name": ns["*"]}
+            yield self.sql["insert", "namespace_starname"], {"nss_id": ns["id"], "nss_name": ns["*"]}
+
+    def gen_revisions(self, page, revisions):
+        """
+        Yields the queries inserting a batch of revisions of a page, their
+        text and contributors.
+        """
+        if self.with_content is True:
+            self.revisions.prefetch_texts([rev for rev in revisions if "*" in rev["slots"]["main"]])
+
+        for rev in revisions:
+            userid = rev.get("userid", 0)
+            if userid and userid not in self._users:
+                self._users.add(userid)
+                db_entry = {
+                    "user_id": userid,
+                    "user_name": rev["user"],
+                    "user_registration": None,
+                    "user_editcount": None,
+                }
+                yield self.sql["insert", "user"], db_entry
+
+            rev_deleted = 0
+            if "texthidden" in rev:
+                rev_deleted |= mwconst.DELETED_TEXT
+            if "commenthidden" in rev:
+                rev_deleted |= mwconst.DELETED_COMMENT
+            if "userhidden" in rev:
+                rev_deleted |= mwconst.DELETED_USER
+
+            slot = rev["slots"]["main"]
+            db_entry = {
+                "rev_id": rev["revid"],
+                "rev_page": page["pageid"],
+                "rev_text_id": None,
+                "rev_comment": rev.get("comment", ""),
+                "rev_user": userid,
+                "rev_user_text": rev.get("user", ""),
+                "rev_timestamp": rev["timestamp"],
+                "rev_minor_edit": "minor" in rev,
+                "rev_deleted": rev_deleted,
+                "rev_len": rev["size"],
+                "rev_parent_id": rev.get("parentid"),
+                "rev_sha1": rev["sha1"],
+                "rev_content_model": slot.get("contentmodel"),
+                "rev_content_format": slot.get("contentformat"),
+            }
+            if self.with_content is True and "*" in slot:
+                db_entry["rev_text_id"] = yield from self.revisions.gen_text(rev)
+
+            yield self.revisions.sql["insert", "revision"], db_entry
+
+    def gen_page(self, page, latest, count):
+        db_entry = {
+            "page_id": page["pageid"],
+            "page_namespace": page["ns"],
+            "page_title": self._dbtitle(page),
+            "page_is_redirect": "redirect" in page,
+            "page_is_new": count == 1,
+            "page_touched": latest["timestamp"],
+            "page_links_updated": None,
+            "page_latest": latest["revid"],
+            "page_len": latest["size"] or 0,
+            "page_content_model": latest["slots"]["main"].get("contentmodel"),
+            "page_lang": None,
+        }
+        yield self.pages.sql["insert", "page"], db_entry
+
+    def _dbtitle(self, page):
+        # strip the namespace prefix, the local namespace names are used in the dump
+        title = page["title"]
+        ns = self._namespaces.get(page["ns"])
+        if page["ns"] != 0 and ns is not None and title.startswith(ns["*"] + ":"):
+            title = title[len(ns["*"]) + 1:]
+        return title
+
+    def gen_insert(self, events):
+        """
+        Yields the queries inserting the events of :py:func:`parse_dump`.
+        """
+        if self.with_content is True:
+            # one instance for the whole import
+            self.revisions.text_id_gen = self.revisions._get_text_id_gen()
+            self.revisions._new_text_handlers()
+        self._namespaces = {}
+        # IDs of the users inserted in this import
+        self._users = {0}
+
+        # create a user with user_id=0 to satisfy FK contraints (used for
+        # anonymous edits), like GrabberUsers
+        dummy = {
+            "user_id": 0,
+            "user_name": "Anonymous",
+            "user_registration": None,
+            "user_editcount": None,
+        }
+        yield self.sql["insert", "user"], dummy
+
+        batch = []
+        latest = None
+        count = 0
+        pages = 0
+        for event in events:
+            if event[0] == "siteinfo":
+                self._namespaces = event[1]["namespaces"]
+                yield from self.gen_siteinfo(event[1])
+            elif event[0] == "revision":
+                page, rev = event[1:]
+                batch.append(rev)
+                count += 1
+                if latest is None or (rev["timestamp"], rev["revid"]) > (latest["timestamp"], latest["revid"]):
+                    # drop the text, only the metadata is needed for the page
+                    latest = dict(rev, slots={"main": dict((k, v) for k, v in rev["slots"]["main"].items() if k != "*")})
+                if len(batch) >= self.batch_size:
+                    yield from self.gen_revisions(page, batch)
+                    batch = []
+            elif event[0] == "page":
+                page = event[1]
+                if batch:
+                    yield from self.gen_revisions(page, batch)
+                    batch = []
+                if latest is not None:
+                    yield from self.gen_page(page, latest, count)
+                    if self.newest_timestamp is None or latest["timestamp"] > self.newest_timestamp:
+                        self.newest_timestamp = latest["timestamp"]
+                latest = None
+                count = 0
+                pages += 1
+                if pages % 10000 == 0:
+                    logger.info("Imported {} pages from the dump".format(pages))
+
+    def gen_insert_from_api(self, sync_timestamp):
+        """
+        Yields the queries of the follow-up pass which fetches the data that
+        is not contained in the dump from the API:
+
+        - all change tags,
+        - the properties, protections and languages of all pages (the pages
+          are updated to their current state),
+        - all deleted revisions with their tags and contributors,
+        - the tags of the revisions up to ``sync_timestamp``.
+
+        The newer revisions are imported by the next synchronization. The
+        generator must be run after :py:meth:`gen_insert`, the contributors
+        of the deleted revisions are added to the users from the dump.
+
+        :param datetime.datetime sync_timestamp:
+            timestamp from which the next synchronization with the API starts
+        """
+        # the tags are needed by the tagged_revision and tagged_archived_revision inserts
+        yield from self.tags.gen_insert()
+        yield from self.pages.gen_insert()
+
+        # alldeletedrevisions cannot be limited by timestamp, see GrabberRevisions.gen_insert_unsharded
+        for page in self.api.list(self.revisions.adr_params, stream=self.with_content):
+            for rev in page["revisions"]:
+                if rev["userid"] not in self._users:
+                    self._users.add(rev["userid"])
+                    db_entry = {
+                        "user_id": rev["userid"],
+                        "user_name": rev["user"],
+                        "user_registration": None,
+                        "user_editcount": None,
+                    }
+                    yield self.sql["insert", "user"], db_entry
+            yield from self.revisions.gen_deletedrevisions(page)
+
+        params = {
+            "list": "allrevisions",
+            "arvprop": "ids|tags",
+            "arvlimit": "max",
+            "arvdir": "newer",
+            "arvend": sync_timestamp,
+        }
+        for page in self.api.list(params):
+            for rev in page["revisions"]:
+                for tag_name in rev.get("tags", []):
+                    db_entry = {
+                        "b_rev_id": rev["revid"],
+                        "b_tag_name": tag_name,
+                    }
+                    yield self.revisions.sql["insert", "tagged_revision"], db_entry
+
+    def import_dump(self, path, *, sync_timestamp=None):
+        """
+        Imports the dump in one transaction, runs the follow-up pass (see
+        :py:meth:`gen_insert_from_api`) if the importer has an API and sets
+        the sync timestamps of the page and revision grabbers.
+
+        :param str path: path to the dump file, see :py:func:`open_dump`
+        :param datetime.datetime sync_timestamp:
+            timestamp from which the next synchronization with the API starts
+            (the timestamp of the newest revision in the dump is used by
+            default)
+        """
+        with open_dump(path) as f:
+            with self.db.engine.begin() as conn:
+                if self.db.bulk_load is True:
+                    # the text table is read by the deduplication on another connection
+                    queue = CopyExecutionQueue(conn, self.db.chunk_size, defer_indexes=["page", "revision"])
+                else:
+                    queue = DeferrableExecutionQueue(conn, self.db.chunk_size)
+                with queue as dfe:
+                    for item in self.gen_insert(parse_dump(f)):
+                        GrabberBase._execute_item(dfe, item)
+
+                if sync_timestamp is None:
+                    sync_timestamp = self.newest_timestamp
+                if sync_timestamp is None:
+                    logger.warning("The dump does not contain any revisions, the sync timestamps are not set.")
+                    return
+
+                if self.api is None:
+                    logger.warning("No API was given, the deleted revisions, change tags, page properties "
+                                   "and protections will contain only the changes made after the dump.")
+                else:
+                    logger.info("Fetching the data missing in the dump from the API")
+                    # the tables are not empty anymore, so COPY cannot be used
+                    with DeferrableExecutionQueue(conn, self.db.chunk_size) as dfe:
+                        for item in self.gen_insert_from_api(sync_timestamp):
+                            GrabberBase._execute_item(dfe, item)
+
+                self.pages._set_sync_timestamp(sync_timestamp, conn)
+                self.revisions._set_sync_timestamp(sync_timestamp, conn)
+        logger.info("Imported the dump {}, the next synchronization will start from {}".format(path, sync_timestamp))
@@ -9,6 +9,7 @@ from .json import *
 from .lazy import *
 from .OrderedSet import *
 from .rate import *
+from .timestamps import *
 from .TLSAdapter import *
 
 # test if given string is ASCII
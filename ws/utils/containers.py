@@ -3,7 +3,7 @@
 import bisect
 import datetime
 
-from .datetime_ import parse_date, format_date
+from .datetime_ import format_date
 
 class ListOfDictsAttrWrapper(object):
     """ A list-like wrapper around list of dicts, operating on a given attribute.
@@ -60,7 +60,10 @@ def dmerge(source, destination):
     """
     if not isinstance(source, dict) or not isinstance(destination, dict):
         raise TypeError("both 'source' and 'destination' must be of type 'dict'")
-    for key, value in source.items():
+    for key in source:
+        # access the values by key to let lazy dicts (e.g.
+        # ws.utils.timestamps.LazyTimestampDict) convert them
+        value = source[key]
         if isinstance(value, dict):
             node = destination.setdefault(key, {})
             dmerge(value, node)
@@ -104,38 +107,6 @@ def gen_nested_values(indict, keys=None):
     else:
         yield keys, indict
 
-def parse_timestamps_in_struct(struct):
-    """
-    Convert all timestamps in a nested structure from str to
-    datetime.datetime.
-    """
-    def set_ts(struct, keys, value):
-        for k in keys[:-1]:
-            struct = struct[k]
-        struct[keys[-1]] = value
-
-    for keys, value in gen_nested_values(struct):
-        if isinstance(value, str):
-            # skip fields which are not timestamps (e.g. user=infinity)
-            _strkeys = "".join(str(k) for k in keys)
-            if "timestamp" not in _strkeys and "registration" not in _strkeys and "expiry" not in _strkeys and "touched" not in _strkeys:
-                continue
-
-            if value.lower() == "infinity" or value.lower() == "infinite":
-                set_ts(struct, keys, datetime.datetime.max)
-            elif value.lower() == "-infinity":
-                set_ts(struct, keys, datetime.datetime.min)
-            elif value.lower() == "indefinite":
-                set_ts(struct, keys, None)
-            elif (len(value) == 20 and value[4] == "-" and value[7] == "-" and
-                    value[10] == "T" and value[13] == ":" and value[16] == ":"
-                    and value[19] == "Z"):
-                try:
-                    ts = parse_date(value)
-                except ValueError:
-                    continue
-                set_ts(struct, keys, ts)
-
 def serialize_timestamps_in_struct(struct):
     """
     Convert all timestamps in a nested structure from str to
@@ -24,17 +24,40 @@ Or at runtime by wrapping the function call:
 
     # allow at most 10 calls in 2 seconds
     wrapped = RateLimited(10, 2)(PrintNumber)
+
+:py:class:`RateLimiter` is a limiter object which can be shared by multiple
+threads, :py:mod:`asyncio` tasks and even processes. It is used by the
+:py:class:`ws.client.connection.Connection` class to limit the rate of HTTP
+requests per action class (e.g. ``read``, ``write`` or ``edit``) and to back
+off when the server signals that it is overloaded.
+
+.. code-block:: python
+
+    limiter = RateLimiter({"read": (10, 2), "edit": (1, 3)})
+    limiter.acquire("read")
+    ...
+    # the server responded with "Retry-After: 5"
+    limiter.backoff(5)
 """
 
 from functools import wraps
+import asyncio
+import contextlib
+import json
+import threading
 import time
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import ws
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["RateLimited"]
+__all__ = ["RateLimited", "TokenBucket", "RateLimiter"]
 
 def RateLimited(rate, per):
     def decorator(func):
@@ -73,6 +96,208 @@ def RateLimited(rate, per):
     return decorator
 
 
+class TokenBucket:
+    """
+    A token bucket which is refilled at the rate of ``rate`` tokens per
+    ``per`` seconds up to the capacity of ``burst`` tokens.
+
+    The bucket supports additive-increase/multiplicative-decrease adaptation
+    of the refill rate: :py:meth:`decrease` is called when the server signals
+    an overload and :py:meth:`increase` after successful requests. The
+    configured rate is never exceeded.
+
+    The bucket itself is not synchronized, see :py:class:`RateLimiter`.
+
+    :param rate: number of tokens per the period
+    :param per: length of the period in seconds
+    :param burst: capacity of the bucket (default: ``rate``)
+    """
+
+    # the adapted rate never drops below this fraction of the configured rate
+    MIN_RATE_FRACTION = 0.05
+    # additive increase of the rate after each success, as a fraction of the configured rate
+    INCREASE_FRACTION = 0.05
+
+    def __init__(self, rate, per, burst=None):
+        if rate <= 0 or per <= 0:
+            raise ValueError("rate and per must be positive")
+        self.max_rate = rate / per
+        self.rate = self.max_rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.tokens = self.burst
+        self.last = None
+
+    def reserve(self, now, tokens=1):
+        """
+        Takes tokens from the bucket and returns the time in seconds for which
+        the caller has to wait before proceeding. The balance of the bucket may
+        become negative, so that concurrent callers wait in turns.
+
+        :param float now: the current time in seconds
+        :param tokens: number of tokens to take
+        :returns: the waiting time in seconds
+        """
+        if self.last is not None and now > self.last:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = max(now, self.last or now)
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def decrease(self, factor=0.5):
+        """
+        Multiplicatively decreases the refill rate.
+        """
+        self.rate = max(self.max_rate * self.MIN_RATE_FRACTION, self.rate * factor)
+
+    def increase(self):
+        """
+        Additively increases the refill rate up to the configured rate.
+        """
+        self.rate = min(self.max_rate, self.rate + self.max_rate * self.INCREASE_FRACTION)
+
+    def get_state(self):
+        return {"tokens": self.tokens, "last": self.last, "rate": self.rate}
+
+    def set_state(self, state):
+        self.tokens = state["tokens"]
+        self.last = state["last"]
+        self.rate = min(self.max_rate, state["rate"])
+
+class RateLimiter:
+    """
+    Thread-safe rate limiter with a :py:class:`TokenBucket` per action class.
+
+    The limiter can be shared by multiple processes through a lock file: the
+    state of the buckets is stored in the file and updated under an exclusive
+    :py:func:`fcntl.flock` lock. In that case the clock must be the wall
+    clock, i.e. :py:func:`time.time`.
+
+    :param dict rates:
+        mapping of action classes to ``(rate, per)`` tuples, which are merged
+        with :py:attr:`DEFAULT_RATES`
+    :param str lock_file: path to the file used for sharing the state
+    :param clock: function returning the current time in seconds
+    :param sleep: function used for sleeping in :py:meth:`acquire`
+    """
+
+    DEFAULT_RATES = {
+        "read": (10, 3),
+        "write": (10, 3),
+        "edit": (1, 3),
+    }
+
+    def __init__(self, rates=None, *, lock_file=None, clock=time.time, sleep=time.sleep):
+        if lock_file is not None and fcntl is None:
+            raise NotImplementedError("sharing the rate limiter state through a lock file is not supported on this platform")
+        _rates = self.DEFAULT_RATES.copy()
+        _rates.update(rates or {})
+        self.buckets = dict((cls, TokenBucket(rate, per)) for cls, (rate, per) in _rates.items())
+        self.blocked_until = 0
+        self.lock_file = lock_file
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if self.lock_file is None:
+                yield
+                return
+            with open(self.lock_file, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    data = f.read()
+                    if data:
+                        state = json.loads(data)
+                        self.blocked_until = state["blocked_until"]
+                        for cls, bucket_state in state["buckets"].items():
+                            if cls in self.buckets:
+                                self.buckets[cls].set_state(bucket_state)
+                    yield
+                    state = {
+                        "blocked_until": self.blocked_until,
+                        "buckets": dict((cls, bucket.get_state()) for cls, bucket in self.buckets.items()),
+                    }
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve(self, rate_class="read"):
+        """
+        Takes a token for the given action class and returns the time in
+        seconds for which the caller has to wait before making the request.
+
+        :param str rate_class: the action class
+        :returns: the waiting time in seconds
+        """
+        with self._locked_state():
+            now = self._clock()
+            delay = self.buckets[rate_class].reserve(now)
+            return max(delay, self.blocked_until - now)
+
+    def acquire(self, rate_class="read"):
+        """
+        Blocks until a request of the given action class can be made.
+
+        :param str rate_class: the action class
+        :returns: the time spent sleeping in seconds
+        """
+        delay = self.reserve(rate_class)
+        if delay > 0:
+            logger.debug("rate limit for '{}' requests exceeded, sleeping for {:0.3f} seconds".format(rate_class, delay))
+            self._sleep(delay)
+        return delay
+
+    async def acquire_async(self, rate_class="read"):
+        """
+        Asynchronous variant of :py:meth:`acquire`.
+        """
+        delay = self.reserve(rate_class)
+        if delay > 0:
+            logger.debug("rate limit for '{}' requests exceeded, sleeping for {:0.3f} seconds".format(rate_class, delay))
+            await asyncio.sleep(delay)
+        return delay
+
+    def backoff(self, delay, rate_class=None):
+        """
+        Blocks all requests for ``delay`` seconds and decreases the rate of the
+        given action class (or all classes if ``rate_class`` is ``None``).
+
+        This should be called when the server signals an overload, e.g. with
+        the ``Retry-After`` header or with the ``maxlag`` error.
+
+        :param float delay: the time in seconds
+        :param str rate_class: the action class
+        """
+        with self._locked_state():
+            self.blocked_until = max(self.blocked_until, self._clock() + delay)
+            classes = [rate_class] if rate_class is not None else list(self.buckets)
+            for cls in classes:
+                self.buckets[cls].decrease()
+        logger.info("backing off for {:0.3f} seconds".format(delay))
+
+    def success(self, rate_class="read"):
+        """
+        Signals a successful request of the given action class, which lets the
+        rate recover after a previous :py:meth:`backoff`.
+
+        :param str rate_class: the action class
+        """
+        bucket = self.buckets[rate_class]
+        # avoid locking the shared state if there is nothing to recover
+        if self.lock_file is None and bucket.rate >= bucket.max_rate:
+            return
+        with self._locked_state():
+            bucket.increase()
+
+
 if __name__ == "__main__":
     # wrap 'print' in rate limiting
     wrapped = RateLimited(10, 2)(print)
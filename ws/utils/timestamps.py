@@ -0,0 +1,216 @@
+#! /usr/bin/env python3
+
+"""
+Conversion of timestamps in API responses from strings to
+:py:class:`datetime.datetime` objects.
+
+Timestamps are recognized by the keys under which they are stored. By default,
+a string is considered a timestamp candidate if any key on its path in the
+structure contains one of the :py:data:`TIMESTAMP_WORDS`. For the most common
+API modules, :py:func:`get_timestamp_keys` returns the exact set of keys which
+carry timestamps, so that all other strings (notably the page content) are
+skipped without being inspected.
+"""
+
+import datetime
+
+from .datetime_ import parse_date
+
+__all__ = ["TIMESTAMP_WORDS", "TIMESTAMP_KEYS", "get_timestamp_keys", "parse_timestamp",
+           "parse_timestamps_in_struct", "LazyTimestampDict", "wrap_timestamps"]
+
+#: Substrings of the keys which may hold timestamps in an arbitrary API response.
+TIMESTAMP_WORDS = ("timestamp", "registration", "expiry", "touched")
+
+#: Mapping of API query modules to the keys holding timestamps in their
+#: output. Modules which are not listed here are handled with the generic rule
+#: based on :py:data:`TIMESTAMP_WORDS`.
+TIMESTAMP_KEYS = {
+    # list modules
+    "allpages": frozenset(),
+    "alldeletedrevisions": frozenset({"timestamp"}),
+    "allrevisions": frozenset({"timestamp"}),
+    "allusers": frozenset({"registration", "expiry", "blockexpiry", "blockedtimestamp"}),
+    "backlinks": frozenset(),
+    "blocks": frozenset({"timestamp", "expiry"}),
+    "categorymembers": frozenset({"timestamp"}),
+    "embeddedin": frozenset(),
+    "protectedtitles": frozenset({"timestamp", "expiry"}),
+    "usercontribs": frozenset({"timestamp"}),
+    "users": frozenset({"registration", "expiry", "blockexpiry", "blockedtimestamp"}),
+    # prop modules
+    "categories": frozenset({"timestamp"}),
+    "deletedrevisions": frozenset({"timestamp"}),
+    "langlinks": frozenset(),
+    "links": frozenset(),
+    "pageprops": frozenset(),
+    "redirects": frozenset(),
+    "revisions": frozenset({"timestamp"}),
+    "templates": frozenset(),
+    # meta modules
+    "tokens": frozenset(),
+    "userinfo": frozenset({"registrationdate", "expiry", "blockexpiry", "blockedtimestamp"}),
+}
+
+# keys which may appear at the top level of any query response
+_COMMON_KEYS = frozenset({"curtimestamp"})
+
+# cache of the results of the generic rule for each key
+_generic_match_cache = {}
+
+def _generic_match(key):
+    match = _generic_match_cache.get(key)
+    if match is None:
+        match = isinstance(key, str) and any(word in key for word in TIMESTAMP_WORDS)
+        _generic_match_cache[key] = match
+    return match
+
+def _split(value):
+    if value is None:
+        return set()
+    if isinstance(value, str):
+        return set(value.split("|")) - {""}
+    return set(value)
+
+def get_timestamp_keys(params):
+    """
+    Returns the set of keys holding timestamps in the response to an API
+    query with the given parameters.
+
+    :param dict params: API parameters
+    :returns:
+        a :py:class:`frozenset` of keys, or ``None`` if the keys are not known
+        and the generic rule has to be used
+    """
+    if params.get("action") != "query":
+        return None
+    modules = _split(params.get("list")) | _split(params.get("prop")) | _split(params.get("meta"))
+    keys = set(_COMMON_KEYS)
+    for module in modules:
+        if module not in TIMESTAMP_KEYS:
+            return None
+        keys |= TIMESTAMP_KEYS[module]
+    return frozenset(keys)
+
+# marker for strings which are not timestamps
+_NOT_A_TIMESTAMP = object()
+
+def _convert(value):
+    lower = value.lower()
+    if lower == "infinity" or lower == "infinite":
+        return datetime.datetime.max
+    elif lower == "-infinity":
+        return datetime.datetime.min
+    elif lower == "indefinite":
+        return None
+    elif (len(value) == 20 and value[4] == "-" and value[7] == "-" and
+            value[10] == "T" and value[13] == ":" and value[16] == ":"
+            and value[19] == "Z"):
+        try:
+            return parse_date(value)
+        except ValueError:
+            pass
+    return _NOT_A_TIMESTAMP
+
+def parse_timestamp(value):
+    """
+    Converts a timestamp string from the API into a :py:class:`datetime.datetime`
+    object. The special values ``infinity`` and ``-infinity`` are converted to
+    :py:attr:`datetime.datetime.max` and :py:attr:`datetime.datetime.min`,
+    ``indefinite`` is converted to ``None``. Other strings are returned as is.
+    """
+    ts = _convert(value)
+    if ts is _NOT_A_TIMESTAMP:
+        return value
+    return ts
+
+def _parse_struct(struct, match, matched):
+    if isinstance(struct, dict):
+        for key, value in struct.items():
+            key_matched = matched or match(key)
+            if isinstance(value, str):
+                if key_matched:
+                    ts = _convert(value)
+                    if ts is not _NOT_A_TIMESTAMP:
+                        struct[key] = ts
+            elif isinstance(value, (dict, list)):
+                _parse_struct(value, match, key_matched)
+    elif isinstance(struct, list):
+        for i, value in enumerate(struct):
+            if isinstance(value, str):
+                if matched:
+                    ts = _convert(value)
+                    if ts is not _NOT_A_TIMESTAMP:
+                        struct[i] = ts
+            elif isinstance(value, (dict, list)):
+                _parse_struct(value, match, matched)
+
+def parse_timestamps_in_struct(struct, keys=None):
+    """
+    Convert all timestamps in a nested structure from str to
+    datetime.datetime.
+
+    A string is converted if it is a valid timestamp (see
+    :py:func:`parse_timestamp`) and any key on its path matches. The values
+    under non-matching keys are not inspected at all.
+
+    :param struct: a nested structure of dicts and lists
+    :param keys:
+        a set of keys holding timestamps (see :py:func:`get_timestamp_keys`),
+        or ``None`` to match the keys containing any of the
+        :py:data:`TIMESTAMP_WORDS`
+    """
+    match = _generic_match if keys is None else keys.__contains__
+    _parse_struct(struct, match, False)
+
+class LazyTimestampDict(dict):
+    """
+    A :py:class:`dict` which converts the timestamps stored under the keys in
+    ``timestamp_keys`` on the first access by :py:meth:`__getitem__` or
+    :py:meth:`get`. Other ways of accessing the values (e.g.
+    :py:meth:`items`) return the raw strings.
+
+    Use :py:func:`wrap_timestamps` to create the wrappers for a whole
+    structure.
+    """
+    __slots__ = ("timestamp_keys",)
+
+    def __init__(self, data, timestamp_keys):
+        super().__init__(data)
+        self.timestamp_keys = timestamp_keys
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, str) and key in self.timestamp_keys:
+            ts = _convert(value)
+            if ts is not _NOT_A_TIMESTAMP:
+                self[key] = ts
+                return ts
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+def wrap_timestamps(struct, keys=None):
+    """
+    Returns a copy of the nested structure with all dicts replaced by
+    :py:class:`LazyTimestampDict` wrappers, so that the timestamps are
+    converted only when they are accessed. Unlike
+    :py:func:`parse_timestamps_in_struct`, only the keys which directly hold
+    the timestamp strings are matched.
+
+    :param struct: a nested structure of dicts and lists
+    :param keys: same as for :py:func:`parse_timestamps_in_struct`
+    """
+    if isinstance(struct, dict):
+        if keys is None:
+            timestamp_keys = frozenset(key for key in struct if _generic_match(key))
+        else:
+            timestamp_keys = keys
+        return LazyTimestampDict(((key, wrap_timestamps(value, keys)) for key, value in struct.items()),
+                                 timestamp_keys)
+    elif isinstance(struct, list):
+        return [wrap_timestamps(value, keys) for value in struct]
+    return struct